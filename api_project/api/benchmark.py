@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the API on a mix of requests.
+
+The mix is either recorded, as the json lines of the ``profiling``
+logger (see ``api.profiling``), or synthetic: politician searches,
+institution charges filtered by date, parliamentarians, votes,
+locations and city mayors, with ids and names read from the
+databases (see ``synthetic_mix``).
+
+Requests are replayed one at a time, through the Django test client
+or against a running server (``ClientTransport``, ``ServerTransport``),
+and summarized per endpoint (the name of the url): latency percentiles,
+throughput, queries per request and peak RSS of the serving process.
+
+Summaries are json documents, that ``compare`` checks against
+the summary of a baseline run::
+
+    {
+        "meta": {"transport": "client", "requests": 1000, "seconds": 12.3, "throughput": 81.3, ...},
+        "endpoints": {
+            "politici:politician-list": {
+                "count": 200, "errors": 0, "mean": 10.2, "p50": 9.8, "p95": 14.1, "p99": 20.5,
+                "throughput": 98.0, "queries": 5.0, "max_queries": 5, "peak_rss": 81234, "rss_growth": 120
+            },
+            ...
+        }
+    }
+
+Latencies are in milliseconds, RSS in kilobytes.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+import json
+import random
+import re
+import resource
+import sys
+import time
+import urllib2
+
+from django.core.urlresolvers import resolve, reverse, Resolver404
+from django.test.client import Client
+from django.utils.datastructures import SortedDict
+
+from api.testing import CaptureAllQueriesContext
+
+__author__ = 'guglielmo'
+
+
+Request = namedtuple('Request', ['endpoint', 'path', 'query_string'])
+
+
+def get_endpoint(path):
+    """Name of the url of a path (with its namespace), or None"""
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return None
+
+
+def load_recording(lines):
+    """
+    Read the GET requests from the json lines of the ``profiling``
+    logger (anything before the json, as a log prefix, is skipped).
+    """
+    requests = []
+    for line in lines:
+        start = line.find('{')
+        if start < 0:
+            continue
+        try:
+            data = json.loads(line[start:])
+        except ValueError:
+            continue
+        if data.get('method') != 'GET' or 'path' not in data:
+            continue
+        endpoint = get_endpoint(data['path'])
+        if endpoint is not None:
+            requests.append(Request(endpoint, data['path'], data.get('query_string', '')))
+    return requests
+
+
+# share of each kind of request in the synthetic mix
+MIX_WEIGHTS = (
+    ('politician-search', 20),
+    ('instcharge-dates', 20),
+    ('parliamentarian-detail', 15),
+    ('vote-detail', 15),
+    ('location-list', 10),
+    ('location-detail', 5),
+    ('city-mayors', 15),
+)
+
+
+def synthetic_mix(size=1000, legislatura=18, seed=1, sample_size=5000):
+    """
+    Return ``size`` requests, of the kinds of ``MIX_WEIGHTS``,
+    on the politicians, charges, locations, parliamentarians and votes
+    in the databases (the first ``sample_size`` of each, by id).
+    """
+    from parlamento import lex
+    from parlamento.models import Politico, Votazione
+    from politici.models import OpPolitician
+    from territori.models import OpLocation
+
+    rnd = random.Random(seed)
+    database = lex.get_legislatura(legislatura).database
+    last_names = list(OpPolitician.objects.using('politici').order_by('pk').
+                      values_list('last_name', flat=True)[:sample_size])
+    cities = list(OpLocation.objects.using('politici').filter(location_type_id=OpLocation.CITY_TYPE_ID).
+                  order_by('pk').values_list('pk', flat=True)[:sample_size])
+    locations = list(OpLocation.objects.using('politici').order_by('pk').values_list('pk', 'name')[:sample_size])
+    parliamentarians = list(Politico.objects.using(database).order_by('pk').
+                            values_list('pk', flat=True)[:sample_size])
+    votes = list(Votazione.objects.using(database).order_by('pk').values_list('pk', flat=True)[:sample_size])
+
+    def random_date():
+        return (date(1995, 1, 1) + timedelta(days=rnd.randint(0, 20 * 365))).isoformat()
+
+    def politician_search():
+        name = rnd.choice(last_names)
+        if rnd.random() < 0.5:
+            query_string = 'namestartswith={0}'.format(urllib2.quote(name[:3].encode('utf-8')))
+        else:
+            query_string = 'namecontains={0}'.format(urllib2.quote(name.encode('utf-8')))
+        return reverse('politici:politician-list'), query_string
+
+    def instcharge_dates():
+        params = rnd.choice(('date={0}', 'started_after={0}', 'closed_after={0}', 'status=a&date={0}'))
+        location = '&location_id={0}'.format(rnd.choice(cities)) if cities and rnd.random() < 0.5 else ''
+        return reverse('politici:instcharge-list'), params.format(random_date()) + location
+
+    def location_list():
+        return reverse('territori:location-list'), 'namestartswith={0}'.format(
+            urllib2.quote(rnd.choice(locations)[1][:4].encode('utf-8'))
+        )
+
+    kinds = {
+        'politician-search': (politician_search, last_names),
+        'instcharge-dates': (instcharge_dates, True),
+        'parliamentarian-detail': (lambda: (reverse('parlamento:parlamentare-detail', kwargs={
+            'legislatura': legislatura, 'politician_id': rnd.choice(parliamentarians)}), ''), parliamentarians),
+        'vote-detail': (lambda: (reverse('parlamento:votazione-detail', kwargs={
+            'legislatura': legislatura, 'votazione': rnd.choice(votes)}), ''), votes),
+        'location-list': (location_list, locations),
+        'location-detail': (lambda: (reverse('territori:location-detail', kwargs={
+            'pk': rnd.choice(locations)[0]}), ''), locations),
+        'city-mayors': (lambda: (reverse('politici:city-mayors', kwargs={
+            'location_id': rnd.choice(cities)}), ''), cities),
+    }
+    # kinds without data in the databases are left out
+    weights = [(kind, weight) for kind, weight in MIX_WEIGHTS if kinds[kind][1]]
+    if not weights:
+        return []
+    total = sum(weight for kind, weight in weights)
+
+    requests = []
+    for _ in range(size):
+        n = rnd.uniform(0, total)
+        for kind, weight in weights:
+            n -= weight
+            if n <= 0:
+                break
+        path, query_string = kinds[kind][0]()
+        requests.append(Request(get_endpoint(path), path, query_string))
+    return requests
+
+
+def get_content(response):
+    # large lists are streamed (see api.mixins.StreamingRenderMixin)
+    if getattr(response, 'streaming', False):
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+class ClientTransport(object):
+    """
+    Requests served in this process, by the Django test client;
+    queries are counted on all the databases.
+    """
+    name = 'client'
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, request):
+        """Return the status, the seconds and the number of queries of the request"""
+        path = '{0}?{1}'.format(request.path, request.query_string) if request.query_string else request.path
+        with CaptureAllQueriesContext() as context:
+            start = time.time()
+            response = self.client.get(path, HTTP_ACCEPT='application/json')
+            get_content(response)
+            seconds = time.time() - start
+        return response.status_code, seconds, len(context)
+
+    def peak_rss(self):
+        """Peak RSS of this process, in kilobytes"""
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on OS X, kilobytes elsewhere
+        return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+server_timing_queries = re.compile(r'desc="(\d+) queries"')
+
+
+class ServerTransport(object):
+    """
+    Requests to a running server, at ``base_url``;
+    queries are read from the ``Server-Timing`` header (when profiling
+    is enabled, and the benchmark runs from ``INTERNAL_IPS``), and the peak RSS of the server process ``pid``
+    from ``/proc`` (Linux only).
+    """
+
+    def __init__(self, base_url, pid=None):
+        self.base_url = base_url.rstrip('/')
+        self.name = self.base_url
+        self.pid = pid
+
+    def request(self, request):
+        url = self.base_url + request.path
+        if request.query_string:
+            url = '{0}?{1}'.format(url, request.query_string)
+        start = time.time()
+        try:
+            response = urllib2.urlopen(urllib2.Request(url, headers={'Accept': 'application/json'}))
+        except urllib2.HTTPError, e:
+            response = e
+        response.read()
+        seconds = time.time() - start
+
+        server_timing = response.info().getheader('Server-Timing')
+        queries = None
+        if server_timing is not None:
+            queries = sum(int(n) for n in server_timing_queries.findall(server_timing))
+        return response.getcode(), seconds, queries
+
+    def peak_rss(self):
+        if self.pid is None:
+            return None
+        try:
+            with open('/proc/{0}/status'.format(self.pid)) as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except EnvironmentError:
+            pass
+        return None
+
+
+def percentile(values, p):
+    """The p-th percentile of the values, with linear interpolation"""
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def run(requests, transport, warmup=0, logger=None):
+    """
+    Replay the requests, after the first ``warmup`` ones (not measured),
+    and return the summary of the run.
+    """
+    for request in requests[:warmup]:
+        transport.request(request)
+
+    measures = SortedDict()
+    start = time.time()
+    rss = transport.peak_rss()
+    for n, request in enumerate(requests[warmup:], 1):
+        status, seconds, queries = transport.request(request)
+        measure = measures.setdefault(request.endpoint, {
+            'latencies': [], 'queries': [], 'errors': 0, 'peak_rss': None, 'rss_growth': 0,
+        })
+        measure['latencies'].append(seconds)
+        if queries is not None:
+            measure['queries'].append(queries)
+        if status >= 500:
+            measure['errors'] += 1
+        # the peak RSS only grows: its growth is charged to the request that caused it
+        last_rss, rss = rss, transport.peak_rss()
+        if rss is not None:
+            measure['peak_rss'] = max(measure['peak_rss'], rss)
+            measure['rss_growth'] += rss - (last_rss or rss)
+        if logger and n % 100 == 0:
+            logger.info(u"{0} requests".format(n))
+    seconds = time.time() - start
+
+    endpoints = SortedDict()
+    for endpoint, measure in sorted(measures.items()):
+        latencies = measure['latencies']
+        queries = measure['queries']
+        endpoints[endpoint] = SortedDict([
+            ('count', len(latencies)),
+            ('errors', measure['errors']),
+            ('mean', round(sum(latencies) / len(latencies) * 1000, 2)),
+            ('p50', round(percentile(latencies, 50) * 1000, 2)),
+            ('p95', round(percentile(latencies, 95) * 1000, 2)),
+            ('p99', round(percentile(latencies, 99) * 1000, 2)),
+            ('throughput', round(len(latencies) / sum(latencies), 2) if sum(latencies) else None),
+            ('queries', round(float(sum(queries)) / len(queries), 2) if queries else None),
+            ('max_queries', max(queries) if queries else None),
+            ('peak_rss', measure['peak_rss']),
+            ('rss_growth', measure['rss_growth'] if measure['peak_rss'] is not None else None),
+        ])
+
+    count = len(requests) - min(warmup, len(requests))
+    return SortedDict([
+        ('meta', SortedDict([
+            ('transport', transport.name),
+            ('started_at', time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start))),
+            ('requests', count),
+            ('warmup', min(warmup, len(requests))),
+            ('seconds', round(seconds, 3)),
+            ('throughput', round(count / seconds, 2) if seconds else None),
+        ])),
+        ('endpoints', endpoints),
+    ])
+
+
+def compare(summary, baseline, tolerance=0.2, min_latency=5.0):
+    """
+    Return the regressions of a run against a baseline, as messages:
+    latency percentiles, queries per request and peak RSS of the
+    endpoints of both runs more than ``tolerance`` (a share) over the
+    baseline, latencies by at least ``min_latency`` milliseconds too,
+    and any new errors.
+    """
+    regressions = []
+    for endpoint, current in summary['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is None:
+            continue
+        for key, floor in (('p50', min_latency), ('p95', min_latency), ('p99', min_latency),
+                           ('queries', 0), ('peak_rss', 0)):
+            value, base = current.get(key), previous.get(key)
+            if value is None or base is None:
+                continue
+            if value > base * (1 + tolerance) and value - base >= floor:
+                regressions.append(u'{0}: {1} {2}, baseline {3}'.format(endpoint, key, value, base))
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(u'{0}: {1} errors, baseline {2}'.format(
+                endpoint, current['errors'], previous.get('errors', 0)
+            ))
+    return regressions
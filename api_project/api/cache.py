@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the rendered responses of the read-only API views
+(see ``api.mixins.ResponseCacheMixin``).
+
+Entries are keyed by the scheme, host, path, sorted query parameters
+and negotiated media type of the request, and by the *watermark*
+of the data the view reads (see ``api.watermarks``): when the data
+changes, so does the watermark, and the old entries are never read
+again. They are dropped from the backend as soon as a new watermark
+of their namespace (the database, usually) is seen, or they expire
+after ``TIMEOUT`` seconds.
+
+Rebuilds are single-flight: while a response is being built,
+concurrent requests for the same key wait for it (``WAIT_TIMEOUT``
+seconds at most), instead of running the same queries.
+
+The cache is configured by the ``RESPONSE_CACHE`` setting::
+
+    RESPONSE_CACHE = {
+        'BACKEND': 'api.cache.LRUBackend',
+        'OPTIONS': {'max_entries': 1000, 'max_size': 64 * 1024 * 1024},
+        'TIMEOUT': 3600,
+        'WAIT_TIMEOUT': 30,
+        'MAX_ENTRY_SIZE': 8 * 1024 * 1024,
+    }
+
+Backends are ``LRUBackend`` (in-process), ``FileBackend`` (files in a
+local directory, shared by the processes) and ``DjangoCacheBackend``
+(a django cache, e.g. memcached). Hits, misses, waits and stores
+are counted in ``response_cache.stats``, and each response
+has a ``X-Cache: HIT|MISS`` header.
+"""
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.utils.module_loading import import_by_path
+
+__author__ = 'guglielmo'
+
+
+class LRUBackend(object):
+    """
+    In-process cache, evicting the least recently used entries
+    when there are more than ``max_entries``, or their contents
+    take more than ``max_size`` bytes.
+    """
+
+    def __init__(self, max_entries=1000, max_size=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, item_key):
+        expires, entry, size = self._entries.pop(item_key)
+        self.size -= size
+        return expires, entry
+
+    def get(self, namespace, key):
+        with self._lock:
+            if (namespace, key) not in self._entries:
+                return None
+            expires, entry = self._pop((namespace, key))
+            if expires < time.time():
+                return None
+            # the entry is moved to the end, as the most recently used
+            self._entries[(namespace, key)] = (expires, entry, len(entry[2]))
+            self.size += len(entry[2])
+            return entry
+
+    def set(self, namespace, key, entry, timeout):
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._pop((namespace, key))
+            self._entries[(namespace, key)] = (time.time() + timeout, entry, len(entry[2]))
+            self.size += len(entry[2])
+            while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_size):
+                self._pop(next(iter(self._entries)))
+
+    def clear(self, namespace=None):
+        with self._lock:
+            for item_key in list(self._entries):
+                if namespace is None or item_key[0] == namespace:
+                    self._pop(item_key)
+
+
+class FileBackend(object):
+    """
+    Entries stored as pickled files, in a directory for each namespace;
+    files are written to a temporary name and then renamed,
+    so that readers never see partial entries.
+    """
+
+    def __init__(self, location):
+        self.location = location
+
+    def get_path(self, namespace, key):
+        return os.path.join(self.location, namespace, key)
+
+    def get(self, namespace, key):
+        try:
+            with open(self.get_path(namespace, key), 'rb') as f:
+                expires, entry = pickle.load(f)
+        except IOError:
+            return None
+        if expires < time.time():
+            return None
+        return entry
+
+    def set(self, namespace, key, entry, timeout):
+        path = self.get_path(namespace, key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time() + timeout, entry), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self, namespace=None):
+        shutil.rmtree(self.location if namespace is None else os.path.join(self.location, namespace),
+                      ignore_errors=True)
+
+
+class DjangoCacheBackend(object):
+    """
+    Entries stored in a django cache; as django caches can not
+    be cleared by prefix, entries of old watermarks just expire.
+    """
+
+    def __init__(self, cache_alias='default'):
+        self.cache = get_cache(cache_alias)
+
+    @staticmethod
+    def get_key(namespace, key):
+        return 'response:{0}:{1}'.format(namespace, key)
+
+    def get(self, namespace, key):
+        return self.cache.get(self.get_key(namespace, key))
+
+    def set(self, namespace, key, entry, timeout):
+        self.cache.set(self.get_key(namespace, key), entry, timeout)
+
+    def clear(self, namespace=None):
+        pass
+
+
+class ResponseCache(object):
+    """
+    Cache of the (status, headers, content) of the responses,
+    on the backend configured by ``RESPONSE_CACHE``.
+    """
+    counters = ('hits', 'misses', 'waits', 'stores', 'invalidations', 'errors')
+
+    def __init__(self):
+        self.stats = dict((name, 0) for name in self.counters)
+        self._config = None
+        self._backend = None
+        self._watermarks = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return getattr(settings, 'RESPONSE_CACHE', None)
+
+    @property
+    def enabled(self):
+        return bool(self.config)
+
+    @property
+    def backend(self):
+        """
+        The backend, built when first used, or when the setting changes.
+        """
+        config = self.config
+        with self._lock:
+            if self._config is not config:
+                backend_class = import_by_path(config.get('BACKEND', 'api.cache.LRUBackend'))
+                self._backend = backend_class(**config.get('OPTIONS', {}))
+                self._config = config
+                self._watermarks.clear()
+            return self._backend
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def get_key(watermark, key):
+        return hashlib.sha1('{0!r} {1}'.format(watermark, key)).hexdigest()
+
+    def check_watermark(self, namespace, watermark):
+        """
+        Drop the entries of the namespace, when its watermark changes.
+        """
+        backend = self.backend
+        with self._lock:
+            changed = self._watermarks.setdefault(namespace, watermark) != watermark
+            self._watermarks[namespace] = watermark
+        if changed:
+            self.count('invalidations')
+            backend.clear(namespace)
+
+    def get(self, namespace, key):
+        try:
+            return self.backend.get(namespace, key)
+        except Exception:
+            # a broken cache must not break the responses
+            self.count('errors')
+            return None
+
+    def set(self, namespace, key, entry):
+        try:
+            self.backend.set(namespace, key, entry, self.config.get('TIMEOUT', 3600))
+            self.count('stores')
+        except Exception:
+            self.count('errors')
+
+    def clear(self, namespace=None):
+        self.backend.clear(namespace)
+        with self._lock:
+            self._watermarks.clear()
+
+    @staticmethod
+    def make_response(entry, state):
+        status, headers, content = entry
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response['X-Cache'] = state
+        return response
+
+    def fetch(self, namespace, watermark, key, build):
+        """
+        Return the cached response for the key, in the namespace,
+        at the given watermark, or build and store it by calling ``build``.
+        """
+        self.check_watermark(namespace, watermark)
+        key = self.get_key(watermark, key)
+        entry = self.get(namespace, key)
+        if entry is not None:
+            self.count('hits')
+            return self.make_response(entry, 'HIT')
+
+        # single flight: the first request builds the response,
+        # the others wait for it
+        with self._lock:
+            flight = self._flights.get((namespace, key))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(namespace, key)] = threading.Event()
+        if not leader:
+            self.count('waits')
+            flight.wait(self.config.get('WAIT_TIMEOUT', 30))
+            entry = self.get(namespace, key)
+            if entry is not None:
+                self.count('hits')
+                return self.make_response(entry, 'HIT')
+            # the leader failed, or its response could not be stored
+            with self._lock:
+                if self._flights.get((namespace, key)) is flight:
+                    del self._flights[(namespace, key)]
+
+        def land():
+            if leader:
+                with self._lock:
+                    if self._flights.get((namespace, key)) is flight:
+                        del self._flights[(namespace, key)]
+                flight.set()
+
+        self.count('misses')
+        try:
+            response = build()
+        except Exception:
+            land()
+            raise
+        return self.store(namespace, key, response, land)
+
+    def store(self, namespace, key, response, land):
+        """
+        Store the content of a successful response, rendering it,
+        then call ``land``; streaming responses are stored
+        (and ``land`` is called) when their content has been sent.
+        """
+        if response.status_code != 200 or response.has_header('Set-Cookie'):
+            land()
+            return response
+
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        headers = [(header, value) for header, value in response.items()]
+        response['X-Cache'] = 'MISS'
+        max_size = self.config.get('MAX_ENTRY_SIZE', 8 * 1024 * 1024)
+
+        if not getattr(response, 'streaming', False):
+            try:
+                if len(response.content) <= max_size:
+                    self.set(namespace, key, (response.status_code, headers, response.content))
+            finally:
+                land()
+            return response
+
+        def tee(chunks):
+            content, size = [], 0
+            # ``land`` is also called when the response is closed, as the
+            # content may never be iterated (e.g. for HEAD requests)
+            try:
+                for chunk in chunks:
+                    if content is not None:
+                        size += len(chunk)
+                        if size <= max_size:
+                            content.append(chunk)
+                        else:
+                            content = None
+                    yield chunk
+                if content is not None:
+                    self.set(namespace, key, (response.status_code, headers, b''.join(content)))
+            finally:
+                land()
+
+        response.streaming_content = ClosingIterator(tee(response.streaming_content), land)
+        return response
+
+
+class ClosingIterator(object):
+    """
+    Iterates over ``iterable``, and calls ``callback`` when closed.
+
+    Streamed responses are closed when served, even when their content
+    is never iterated (e.g. for HEAD requests, whose content is dropped):
+    the ``finally`` clause of a generator that was never started
+    is not run, so the callback is used for the cleanup that must happen.
+    """
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            callback, self.callback = self.callback, None
+            if callback is not None:
+                callback()
+
+
+response_cache = ResponseCache()
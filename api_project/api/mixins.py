@@ -1,7 +1,23 @@
 # -*- coding: utf-8 -*-
-from django.http import Http404
+import base64
+import hashlib
+import json
+import time
+from urllib import urlencode
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.datastructures import SortedDict
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.exceptions import NotAcceptable, ParseError
 from rest_framework.mixins import ListModelMixin
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+from api.cache import response_cache
 
 class ShortListModelMixin(ListModelMixin):
     """
@@ -38,3 +54,303 @@ class ShortListModelMixin(ListModelMixin):
             ]
 
         return Response(serializer.data)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Adds an opt-in keyset (cursor) pagination mode to a list view.
+
+    When the ``cursor`` querystring parameter is present (even empty),
+    results are sorted by the key returned by ``get_cursor_key`` plus
+    the primary key, and each page is fetched by seeking past the last
+    seen key, instead of using an OFFSET; no COUNT(*) is performed.
+
+    The response contains opaque ``next`` and ``previous`` cursors urls,
+    and the ``results`` list.
+    """
+    cursor_query_param = 'cursor'
+
+    # (field, descending) couple used to sort the results
+    cursor_key = ('pk', False)
+
+    def get_cursor_key(self):
+        return self.cursor_key
+
+    def list(self, request, *args, **kwargs):
+        if self.cursor_query_param not in request.QUERY_PARAMS:
+            return super(KeysetPaginationMixin, self).list(request, *args, **kwargs)
+
+        field, descending = self.get_cursor_key()
+        page_size = self.get_paginate_by() or api_settings.PAGINATE_BY
+        queryset = self.filter_queryset(self.get_queryset())
+
+        token = request.QUERY_PARAMS.get(self.cursor_query_param)
+        position = self.decode_cursor(token, field) if token else None
+
+        # a reverse cursor walks the inverted ordering, then flips the page
+        reverse = position is not None and position[0]
+        walk_descending = descending != reverse
+        ordering = (field, 'pk')
+        if walk_descending:
+            ordering = tuple('-' + f for f in ordering)
+        queryset = queryset.order_by(*ordering)
+
+        if position is not None:
+            queryset = queryset.filter(
+                self._seek_condition(field, walk_descending, position[1], position[2])
+            )
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        next_url = previous_url = None
+        if rows:
+            if has_more or reverse:
+                next_url = self.get_cursor_url(field, rows[-1], False)
+            if position is not None and (has_more or not reverse):
+                previous_url = self.get_cursor_url(field, rows[0], True)
+
+        serializer = self.get_serializer(rows, many=True)
+        return Response(SortedDict([
+            ('next', next_url),
+            ('previous', previous_url),
+            ('results', serializer.data),
+        ]))
+
+    @staticmethod
+    def _seek_condition(field, descending, value, pk):
+        """
+        Build the condition selecting rows strictly after (value, pk),
+        in the given direction.
+        NULL values are sorted first in ascending order and last
+        in descending order, as MySQL does.
+        """
+        op = 'lt' if descending else 'gt'
+        after_pk = Q(**{'pk__{0}'.format(op): pk})
+        is_null = Q(**{'{0}__isnull'.format(field): True})
+        if value is None:
+            if descending:
+                return is_null & after_pk
+            return (is_null & after_pk) | Q(**{'{0}__isnull'.format(field): False})
+
+        condition = Q(**{'{0}__{1}'.format(field, op): value}) | (Q(**{field: value}) & after_pk)
+        if descending:
+            condition |= is_null
+        return condition
+
+    def get_cursor_url(self, field, obj, reverse):
+        value = obj
+        for attr in field.split('__'):
+            value = getattr(value, attr) if value is not None else None
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+
+        token = base64.urlsafe_b64encode(json.dumps([field, int(reverse), value, obj.pk]))
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, token
+        )
+
+    def decode_cursor(self, token, field):
+        """
+        Return the (reverse, value, pk) position encoded in the cursor.
+        """
+        try:
+            cursor_field, reverse, value, pk = json.loads(base64.urlsafe_b64decode(str(token)))
+        except (TypeError, ValueError):
+            raise ParseError('Invalid cursor: {0}'.format(token))
+        if cursor_field != field:
+            raise ParseError('Cursor does not match the requested ordering')
+        return bool(reverse), value, pk
+
+
+class StreamingRenderMixin(object):
+    """
+    Sends large lists as a streaming (chunked) response, encoded
+    incrementally by renderers that implement ``iter_render``
+    (see ``api.render.JSONLDRenderer``), instead of building
+    the whole content in memory.
+
+    Responses are streamed when the list, or its ``results``,
+    has at least ``STREAMING_RENDER_MIN_ITEMS`` items.
+    """
+
+    @staticmethod
+    def count_items(data):
+        if isinstance(data, dict):
+            data = data.get('results', None)
+        if isinstance(data, (list, tuple)):
+            return len(data)
+        return 0
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(StreamingRenderMixin, self).finalize_response(request, response, *args, **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if not isinstance(response, Response) or response.exception or response.status_code != 200 or \
+                not hasattr(renderer, 'iter_render'):
+            return response
+
+        min_items = getattr(settings, 'STREAMING_RENDER_MIN_ITEMS', 500)
+        if min_items is None or self.count_items(response.data) < min_items:
+            return response
+
+        # same content type of the rendered response
+        content_type = response.content_type or renderer.media_type
+        if response.content_type is None and renderer.charset is not None:
+            content_type = '{0}; charset={1}'.format(renderer.media_type, renderer.charset)
+
+        streaming_response = StreamingHttpResponse(
+            renderer.iter_render(response.data, response.accepted_media_type, response.renderer_context),
+            status=response.status_code,
+            content_type=content_type
+        )
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                streaming_response[header] = value
+        return streaming_response
+
+
+class ResponseCacheMixin(object):
+    """
+    Serves GET requests from the response cache (see ``api.cache``).
+
+    Views tell the namespace (the database) and the watermark of their data,
+    with ``get_response_cache_namespace`` and ``get_response_cache_watermark``;
+    requests are not cached when the namespace is None, or when
+    the negotiated format is not among ``response_cache_formats``
+    (e.g. the browsable API, that shows the user).
+    """
+    cache_responses = True
+    response_cache_formats = ('json', )
+
+    def get_response_cache_namespace(self):
+        return None
+
+    def get_response_cache_watermark(self):
+        return None
+
+    def get_response_cache_key(self, request, *args, **kwargs):
+        """
+        Return the key of the request: url, with the sorted query parameters,
+        and negotiated media type; None if its format is not cached.
+        """
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        try:
+            renderer, media_type = self.perform_content_negotiation(self.initialize_request(request))
+        except NotAcceptable:
+            return None
+        if renderer.format not in self.response_cache_formats:
+            return None
+
+        # parameters are sorted by name, keeping the order of repeated values
+        query = urlencode(sorted((
+            (name.encode('utf-8'), value.encode('utf-8'))
+            for name, values in request.GET.lists() for value in values
+        ), key=lambda item: item[0]))
+        return '{0}://{1}{2}?{3} {4}'.format(
+            'https' if request.is_secure() else 'http', request.get_host(), request.path, query, media_type
+        )
+
+    def get_response_cache_params(self, request, *args, **kwargs):
+        """
+        Return the (namespace, watermark, key) of a GET request,
+        or None if it is not cached; computed once per request.
+        """
+        if not hasattr(self, '_response_cache_params'):
+            self._response_cache_params = None
+            if self.cache_responses and request.method in ('GET', 'HEAD'):
+                # the view reads the request and its arguments, to tell the namespace
+                self.request, self.args, self.kwargs = request, args, kwargs
+                try:
+                    namespace = self.get_response_cache_namespace()
+                    key = namespace and self.get_response_cache_key(request, *args, **kwargs)
+                    if key is not None:
+                        self._response_cache_params = namespace, self.get_response_cache_watermark(), key
+                except Http404:
+                    # answered by the view
+                    pass
+        return self._response_cache_params
+
+    def dispatch(self, request, *args, **kwargs):
+        params = response_cache.enabled and self.get_response_cache_params(request, *args, **kwargs)
+        if not params:
+            return super(ResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+
+        namespace, watermark, key = params
+        return response_cache.fetch(
+            namespace, watermark, key,
+            lambda: super(ResponseCacheMixin, self).dispatch(request, *args, **kwargs)
+        )
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """
+    Tell if the resource, with the given ETag (not quoted) and last
+    modification timestamp, is not modified for a conditional GET request.
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag is not None and (etag in etags or '*' in etags)
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return last_modified is not None and if_modified_since is not None and \
+        int(last_modified) <= if_modified_since
+
+
+def set_validators(response, etag=None, last_modified=None, max_age=None):
+    """Add the ETag, Last-Modified and Cache-Control headers to a response"""
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if max_age is not None:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+class ConditionalGetMixin(ResponseCacheMixin):
+    """
+    Conditional GET for the cached views (see ``ResponseCacheMixin``).
+
+    The ETag of a response is computed from the key of the request
+    and the watermark of the data, and its Last-Modified date from
+    the watermark, when it is a date; as both are known before running
+    the view, ``If-None-Match`` and ``If-Modified-Since`` requests
+    are answered with 304 Not Modified, without querying
+    or serializing anything.
+
+    ``Cache-Control`` lifetimes are given by ``get_cache_max_age``,
+    according to how often the data change.
+    """
+    cache_max_age = None
+
+    def get_cache_max_age(self):
+        return self.cache_max_age
+
+    def get_last_modified(self, watermark):
+        """
+        Return the timestamp of the last modification of the data, or None.
+        """
+        if hasattr(watermark, 'timetuple'):
+            return time.mktime(watermark.timetuple())
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        params = self.get_response_cache_params(request, *args, **kwargs)
+        if not params:
+            return super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+
+        namespace, watermark, key = params
+        etag = hashlib.sha1('{0!r} {1!r} {2}'.format(namespace, watermark, key)).hexdigest()
+        last_modified = self.get_last_modified(watermark)
+        if is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return set_validators(response, etag, last_modified, self.get_cache_max_age())
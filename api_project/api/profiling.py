@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+Request profiling and query instrumentation.
+
+``ProfilingMiddleware`` records, for each request:
+
+* the time spent in the view (``view``), split into queries (``sql``)
+  and the rest, mostly serialization (``serialize``), and the time
+  spent rendering the response (``render``), of which rewriting
+  the JSON-LD keys (``ld``, see ``api.render``),
+* the number and time of the queries on each database alias,
+* the slowest query, with its EXPLAIN when it took more than
+  ``PROFILING_EXPLAIN_THRESHOLD`` seconds,
+
+and sends them:
+
+* in the ``Server-Timing`` header of the responses to staff users
+  and ``INTERNAL_IPS``,
+* as a json line on the ``profiling`` logger (that can be replayed
+  by the benchmarks, see ``api.benchmark``),
+* to the in-process ``metrics``, exposed by the ``metrics`` view
+  (Prometheus text format, or json with ``?format=json``),
+  with latency histograms per view class.
+
+Streamed responses are timed until their content has been sent,
+so their ``Server-Timing`` header does not contain the ``stream`` phase.
+
+Staff users can profile a request with cProfile by adding
+``?profile`` (``PROFILING_QUERY_PARAM``) to its url: the response
+is replaced by the profiler stats, sorted by cumulative time.
+A share ``PROFILING_SAMPLE_RATE`` of all requests is profiled,
+and the stats are saved in ``PROFILING_DIR``.
+"""
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import StringIO
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.datastructures import SortedDict
+
+from api.cache import ClosingIterator
+
+__author__ = 'guglielmo'
+
+
+logger = logging.getLogger('profiling')
+
+_local = threading.local()
+
+
+def get_current_profile():
+    """Return the profile of the request being served by this thread, or None"""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to a phase of the current request"""
+    profile = get_current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile.add(phase, time.time() - start)
+
+
+def get_view_name(view_func):
+    """Name of the view class (of the function, for function views)"""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        return '{0}.{1}'.format(view_class.__module__, view_class.__name__)
+    return '{0}.{1}'.format(view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+
+def explain(alias, sql):
+    """
+    Return the plan of a query, as a list of rows, or an error message.
+    Queries are logged with their parameters interpolated,
+    so the plan can not be computed for some of them.
+    """
+    connection = connections[alias]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + sql)
+        return [[unicode(value) for value in row] for row in cursor.fetchall()]
+    except Exception, e:
+        return u'EXPLAIN failed: {0}'.format(e)
+
+
+class RequestProfile(object):
+    """
+    Timings and queries of a request.
+
+    Queries are read from ``connection.queries``: the debug cursor
+    is forced on all aliases while the request is served.
+    """
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.path
+        self.query_string = request.META.get('QUERY_STRING', '')
+        self.start = time.time()
+        self.view_name = None
+        self.view_start = self.view_end = None
+        self.status = None
+        self.finished = False
+        self.phases = SortedDict()
+        self.queries = SortedDict()
+        self.slowest = None
+        self._query_marks = {}
+        self._debug_cursors = {}
+        for alias in connections:
+            connection = connections[alias]
+            self._debug_cursors[alias] = connection.use_debug_cursor
+            self._query_marks[alias] = len(connection.queries)
+            connection.use_debug_cursor = True
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def collect_queries(self):
+        """
+        Read the queries run so far by the request, per alias.
+        """
+        self.queries = SortedDict()
+        self.slowest = None
+        for alias in connections:
+            queries = connections[alias].queries[self._query_marks.get(alias, 0):]
+            if not queries:
+                continue
+            timings = [float(q['time']) for q in queries]
+            self.queries[alias] = {'count': len(queries), 'time': sum(timings)}
+            slowest = max(range(len(queries)), key=timings.__getitem__)
+            if self.slowest is None or timings[slowest] > self.slowest['time']:
+                self.slowest = {'alias': alias, 'time': timings[slowest], 'sql': queries[slowest]['sql']}
+
+        self.phases['sql'] = sum(q['time'] for q in self.queries.values())
+        if self.view_start is not None and self.view_end is not None:
+            self.phases['view'] = self.view_end - self.view_start
+            self.phases['serialize'] = max(self.phases['view'] - self.phases['sql'], 0)
+
+    def close(self):
+        """
+        Restore the cursors, and explain the slowest query
+        when it took more than ``PROFILING_EXPLAIN_THRESHOLD`` seconds.
+        """
+        for alias in connections:
+            connections[alias].use_debug_cursor = self._debug_cursors.get(alias, None)
+
+        threshold = getattr(settings, 'PROFILING_EXPLAIN_THRESHOLD', 0.5)
+        if self.slowest is not None and self.slowest['time'] >= threshold and \
+                self.slowest['sql'].lstrip().upper().startswith('SELECT'):
+            self.slowest['explain'] = explain(self.slowest['alias'], self.slowest['sql'])
+
+    @property
+    def duration(self):
+        return self.phases.get('total', time.time() - self.start)
+
+    def server_timing(self):
+        """Value of the Server-Timing header"""
+        metrics = ['{0};dur={1:.1f}'.format(phase, seconds * 1000) for phase, seconds in self.phases.items()]
+        for alias, queries in self.queries.items():
+            metrics.append('db-{0};dur={1:.1f};desc="{2} queries"'.format(
+                alias, queries['time'] * 1000, queries['count']
+            ))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return SortedDict([
+            ('method', self.method),
+            ('path', self.path),
+            ('query_string', self.query_string),
+            ('view', self.view_name),
+            ('status', self.status),
+            ('duration', round(self.duration, 4)),
+            ('phases', SortedDict((phase, round(seconds, 4)) for phase, seconds in self.phases.items())),
+            ('queries', self.queries),
+            ('slowest_query', self.slowest),
+        ])
+
+
+class Metrics(object):
+    """
+    Latency histograms, errors and queries per view, and queries per alias,
+    aggregated in the process.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+            self.aliases = {}
+
+    def get_buckets(self):
+        if self.buckets is not None:
+            return self.buckets
+        return getattr(settings, 'PROFILING_BUCKETS', (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+    def record(self, profile):
+        buckets = self.get_buckets()
+        name = profile.view_name or 'unresolved'
+        duration = profile.duration
+        with self._lock:
+            view = self.views.get(name)
+            if view is None:
+                view = self.views[name] = {
+                    'count': 0, 'errors': 0, 'sum': 0.0, 'buckets': [0] * len(buckets),
+                    'queries': 0, 'sql_time': 0.0, 'slowest_query': None,
+                }
+            view['count'] += 1
+            view['sum'] += duration
+            if profile.status >= 500:
+                view['errors'] += 1
+            for n, bound in enumerate(buckets):
+                if duration <= bound:
+                    view['buckets'][n] += 1
+            for alias, queries in profile.queries.items():
+                view['queries'] += queries['count']
+                view['sql_time'] += queries['time']
+                totals = self.aliases.setdefault(alias, {'count': 0, 'time': 0.0})
+                totals['count'] += queries['count']
+                totals['time'] += queries['time']
+            slowest = profile.slowest
+            if slowest is not None and (view['slowest_query'] is None or
+                                        slowest['time'] > view['slowest_query']['time']):
+                view['slowest_query'] = slowest
+
+    def as_dict(self):
+        with self._lock:
+            return SortedDict([
+                ('buckets', list(self.get_buckets())),
+                ('views', SortedDict(sorted(self.views.items()))),
+                ('aliases', SortedDict(sorted(self.aliases.items()))),
+            ])
+
+    def prometheus(self):
+        """Metrics in the Prometheus text format"""
+        from api.cache import response_cache
+
+        data = self.as_dict()
+        lines = [
+            '# HELP api_request_duration_seconds Duration of the requests, by view.',
+            '# TYPE api_request_duration_seconds histogram',
+        ]
+        for name, view in data['views'].items():
+            for bound, count in zip(data['buckets'], view['buckets']):
+                lines.append('api_request_duration_seconds_bucket{{view="{0}",le="{1}"}} {2}'.format(name, bound, count))
+            lines.append('api_request_duration_seconds_bucket{{view="{0}",le="+Inf"}} {1}'.format(name, view['count']))
+            lines.append('api_request_duration_seconds_sum{{view="{0}"}} {1:.6f}'.format(name, view['sum']))
+            lines.append('api_request_duration_seconds_count{{view="{0}"}} {1}'.format(name, view['count']))
+        for metric, key, help_text in (
+            ('api_request_errors_total', 'errors', 'Responses with a 5xx status, by view.'),
+            ('api_view_queries_total', 'queries', 'Queries run by the requests, by view.'),
+            ('api_view_query_seconds_total', 'sql_time', 'Time spent in queries, by view.'),
+        ):
+            lines += ['# HELP {0} {1}'.format(metric, help_text), '# TYPE {0} counter'.format(metric)]
+            lines += ['{0}{{view="{1}"}} {2}'.format(metric, name, view[key]) for name, view in data['views'].items()]
+        for metric, key, help_text in (
+            ('api_db_queries_total', 'count', 'Queries run by the requests, by database alias.'),
+            ('api_db_query_seconds_total', 'time', 'Time spent in queries, by database alias.'),
+        ):
+            lines += ['# HELP {0} {1}'.format(metric, help_text), '# TYPE {0} counter'.format(metric)]
+            lines += ['{0}{{alias="{1}"}} {2}'.format(metric, alias, totals[key])
+                      for alias, totals in data['aliases'].items()]
+        lines += [
+            '# HELP api_response_cache_events_total Events of the response cache.',
+            '# TYPE api_response_cache_events_total counter',
+        ]
+        lines += ['api_response_cache_events_total{{event="{0}"}} {1}'.format(event, count)
+                  for event, count in sorted(response_cache.stats.items())]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def is_internal(request):
+    """Tell if the request comes from a staff user, or from ``INTERNAL_IPS``"""
+    user = getattr(request, 'user', None)
+    return (user is not None and user.is_staff) or \
+        request.META.get('REMOTE_ADDR') in getattr(settings, 'INTERNAL_IPS', ())
+
+
+def metrics_view(request):
+    """
+    The aggregated metrics of this process, for staff users
+    and ``INTERNAL_IPS``; Prometheus text format, or json with ``?format=json``.
+    """
+    if not is_internal(request):
+        return HttpResponseForbidden()
+    if request.GET.get('format') == 'json':
+        return HttpResponse(json.dumps(metrics.as_dict()), content_type='application/json')
+    return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4')
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles the requests (see the module documentation);
+    it should be the first middleware, to time the others too.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        _local.profile = RequestProfile(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = get_current_profile()
+        if profile is None:
+            return None
+        profile.view_name = get_view_name(view_func)
+        profile.view_start = time.time()
+
+        requested = getattr(settings, 'PROFILING_QUERY_PARAM', 'profile') in request.GET and \
+            getattr(request, 'user', None) is not None and request.user.is_staff
+        sampled = random.random() < getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if requested or sampled:
+            return self.run_profiler(request, profile, view_func, view_args, view_kwargs, requested)
+        return None
+
+    def run_profiler(self, request, profile, view_func, view_args, view_kwargs, requested):
+        """
+        Run and render the view with cProfile; return the stats
+        to staff requests, or save them in PROFILING_DIR.
+        """
+        profiler = cProfile.Profile()
+        response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            profile.view_end = time.time()
+            response = profiler.runcall(response.render)
+        if requested and getattr(response, 'streaming', False):
+            profiler.runcall(lambda: b''.join(response.streaming_content))
+
+        if requested:
+            output = StringIO.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(100)
+            return HttpResponse(output.getvalue(), content_type='text/plain')
+
+        directory = getattr(settings, 'PROFILING_DIR', None)
+        if directory:
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                profiler.dump_stats(os.path.join(directory, '{0:.6f}-{1}-{2}.prof'.format(
+                    time.time(), profile.view_name, os.getpid()
+                )))
+            except EnvironmentError, e:
+                logger.warning(u'Profile not saved: {0}'.format(e))
+        return response
+
+    def process_template_response(self, request, response):
+        profile = get_current_profile()
+        if profile is not None and profile.view_end is None:
+            profile.view_end = time.time()
+        return response
+
+    def process_response(self, request, response):
+        profile = get_current_profile()
+        if profile is None:
+            return response
+
+        now = time.time()
+        if profile.view_start is not None:
+            if profile.view_end is None:
+                profile.view_end = now
+            else:
+                profile.add('render', now - profile.view_end)
+        profile.status = response.status_code
+        profile.collect_queries()
+        profile.phases['total'] = now - profile.start
+        if is_internal(request):
+            response['Server-Timing'] = profile.server_timing()
+
+        if getattr(response, 'streaming', False):
+            # the profile is finished when the response is closed, if its
+            # content is never iterated (e.g. for HEAD requests)
+            response.streaming_content = ClosingIterator(
+                self.time_stream(profile, response.streaming_content), lambda: self.finish(profile)
+            )
+        else:
+            self.finish(profile)
+        return response
+
+    def time_stream(self, profile, chunks):
+        """
+        Time the streaming of the content, and the queries run meanwhile.
+        """
+        start = time.time()
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            profile.add('stream', time.time() - start)
+            profile.collect_queries()
+            profile.phases['total'] = time.time() - profile.start
+            self.finish(profile)
+
+    @staticmethod
+    def finish(profile):
+        if profile.finished:
+            return
+        profile.finished = True
+        if get_current_profile() is profile:
+            _local.profile = None
+        profile.close()
+        metrics.record(profile)
+        logger.info(json.dumps(profile.as_dict()))
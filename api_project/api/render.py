@@ -1,35 +1,121 @@
 # -*- coding: utf-8 -*-
-from collections import OrderedDict
+"""
+JSON-LD rendering: keys starting with ``json_ld_`` are rendered as
+JSON-LD keywords, starting with ``@`` (``json_ld_id`` → ``@id``).
+
+Keys are not rewritten on the data, that would mean copying the
+whole tree of the response, but on the encoded json: a key is always
+preceded by ``{`` or ``,`` and followed by ``:``, while quotes
+inside strings are escaped, so the rewriting can not touch values.
+The json of responses without JSON-LD keys is left as it is.
+
+Lists (the response itself, or its ``results``) are encoded
+item by item, with the C encoder, and yielded in chunks
+by ``iter_render``, so that large responses can be streamed
+(see ``api.mixins.StreamingRenderMixin``).
+"""
 import re
 
+from django.http.multipartparser import parse_header
+from rest_framework.renderers import JSONRenderer
+
+from api.profiling import timed
+
 __author__ = 'guglielmo'
 
-from rest_framework.renderers import JSONRenderer
 
+json_ld_keys = re.compile(r'([{,]\s*)"json_ld_((?:[^"\\]|\\.)*)"(\s*:)')
 
-def ld(data):
-    if isinstance(data, dict):
-        new_dict = OrderedDict()
-        for key, value in data.items():
-            new_key = key
 
-            m = re.match(r'^json_ld_(.*)', key)
-            if m:
-                new_key = "@{0}".format(m.group(1))
+def ld(json):
+    """
+    Rewrite the ``json_ld_*`` keys of an encoded json into ``@*``.
+    """
+    if '"json_ld_' not in json:
+        return json
+    with timed('ld'):
+        return json_ld_keys.sub(r'\1"@\2"\3', json)
 
-            new_dict[new_key] = ld(value)
-        return new_dict
 
+class JSONLDRenderer(JSONRenderer):
+    """
+    Renders JSON-LD keys, and encodes lists incrementally.
+    """
+    # number of list items encoded in each chunk
+    chunk_size = 100
 
-    if isinstance(data, (list, tuple)):
-        for i in range(len(data)):
-            data[i] = ld(data[i])
-        return data
+    def get_indent(self, accepted_media_type, renderer_context):
+        """
+        Indentation is taken from the renderer context, or from
+        the media type parameters, as in ``JSONRenderer``.
+        """
+        indent = (renderer_context or {}).get('indent', None)
+        if accepted_media_type:
+            base_media_type, params = parse_header(accepted_media_type.encode('ascii'))
+            indent = params.get('indent', indent)
+            try:
+                indent = max(min(int(indent), 8), 0)
+            except (ValueError, TypeError):
+                indent = None
+        return indent
 
-    return data
+    def get_encoder(self, accepted_media_type, renderer_context):
+        return self.encoder_class(
+            indent=self.get_indent(accepted_media_type, renderer_context),
+            ensure_ascii=self.ensure_ascii
+        )
 
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return b''.join(self.iter_render(data, accepted_media_type, renderer_context))
 
-class JSONLDRenderer(JSONRenderer):
-    def render(self, data, *args, **kwargs):
-        return super(JSONLDRenderer, self).render(
-            ld(data), *args, **kwargs)
+    def iter_render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Yield the encoded json of the data, in chunks.
+
+        Without indentation, items of lists at the top level,
+        or under the ``results`` key, are encoded a chunk at a time,
+        and the same json of ``json.dumps`` is produced.
+        """
+        encoder = self.get_encoder(accepted_media_type, renderer_context)
+        if encoder.indent is not None:
+            yield self._bytes(ld(encoder.encode(data)))
+            return
+
+        if isinstance(data, (list, tuple)):
+            for chunk in self._iter_list(encoder, data):
+                yield chunk
+        elif isinstance(data, dict) and isinstance(data.get('results', None), (list, tuple)) and \
+                all(isinstance(key, basestring) for key in data):
+            # the envelope is encoded here, keeping the order of its keys
+            separator = '{'
+            for key, value in data.items():
+                prefix = ld('{0}{1}: '.format(separator, encoder.encode(key)))
+                separator = ', '
+                if key == 'results':
+                    yield self._bytes(prefix)
+                    for chunk in self._iter_list(encoder, value):
+                        yield chunk
+                else:
+                    yield self._bytes(prefix + ld(encoder.encode(value)))
+            yield b'}'
+        else:
+            yield self._bytes(ld(encoder.encode(data)))
+
+    def _iter_list(self, encoder, items):
+        if not items:
+            yield b'[]'
+            return
+        separator = '['
+        for start in range(0, len(items), self.chunk_size):
+            chunk = ', '.join(encoder.encode(item) for item in items[start:start + self.chunk_size])
+            yield self._bytes(separator + ld(chunk))
+            separator = ', '
+        yield b']'
+
+    @staticmethod
+    def _bytes(json):
+        if isinstance(json, unicode):
+            return json.encode('utf-8')
+        return json
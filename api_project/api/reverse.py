@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Fast reversing of urls, as a drop-in replacement of
+``rest_framework.reverse.reverse``.
+
+Reversing a named url walks the resolver for every call,
+and hyperlinked fields reverse an url for every serialized object.
+Here, each named url is reversed only once per process, with
+numeric placeholders in place of the arguments, into a format string;
+the urls of objects are then built by string interpolation.
+
+Urls are made absolute with the scheme and host of the request,
+computed once per request; format suffixes are kept, as the format
+is part of the key of the cached templates.
+
+Urls that can not be reversed with the placeholders (e.g. their
+arguments do not match digits), or that use positional arguments,
+are reversed by ``rest_framework.reverse.reverse``.
+Note that, unlike Django's ``reverse``, argument values are
+not validated against the url patterns.
+"""
+from django.core.urlresolvers import reverse as django_reverse, get_script_prefix, NoReverseMatch
+from django.utils.encoding import force_text
+from django.utils.http import urlquote
+from rest_framework.reverse import reverse as drf_reverse
+
+__author__ = 'guglielmo'
+
+
+class URLTemplates(object):
+    """
+    Cache of the url templates, by view name, argument names,
+    format and script prefix.
+    """
+    # placeholders are built by adding the position
+    # of the argument to this number
+    placeholder_base = 7350000000
+
+    def __init__(self):
+        self._templates = {}
+
+    def build_template(self, viewname, names, format=None):
+        """
+        Return the format string of the url, with a ``%(name)s``
+        placeholder for each argument, or None if it can not be built.
+        """
+        placeholders = dict((name, str(self.placeholder_base + n)) for n, name in enumerate(names))
+        kwargs = dict(placeholders)
+        if format is not None:
+            kwargs['format'] = format
+        try:
+            url = django_reverse(viewname, kwargs=kwargs)
+        except NoReverseMatch:
+            return None
+
+        template = url.replace('%', '%%')
+        for name, placeholder in placeholders.items():
+            if template.count(placeholder) != 1:
+                return None
+            template = template.replace(placeholder, '%({0})s'.format(name))
+        return template
+
+    def get_template(self, viewname, names, format=None):
+        key = (viewname, names, format, get_script_prefix())
+        try:
+            return self._templates[key]
+        except KeyError:
+            template = self._templates[key] = self.build_template(viewname, names, format)
+            return template
+
+    def clear(self):
+        self._templates.clear()
+
+    @staticmethod
+    def get_base_url(request):
+        """
+        Return the scheme and host of the request, computed once per request.
+        """
+        http_request = getattr(request, '_request', request)
+        try:
+            return http_request._base_url
+        except AttributeError:
+            base_url = http_request._base_url = http_request.build_absolute_uri('/')[:-1]
+            return base_url
+
+    def reverse(self, viewname, args=None, kwargs=None, request=None, format=None, **extra):
+        if args or extra:
+            return drf_reverse(viewname, args=args, kwargs=kwargs, request=request, format=format, **extra)
+
+        kwargs = kwargs or {}
+        template = self.get_template(viewname, tuple(sorted(kwargs)), format)
+        if template is None:
+            return drf_reverse(viewname, kwargs=kwargs, request=request, format=format)
+
+        url = template % dict((k, urlquote(force_text(v))) for k, v in kwargs.items())
+        if request:
+            return self.get_base_url(request) + url
+        return url
+
+
+url_templates = URLTemplates()
+
+
+def reverse(viewname, args=None, kwargs=None, request=None, format=None, **extra):
+    """
+    Same as ``rest_framework.reverse.reverse``, using the cached url templates.
+    """
+    return url_templates.reverse(viewname, args=args, kwargs=kwargs, request=request, format=format, **extra)
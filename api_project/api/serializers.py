@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Flat serializers, for read-only list endpoints.
+
+A ``ModelSerializer`` builds a model instance for each row, and then
+walks its field objects; a ``FlatSerializer`` declares the output keys,
+mapped to ``values_list`` lookups, computed values and hyperlinks,
+and builds the rows straight from the tuples of a single query::
+
+    class GroupFlatSerializer(FlatSerializer):
+        fields = (
+            ('id', 'id'),
+            ('name', 'name'),
+            ('acronym', Computed(lambda name: name[:3].upper(), 'name')),
+            ('self_uri', Hyperlink('group-detail', kwargs={'pk': 'id'})),
+        )
+
+Values are converted as DRF does (dates in ISO 8601), so that the
+produced json is the same of the corresponding ``ModelSerializer``.
+
+Flat serializers are used as ``serializer_class`` of list views,
+with or without pagination, and only accept querysets.
+"""
+from urllib import urlencode
+
+from django.db.models import DateField, DateTimeField, TimeField
+from django.db.models.query import QuerySet
+from django.utils.datastructures import SortedDict
+from rest_framework import serializers
+
+from api.reverse import url_templates
+
+__author__ = 'guglielmo'
+
+
+def get_model_field(model, lookup):
+    """Return the model field of a lookup (following relations), or None"""
+    field = None
+    for name in lookup.split('__'):
+        if field is not None:
+            if not field.rel:
+                return None
+            model = field.rel.to
+        try:
+            field = model._meta.get_field_by_name(name)[0]
+        except Exception:
+            return None
+    if field is not None and field.rel:
+        # values of foreign keys are the primary keys of the related objects
+        return get_model_field(field.rel.to, field.rel.field_name)
+    return field
+
+
+def datetime_to_native(value):
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def iso_to_native(value):
+    return value.isoformat()
+
+
+def get_converter(model, lookup):
+    """
+    Return the function that converts the values of a lookup
+    as the default DRF fields do, or None.
+    """
+    field = get_model_field(model, lookup)
+    if isinstance(field, DateTimeField):
+        return datetime_to_native
+    if isinstance(field, (DateField, TimeField)):
+        return iso_to_native
+    return None
+
+
+class Computed(object):
+    """
+    Value computed by a function of the values of the given lookups.
+    """
+
+    def __init__(self, function, *lookups):
+        self.function = function
+        self.lookups = lookups
+
+    def prepare(self, serializer):
+        return self.function
+
+
+class Hyperlink(object):
+    """
+    Url of a named view, with kwargs and querystring filters
+    taken from the values of the given lookups ({name: lookup}).
+
+    Constant kwargs may be computed from the serializer context,
+    once for each serialization, by ``get_kwargs``.
+    """
+
+    def __init__(self, view_name, kwargs=None, filters=None):
+        self.view_name = view_name
+        self.kwargs = kwargs or {}
+        self.filters = filters or {}
+        self.kwarg_names = tuple(self.kwargs.keys())
+        self.filter_names = tuple(self.filters.keys())
+        self.lookups = tuple(self.kwargs.values()) + tuple(self.filters.values())
+
+    def get_kwargs(self, context):
+        return {}
+
+    def prepare(self, serializer):
+        """
+        Return the function that builds the url from the values of the lookups.
+        """
+        request = serializer.context.get('request', None)
+        format = serializer.context.get('format', None)
+        constant_kwargs = self.get_kwargs(serializer.context)
+        view_name, kwarg_names, filter_names = self.view_name, self.kwarg_names, self.filter_names
+        n_kwargs = len(kwarg_names)
+
+        def build(*values):
+            kwargs = dict(constant_kwargs)
+            kwargs.update(zip(kwarg_names, values[:n_kwargs]))
+            url = url_templates.reverse(view_name, kwargs=kwargs, request=request, format=format)
+            if filter_names:
+                url = "{0}?{1}".format(url, urlencode(zip(filter_names, values[n_kwargs:])))
+            return url
+        return build
+
+
+class FlatSerializer(serializers.Field):
+    """
+    Serializes the rows of a queryset, read with ``values_list``.
+
+    ``fields`` is a sequence of (key, spec) couples, where spec
+    is a lookup, a ``Computed`` value or a ``Hyperlink``.
+    """
+    fields = ()
+
+    def __init__(self, instance=None, data=None, files=None, many=True, partial=False, context=None,
+                 source=None, **kwargs):
+        super(FlatSerializer, self).__init__(source=source)
+        self.object = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def data(self):
+        return self.to_native(self.object)
+
+    def get_lookups(self):
+        lookups = []
+        for key, spec in self.fields:
+            for lookup in (spec.lookups if hasattr(spec, 'lookups') else (spec, )):
+                if lookup not in lookups:
+                    lookups.append(lookup)
+        return lookups
+
+    def to_native(self, queryset):
+        if not isinstance(queryset, QuerySet):
+            raise TypeError("{0} can only serialize querysets".format(self.__class__.__name__))
+
+        lookups = self.get_lookups()
+        keys = [key for key, spec in self.fields]
+
+        # (function, positions of the arguments) for each key
+        builders = []
+        for key, spec in self.fields:
+            if hasattr(spec, 'prepare'):
+                builders.append((spec.prepare(self), [lookups.index(l) for l in spec.lookups]))
+            else:
+                builders.append((get_converter(queryset.model, spec), lookups.index(spec)))
+
+        rows = []
+        for values in queryset.values_list(*lookups):
+            row = []
+            for function, positions in builders:
+                if isinstance(positions, int):
+                    value = values[positions]
+                    if function is not None and value is not None:
+                        value = function(value)
+                else:
+                    value = function(*[values[n] for n in positions])
+                row.append(value)
+            rows.append(SortedDict(zip(keys, row)))
+        return rows
@@ -20,11 +20,21 @@ TEMPLATE_DEBUG = DEBUG
 DATABASES = {
     'default': env.db('DB_DEFAULT_URL'),
     'politici': env.db('DB_POLITICI_URL'),
-    'parlamento16': env.db('DB_PARLAMENTO16_URL'),
-    'parlamento17': env.db('DB_PARLAMENTO17_URL'),
     'parlamento18': env.db('DB_PARLAMENTO18_URL'),
 }
 
+# databases of closed legislatures are only needed to build their snapshots
+# (see parlamento.snapshots), and can be left out once snapshots exist
+for alias, url in (('parlamento16', 'DB_PARLAMENTO16_URL'), ('parlamento17', 'DB_PARLAMENTO17_URL')):
+    if env(url, default=''):
+        DATABASES[alias] = env.db(url)
+
+# directory of the snapshots of closed legislatures
+PARLAMENTO_SNAPSHOTS_DIR = env('PARLAMENTO_SNAPSHOTS_DIR', default=root('snapshots'))
+
+# memory-mapped vote matrices of the parlamento databases (see parlamento.votematrix)
+PARLAMENTO_VOTE_MATRIX_DIR = env('PARLAMENTO_VOTE_MATRIX_DIR', default=root('votematrix'))
+
 
 MEDIA_ROOT = root('../public/assets')
 MEDIA_URL = '/media/'
@@ -95,6 +105,8 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    # first, to time the other middlewares too
+    'api.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -198,7 +210,13 @@ LOGGING = {
             'handlers': ['console', ],
             'level': 'ERROR',
             'propagate': True
-        }
+        },
+        # timings of the requests, as json lines (see api.profiling)
+        'profiling': {
+            'handlers': ['logfile', ],
+            'level': 'INFO',
+            'propagate': False
+        },
     }
 }
 
@@ -243,3 +261,82 @@ OP_API_USERNAME = env('OP_API_USERNAME')
 OP_API_PASSWORD = env('OP_API_PASSWORD')
 
 # POSTGIS_VERSION = env.tuple('POSTGIS_VERSION')
+
+# seconds after which the in-process registries of normalized
+# parties, groups, professions and education levels are reloaded
+NORMALIZATION_CACHE_TTL = 3600
+
+# seconds after which the cached statistics on current charges
+# (see politici.statistics) are recomputed
+STATISTICS_CACHE_TTL = 600
+
+# seconds after which the cached lists of city mayors are recomputed;
+# they are invalidated anyway when the location's last_charge_update changes
+CITY_MAYORS_CACHE_TTL = 86400
+
+# seconds between checks of the op_location watermark,
+# after which the in-memory territorial gazetteer is rebuilt, if needed
+GAZETTEER_CHECK_INTERVAL = 300
+
+# max number of codes resolved in a single request to /territori/locations/resolve
+LOCATION_RESOLVE_MAX_CODES = 50000
+
+# seconds during which the last update date of each parlamento database
+# is kept in memory, before being read again (see parlamento.utils)
+PARLAMENTO_LAST_UPDATE_TTL = 60
+
+# seconds during which the group cohesion and agreement analytics are cached;
+# they are invalidated anyway when new votes are imported (see parlamento.cohesion)
+PARLAMENTO_ANALYTICS_CACHE_TTL = 86400
+
+# min number of items of a list response (or of its results), over which
+# the response is encoded and sent incrementally, as a streaming response
+# (see api.mixins.StreamingRenderMixin); None disables streaming
+STREAMING_RENDER_MIN_ITEMS = 500
+
+# seconds during which the last update of the politici contents
+# is kept in memory, before being read again (see politici.watermarks)
+POLITICI_LAST_UPDATE_TTL = 60
+
+# cache of the rendered responses of the read-only views (see api.cache);
+# keys contain the watermark of the data, so entries are replaced when the data changes.
+# Backends: api.cache.LRUBackend (in-process), api.cache.FileBackend (local directory,
+# shared by the processes), api.cache.DjangoCacheBackend (a django cache, e.g. memcached);
+# None disables the cache
+RESPONSE_CACHE = {
+    'BACKEND': 'api.cache.LRUBackend',
+    'OPTIONS': {'max_entries': 1000, 'max_size': 64 * 1024 * 1024},
+    # seconds after which entries expire anyway
+    'TIMEOUT': 3600,
+    # seconds during which concurrent requests wait for a response being built
+    'WAIT_TIMEOUT': 30,
+    # bytes of the largest response stored
+    'MAX_ENTRY_SIZE': 8 * 1024 * 1024,
+}
+
+# Cache-Control max-age of the responses, in seconds, by how often their data change:
+# parlamento data are imported daily, closed legislatures do not change,
+# politici contents are edited continuously, locations rarely (see api.mixins.ConditionalGetMixin)
+PARLAMENTO_MAX_AGE = 3600
+PARLAMENTO_CLOSED_MAX_AGE = 30 * 86400
+POLITICI_MAX_AGE = 300
+TERRITORI_MAX_AGE = 86400
+
+# profiling of the requests (see api.profiling): Server-Timing headers,
+# timings log and the /metrics view; it forces the debug cursor on all
+# connections, and explains slow queries while serving them, so it is
+# enabled in the development and staging settings only
+PROFILING_ENABLED = False
+# queries slower than this (seconds) are explained in the timings log
+PROFILING_EXPLAIN_THRESHOLD = 0.5
+# querystring parameter with which staff users profile a request with cProfile
+PROFILING_QUERY_PARAM = 'profile'
+# share of the requests profiled with cProfile, saved in PROFILING_DIR (0 disables)
+PROFILING_SAMPLE_RATE = 0
+PROFILING_DIR = env('PROFILING_DIR', default=root('profiles'))
+# upper bounds (seconds) of the buckets of the latency histograms
+PROFILING_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# time budgets of the query-budget tests are multiplied by this factor,
+# on slower machines (see api.testing)
+TEST_TIME_BUDGET_FACTOR = env.float('TEST_TIME_BUDGET_FACTOR', default=1.0)
@@ -9,3 +9,5 @@ INSTALLED_APPS = INSTALLED_APPS + (
     'debug_toolbar',
 )
 
+PROFILING_ENABLED = True
+
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Test helpers for the API applications.
+
+Their models are unmanaged, so their tables are not created in the
+test databases by syncdb: ``create_unmanaged_tables`` creates them,
+and synthetic data can then be loaded (see the ``synthetic`` module
+of each application).
+
+``ApiTestCase`` creates the tables, and loads the data of each test.
+
+``QueryBudgetMixin`` requests every URL of an application,
+at page sizes 25 and 1000, and asserts that each response needs
+no more queries, and no more time, than its budget, and that the
+number of queries does not grow with the page size (N+1 queries).
+Budgets are in the ``budgets`` attribute, by URL name::
+
+    class PoliticiQueryBudgetTest(QueryBudgetMixin, ApiTestCase):
+        unmanaged_apps = {'politici': ('territori', 'politici')}
+        urls_module = 'politici.urls'
+        namespace = 'politici'
+        budgets = {
+            'politician-list': Budget(queries=6, seconds=1.0),
+            'politician-detail': Budget(queries=8, kwargs={'pk': 1}),
+        }
+
+Time budgets are multiplied by the ``TEST_TIME_BUDGET_FACTOR`` setting,
+for slower machines.
+"""
+import json
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.urlresolvers import RegexURLResolver, reverse
+from django.db import connections
+from django.db.models import get_app, get_models
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.importlib import import_module
+
+__author__ = 'guglielmo'
+
+
+def create_unmanaged_tables(db_alias, *app_labels):
+    """
+    Create the tables of the unmanaged models of the given applications,
+    in the (test) database, as they are not created by syncdb.
+    """
+    connection = connections[db_alias]
+    existing = set(connection.introspection.table_names())
+    cursor = connection.cursor()
+    for app_label in app_labels:
+        for model in get_models(get_app(app_label), include_auto_created=True):
+            if model._meta.db_table in existing:
+                continue
+            existing.add(model._meta.db_table)
+            model._meta.managed = True
+            try:
+                statements, _ = connection.creation.sql_create_model(model, no_style())
+            finally:
+                model._meta.managed = False
+            for statement in statements:
+                # relation tables with a double primary key
+                if statement.count('PRIMARY KEY') > 1:
+                    statement = statement.replace(' PRIMARY KEY', '')
+                cursor.execute(drop_duplicate_columns(statement))
+
+
+def drop_duplicate_columns(statement):
+    """
+    Remove the columns defined twice from a CREATE TABLE statement
+    (some models map more fields on the same column).
+    """
+    lines = []
+    columns = set()
+    for line in statement.split('\n'):
+        column = line.split()[0] if line.startswith('    ') else None
+        if column is not None and column in columns:
+            continue
+        columns.add(column)
+        lines.append(line)
+    return '\n'.join(lines).replace(',\n)', '\n)')
+
+
+def reset_caches():
+    """
+    Forget the in-process registries, indexes and watermarks of the
+    applications, and empty the cache, so that they are rebuilt from
+    the data of the current test.
+    """
+    from parlamento.rankings import rankings
+    from parlamento.utils import watermarks
+    from parlamento.votematrix import vote_matrices
+    from politici.intervals import intervals
+    from politici.models import OpProfession, OpEducationLevel, OpParty, OpGroup
+    from politici.watermarks import contents
+    from territori import gazetteer
+
+    for registry in (OpProfession.normalizations, OpEducationLevel.normalizations,
+                     OpParty.normalizations, OpGroup.normalizations):
+        registry.invalidate()
+    for service in (rankings, watermarks, vote_matrices, contents, intervals, gazetteer.locations):
+        service.invalidate()
+    gazetteer.invalidate()
+    cache.clear()
+
+
+class CaptureAllQueriesContext(object):
+    """
+    Capture the queries run on all the databases.
+    """
+
+    def __init__(self):
+        self.contexts = [CaptureQueriesContext(connections[alias]) for alias in connections]
+
+    def __enter__(self):
+        for context in self.contexts:
+            context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for context in self.contexts:
+            context.__exit__(exc_type, exc_value, traceback)
+
+    def __len__(self):
+        return sum(len(context) for context in self.contexts)
+
+    @property
+    def captured_queries(self):
+        return [query for context in self.contexts for query in context.captured_queries]
+
+
+class Budget(object):
+    """
+    The maximum number of queries and seconds of the requests to a URL,
+    with the URL kwargs, the query parameters (or the json data, for POST)
+    and the expected status code.
+
+    Unless ``constant`` is False, the same number of queries
+    is expected at all page sizes.
+    """
+
+    def __init__(self, queries, seconds=0.5, kwargs=None, params=None, method='get', data=None,
+                 status=200, constant=True):
+        self.queries = queries
+        self.seconds = seconds
+        self.kwargs = kwargs or {}
+        self.params = params or {}
+        self.method = method
+        self.data = data
+        self.status = status
+        self.constant = constant
+
+
+def get_url_names(urls_module):
+    """
+    Return the names of the URLs of a urls module, with those of
+    the included modules of the same application (not of the namespaced ones).
+    """
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, RegexURLResolver):
+                if pattern.namespace is None:
+                    for name in walk(pattern.url_patterns):
+                        yield name
+            elif pattern.name:
+                yield pattern.name
+    return set(walk(import_module(urls_module).urlpatterns))
+
+
+class ApiTestCase(TestCase):
+    """
+    Creates the tables of ``unmanaged_apps`` (applications, by database
+    alias), loads the data of each test in ``build_data``, and forgets
+    the in-process caches around each test.
+
+    Vote matrices are written in a temporary directory.
+    """
+    multi_db = True
+    unmanaged_apps = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super(ApiTestCase, cls).setUpClass()
+        for db_alias, app_labels in sorted(cls.unmanaged_apps.items()):
+            create_unmanaged_tables(db_alias, *app_labels)
+
+    def setUp(self):
+        # vote matrices are files, built from the test data
+        self.vote_matrix_dir = tempfile.mkdtemp()
+        self.vote_matrix_override = override_settings(PARLAMENTO_VOTE_MATRIX_DIR=self.vote_matrix_dir)
+        self.vote_matrix_override.enable()
+        self.build_data()
+        reset_caches()
+
+    def tearDown(self):
+        reset_caches()
+        self.vote_matrix_override.disable()
+        shutil.rmtree(self.vote_matrix_dir, ignore_errors=True)
+
+    def build_data(self):
+        pass
+
+
+class QueryBudgetMixin(object):
+    """
+    Requests each URL of ``urls_module``, at each page size,
+    and checks the queries and time against its budget.
+
+    A mixin of ``ApiTestCase``, so that the budgets are
+    only checked by its subclasses.
+    """
+    urls_module = None
+    namespace = None
+    page_sizes = (25, 1000)
+    budgets = {}
+
+    def setUp(self):
+        # the response cache is disabled, responses must be built by the views
+        self.budget_override = override_settings(RESPONSE_CACHE=None, PROFILING_ENABLED=False)
+        self.budget_override.enable()
+        super(QueryBudgetMixin, self).setUp()
+
+    def tearDown(self):
+        super(QueryBudgetMixin, self).tearDown()
+        self.budget_override.disable()
+
+    def request(self, name, budget, page_size):
+        """
+        Request the URL and read the whole response;
+        return the response and its content.
+        """
+        url = reverse('{0}:{1}'.format(self.namespace, name), kwargs=budget.kwargs)
+        if budget.method == 'post':
+            response = self.client.post(
+                '{0}?page_size={1}'.format(url, page_size), json.dumps(budget.data),
+                content_type='application/json', HTTP_ACCEPT='application/json'
+            )
+        else:
+            params = dict(budget.params, page_size=page_size)
+            response = getattr(self.client, budget.method)(url, params, HTTP_ACCEPT='application/json')
+        if getattr(response, 'streaming', False):
+            return response, b''.join(response.streaming_content)
+        return response, response.content
+
+    def measure(self, name, budget, page_size):
+        """
+        Return the response, the number of queries and the seconds
+        of the request; in-process indexes are built by a first request,
+        so that the second one is measured.
+        """
+        self.request(name, budget, page_size)
+        with CaptureAllQueriesContext() as context:
+            start = time.time()
+            response, content = self.request(name, budget, page_size)
+            seconds = time.time() - start
+        return response, len(context), seconds
+
+    def test_urls_have_budgets(self):
+        if self.urls_module is None:
+            return
+        self.assertEqual(get_url_names(self.urls_module) - set(self.budgets), set())
+
+    def test_query_budgets(self):
+        factor = getattr(settings, 'TEST_TIME_BUDGET_FACTOR', 1.0)
+        errors = []
+        for name, budget in sorted(self.budgets.items()):
+            counts = []
+            for page_size in self.page_sizes:
+                response, queries, seconds = self.measure(name, budget, page_size)
+                counts.append(queries)
+                prefix = '{0} (page_size={1})'.format(name, page_size)
+                if response.status_code != budget.status:
+                    errors.append('{0}: status {1}, {2} expected'.format(prefix, response.status_code, budget.status))
+                if queries > budget.queries:
+                    errors.append('{0}: {1} queries, {2} allowed'.format(prefix, queries, budget.queries))
+                if seconds > budget.seconds * factor:
+                    errors.append('{0}: {1:.3f}s, {2:.3f}s allowed'.format(prefix, seconds, budget.seconds * factor))
+            if budget.constant and len(set(counts)) > 1:
+                errors.append('{0}: queries grow with the page size: {1}'.format(name, counts))
+        if errors:
+            self.fail('\n'.join(errors))
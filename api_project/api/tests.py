@@ -5,7 +5,13 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from api.profiling import ProfilingMiddleware, get_current_profile, metrics
 
 
 class SimpleTest(TestCase):
@@ -14,3 +20,39 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+@override_settings(PROFILING_ENABLED=True, INTERNAL_IPS=('127.0.0.1',))
+class ProfilingMiddlewareTest(TestCase):
+    """
+    Timings are only sent to staff users and internal IPs.
+    """
+
+    def profile(self, remote_addr):
+        middleware = ProfilingMiddleware()
+        request = RequestFactory().get('/politici/', REMOTE_ADDR=remote_addr)
+        middleware.process_request(request)
+        return middleware.process_response(request, HttpResponse())
+
+    def test_server_timing(self):
+        self.assertTrue(self.profile('127.0.0.1').has_header('Server-Timing'))
+        self.assertFalse(self.profile('10.0.0.1').has_header('Server-Timing'))
+
+    def test_unread_stream(self):
+        """
+        The profile of a streamed response is finished when the response
+        is closed, even if its content is never read (as for HEAD requests).
+        """
+        metrics.reset()
+        debug_cursors = dict((alias, connections[alias].use_debug_cursor) for alias in connections)
+        middleware = ProfilingMiddleware()
+        request = RequestFactory().head('/politici/', REMOTE_ADDR='10.0.0.1')
+        middleware.process_request(request)
+        response = middleware.process_response(request, StreamingHttpResponse(iter(['a', 'b'])))
+        response.streaming_content = []
+        response.close()
+
+        self.assertIsNone(get_current_profile())
+        self.assertEqual(metrics.as_dict()['views']['unresolved']['count'], 1)
+        for alias in connections:
+            self.assertEqual(connections[alias].use_debug_cursor, debug_cursors[alias])
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
+from api.profiling import metrics_view
 from api.views import ApiRootView
 
 admin.autodiscover()
 
 urlpatterns = patterns('',
    url(r'^$', ApiRootView.as_view(), name='op-api-root'),
+   url(r'^metrics$', metrics_view, name='metrics'),
    url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
    url(r'^admin/', include(admin.site.urls)),
 #    url(r'^maps/', include('places.urls', namespace='maps')),
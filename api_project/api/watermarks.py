@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Watermarks: cheap values, read from a database, that change
+whenever the data served by the API changes (e.g. the date of
+the last import), used to invalidate caches and snapshots.
+"""
+import threading
+import time
+
+__author__ = 'guglielmo'
+
+
+class Watermark(object):
+    """
+    Watermark of the data, for each database, computed by ``query``.
+
+    Aggregates may be slow on big tables, so the value is kept
+    for ``get_ttl()`` seconds, and refreshed by a single thread:
+    while a refresh is running, other threads get the previous value
+    (or wait for it, when there is none yet).
+    """
+    default_ttl = 60
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return self.default_ttl
+
+    def _get_lock(self, db_alias):
+        with self._lock:
+            return self._locks.setdefault(db_alias, threading.Lock())
+
+    def query(self, db_alias):
+        raise NotImplementedError
+
+    def get(self, db_alias):
+        """
+        Return the watermark of the given database.
+        """
+        cached = self._values.get(db_alias)
+        if cached is not None and time.time() - cached[1] <= self.get_ttl():
+            return cached[0]
+
+        lock = self._get_lock(db_alias)
+        # a stale value is returned, if another thread is refreshing it
+        if not lock.acquire(cached is None):
+            return cached[0]
+        try:
+            # queried again if still stale, or forgotten by ``invalidate`` meanwhile
+            value = self._values.get(db_alias)
+            if value is None or value is cached:
+                value = (self.query(db_alias), time.time())
+                self._values[db_alias] = value
+            return value[0]
+        finally:
+            lock.release()
+
+    def has_changed(self, db_alias, watermark):
+        """
+        Tell if the data of the database changed after the given watermark.
+        """
+        return self.get(db_alias) != watermark
+
+    def invalidate(self, db_alias=None):
+        """
+        Forget the watermark of a database (of all, if None).
+        """
+        with self._lock:
+            if db_alias is None:
+                self._values.clear()
+            else:
+                self._values.pop(db_alias, None)
@@ -0,0 +1,149 @@
+# coding=utf-8
+"""
+Cohesion and rebellion analytics of the parliamentary groups,
+computed on the vote matrix (see ``parlamento.votematrix``).
+
+Only the votes cast by the members of a group, while they were
+members (``CaricaHasGruppo`` start and end dates), are considered.
+
+For each vote, the position of a group is the most frequent among
+*Favorevole*, *Contrario* and *Astenuto* (none, on ties), and its
+cohesion is the agreement index of Hix, Noury and Roland::
+
+    (max(F, C, A) - (F + C + A - max(F, C, A)) / 2) / (F + C + A)
+
+that is 1 when all members vote the same way, and 0 when they
+split evenly on the three options.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.datastructures import SortedDict
+import numpy as np
+
+from parlamento.votematrix import VOTE_CODES, NO_VOTE
+
+__author__ = 'daniele'
+
+
+# codes of the votes cast, as opposed to absences, missions, ...
+CAST_CODES = tuple(VOTE_CODES[v] for v in ('favorevole', 'contrario', 'astenuto'))
+
+
+def get_cache_key(matrix, name, *args):
+    """
+    Results are cached by database, arguments and last update of the matrix,
+    so that they are invalidated when new votes are imported.
+    """
+    return 'parlamento:{0}:{1}:{2}:{3}:{4}'.format(
+        name,
+        matrix.path.replace(' ', '_'),
+        matrix.last_update and matrix.last_update.isoformat(),
+        matrix.shape[1],
+        ':'.join(str(a) for a in args)
+    )
+
+
+def cached(name):
+    """Cache the results of a function of the matrix and its arguments"""
+    def decorator(f):
+        def wrapper(matrix, *args):
+            key = get_cache_key(matrix, name, *args)
+            result = cache.get(key)
+            if result is None:
+                result = f(matrix, *args)
+                cache.set(key, result, getattr(settings, 'PARLAMENTO_ANALYTICS_CACHE_TTL', 86400))
+            return result
+        wrapper.__doc__ = f.__doc__
+        return wrapper
+    return decorator
+
+
+def positions(votes):
+    """
+    Return the positions (codes) of a group in each vote
+    (NO_VOTE where no member voted, or on ties), and the agreement indexes
+    (nan where no member voted), given the encoded votes of its members.
+    """
+    counts = np.vstack([(votes == code).sum(axis=0) for code in CAST_CODES])
+    total = counts.sum(axis=0)
+    top = counts.max(axis=0)
+
+    position = np.array(CAST_CODES, dtype=np.int8)[counts.argmax(axis=0)]
+    position[(total == 0) | ((counts == top).sum(axis=0) > 1)] = NO_VOTE
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        agreement = (1.5 * top - 0.5 * total) / total
+    return position, agreement
+
+
+def ratio(a, b):
+    return round(float(a) / b, 4) if b else None
+
+
+@cached('cohesion')
+def group_cohesion(matrix, group_id, date_from=None, date_to=None):
+    """
+    Return the cohesion of the group, in the given period,
+    and the votes, rebellions and loyalty of each member.
+    """
+    rows, columns, votes, rebels = matrix.slice(group_id=group_id, date_from=date_from, date_to=date_to)
+    position, agreement = positions(votes)
+    voted = ~np.isnan(agreement)
+
+    cast = np.in1d(votes, CAST_CODES).reshape(votes.shape)
+    loyal = cast & (votes == position) & (position != NO_VOTE)
+    with_position = cast & (position != NO_VOTE)
+    n_cast = cast.sum(axis=1)
+    n_rebels = rebels.sum(axis=1)
+    n_loyal = loyal.sum(axis=1)
+    n_with_position = with_position.sum(axis=1)
+
+    members = []
+    for n, row in enumerate(rows.tolist()):
+        members.append(SortedDict([
+            ('charge_id', int(matrix.charge_ids[row])),
+            ('politician_id', int(matrix.politician_ids[row])),
+            ('votes', int(n_cast[n])),
+            ('rebellions', int(n_rebels[n])),
+            ('rebellion_rate', ratio(n_rebels[n], n_cast[n])),
+            ('loyalty', ratio(n_loyal[n], n_with_position[n])),
+        ]))
+
+    return SortedDict([
+        ('group_id', group_id),
+        ('votes', int(voted.sum())),
+        ('cohesion', round(float(agreement[voted].mean()), 4) if voted.any() else None),
+        ('unanimous_votes', int((agreement[voted] == 1).sum())),
+        ('rebellions', int(n_rebels.sum())),
+        ('rebellion_rate', ratio(n_rebels.sum(), n_cast.sum())),
+        ('members', members),
+    ])
+
+
+@cached('agreement')
+def groups_agreement(matrix, date_from=None, date_to=None):
+    """
+    Return the ids of the groups, and the share of the votes,
+    in the given period, in which each pair of groups took the same position,
+    among those in which both took a position.
+    """
+    group_ids = sorted(set(matrix.membership_groups.tolist()))
+    columns = matrix.date_columns(date_from, date_to)
+    group_positions = np.zeros((len(group_ids), len(columns)), dtype=np.int8)
+    for n, group_id in enumerate(group_ids):
+        votes = matrix.slice(group_id=group_id, date_from=date_from, date_to=date_to)[2]
+        group_positions[n] = positions(votes)[0]
+
+    valid = group_positions != NO_VOTE
+    both = (valid[:, None, :] & valid[None, :, :]).sum(axis=2)
+    same = ((group_positions[:, None, :] == group_positions[None, :, :]) &
+            valid[:, None, :] & valid[None, :, :]).sum(axis=2)
+
+    return SortedDict([
+        ('groups', group_ids),
+        ('votes', both.tolist()),
+        ('agreement', [
+            [ratio(same[i, j], both[i, j]) for j in range(len(group_ids))]
+            for i in range(len(group_ids))
+        ]),
+    ])
@@ -1,4 +1,3 @@
-from django.db.models import Q
 from rest_framework import serializers
 from parlamento.utils import get_legislatura_from_request, reverse_url, get_last_update
 
@@ -75,15 +74,19 @@ class FirstParliamentarianChargeField(serializers.CharField):
     Get the first charge , and return its representation.
     Delegates the serialisation of the field to the __unicode__ model
     method.
+
+    Charges are filtered in memory, so that they can be prefetched
+    for all the parliamentarians of a page.
     """
     def to_native(self, value):
-        ret = value.filter(
-            Q(charge_type__name__iexact='deputato') |
-            Q(charge_type__name__icontains='senatore')
-        )
+        charges = list(value.all())
+        ret = [
+            c for c in charges
+            if c.charge_type.name.lower() == 'deputato' or 'senatore' in c.charge_type.name.lower()
+        ]
 
         if not ret:
-            ret = value.all()
+            ret = charges
 
         return ret[0].__unicode__()
 
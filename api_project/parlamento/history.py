@@ -0,0 +1,174 @@
+# coding=utf-8
+"""
+Voting history of a parliamentarian: the rows of
+``opp_votazione_has_carica`` of its charges, joined with the
+vote (``opp_votazione``) and the sitting (``opp_seduta``)
+in a single query, sorted by sitting date, vote number, vote id and charge id.
+
+Pages are fetched seeking past the key of the last row
+of the previous page, instead of using an OFFSET, so that
+the cost of a page does not grow with its position;
+the whole history is streamed the same way, in chunks,
+as NDJSON (one json object per line).
+"""
+import base64
+from collections import OrderedDict as odict
+from datetime import date
+import json
+from json.encoder import encode_basestring_ascii
+
+from django.db import reset_queries
+from django.db.models import Q
+from rest_framework.compat import parse_date
+from rest_framework.utils.encoders import JSONEncoder
+
+from parlamento.models import VotazioneHasCarica
+
+__author__ = 'daniele'
+
+
+def encode_value(value, encoder=JSONEncoder()):
+    """
+    Return the json of a value of a row (ascii only)
+    """
+    if value is None:
+        return 'null'
+    if isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, date):
+        return '"{0}"'.format(value.isoformat())
+    return encoder.encode(value)
+
+
+class VotingHistory(object):
+    """
+    Votes cast by the given charges, in a database.
+    """
+    content_type = 'application/x-ndjson'
+
+    # (name, lookup) of the fields of each row
+    fields = (
+        ('vote_id', 'vote__id'),
+        ('charge_id', 'charge__id'),
+        ('date', 'vote__sitting__date'),
+        ('sitting_id', 'vote__sitting__id'),
+        ('sitting_number', 'vote__sitting__number'),
+        ('house', 'vote__sitting__house'),
+        ('numero_votazione', 'vote__numero_votazione'),
+        ('titolo', 'vote__titolo'),
+        ('esito', 'vote__esito'),
+        ('finale', 'vote__finale'),
+        ('voting', 'voting'),
+        ('rebel', 'rebel'),
+        ('maggioranza_sotto_salva', 'maggioranza_sotto_salva'),
+    )
+
+    # lookups of the sort key, the last two are unique together
+    # (a politician may vote with several of its charges)
+    key = ('vote__sitting__date', 'vote__numero_votazione', 'vote__id', 'charge__id')
+
+    def __init__(self, db_alias, charge_ids, chunk_size=5000):
+        self.db_alias = db_alias
+        self.charge_ids = list(charge_ids)
+        self.chunk_size = chunk_size
+
+        lookups = [lookup for name, lookup in self.fields]
+        self.key_positions = [lookups.index(lookup) for lookup in self.key]
+
+    def get_queryset(self):
+        return VotazioneHasCarica.objects.using(self.db_alias).filter(
+            charge__in=self.charge_ids
+        ).order_by(*self.key).values_list(*[lookup for name, lookup in self.fields])
+
+    def seek(self, queryset, position):
+        """
+        Select the rows strictly after the (date, number, vote id, charge id)
+        position; NULL dates are sorted first, as MySQL does.
+        """
+        date_field, number_field, id_field, charge_field = self.key
+        day, number, vote_id, charge_id = position
+        after_vote = Q(**{id_field + '__gt': vote_id}) | \
+            Q(**{id_field: vote_id, charge_field + '__gt': charge_id})
+        after_number = Q(**{number_field + '__gt': number}) | \
+            (Q(**{number_field: number}) & after_vote)
+        if day is None:
+            condition = (Q(**{date_field + '__isnull': True}) & after_number) | \
+                Q(**{date_field + '__isnull': False})
+        else:
+            condition = Q(**{date_field + '__gt': day}) | (Q(**{date_field: day}) & after_number)
+        return queryset.filter(condition)
+
+    def position(self, row):
+        return tuple(row[n] for n in self.key_positions)
+
+    def as_dict(self, row):
+        return odict(zip([name for name, lookup in self.fields], row))
+
+    def page(self, position=None, size=25):
+        """
+        Return the rows after the position (the first ones, if None),
+        and the position of the last one, if there are more rows.
+        """
+        queryset = self.get_queryset()
+        if position is not None:
+            queryset = self.seek(queryset, position)
+        rows = list(queryset[:size + 1])
+        next_position = self.position(rows[size - 1]) if len(rows) > size else None
+        return [self.as_dict(row) for row in rows[:size]], next_position
+
+    def tuples(self):
+        """
+        Yield all rows, as tuples, fetched in chunks.
+        """
+        position = None
+        while True:
+            queryset = self.get_queryset()
+            if position is not None:
+                queryset = self.seek(queryset, position)
+            chunk = list(queryset[:self.chunk_size])
+            if not chunk:
+                break
+            for row in chunk:
+                yield row
+            position = self.position(chunk[-1])
+
+            # avoid the growth of the queries log, when DEBUG is on
+            reset_queries()
+
+    def rows(self):
+        """
+        Yield all rows, as dictionaries.
+        """
+        for row in self.tuples():
+            yield self.as_dict(row)
+
+    def ndjson(self):
+        """
+        Yield the json lines of all rows.
+
+        Lines are filled in a template, with the keys in place,
+        encoding the values one by one: building and encoding
+        a dictionary for each row is several times slower.
+        """
+        template = '{' + ', '.join('"{0}": %s'.format(name) for name, lookup in self.fields) + '}\n'
+        for row in self.tuples():
+            yield template % tuple(encode_value(value) for value in row)
+
+    @staticmethod
+    def encode_cursor(position):
+        day, number, vote_id, charge_id = position
+        return base64.urlsafe_b64encode(json.dumps([day and day.isoformat(), number, vote_id, charge_id]))
+
+    @staticmethod
+    def decode_cursor(token):
+        """
+        Return the position encoded in the cursor;
+        a ValueError is raised for invalid cursors.
+        """
+        try:
+            day, number, vote_id, charge_id = json.loads(base64.urlsafe_b64decode(str(token)))
+            return (parse_date(day) if day else None), int(number), int(vote_id), int(charge_id)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor: {0}'.format(token))
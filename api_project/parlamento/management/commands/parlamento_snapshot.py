@@ -0,0 +1,67 @@
+# coding=utf-8
+from optparse import make_option
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parlamento import lex
+from parlamento.snapshots import build_snapshot, get_closed_legislature
+
+__author__ = 'daniele'
+
+
+class Command(BaseCommand):
+    """
+    The database of a closed legislature is frozen into a read-only
+    SQLite snapshot, in PARLAMENTO_SNAPSHOTS_DIR,
+    that is then used by the API instead of the database.
+
+    All closed legislatures with a database are processed,
+    if none is given.
+    """
+    args = '<legislatura legislatura ...>'
+    help = "Build the snapshots of closed legislatures"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='Snapshot file (only with a single legislatura)'),
+        make_option('--chunk-size',
+                    dest='chunk_size',
+                    default=5000,
+                    help='Number of rows copied per query'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        if args:
+            legislature = [lex.get_legislatura(n) for n in args]
+        else:
+            legislature = get_closed_legislature()
+
+        if options['output'] and len(legislature) != 1:
+            raise CommandError("--output can only be used with a single legislatura")
+
+        for legislatura in legislature:
+            self.logger.info(u"Building snapshot of {0}".format(legislatura.name))
+            try:
+                path = build_snapshot(
+                    legislatura, path=options['output'],
+                    chunk_size=int(options['chunk_size']), logger=self.logger
+                )
+            except ValueError as e:
+                raise CommandError(e)
+            self.logger.info(u"Snapshot of {0} written to {1}".format(legislatura.name, path))
@@ -0,0 +1,94 @@
+# coding=utf-8
+from optparse import make_option
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from api.testing import create_unmanaged_tables
+from parlamento import lex
+from parlamento.models import Carica, Votazione, VotazioneHasCarica
+from parlamento.synthetic import build_parlamento
+
+__author__ = 'daniele'
+
+
+class Command(BaseCommand):
+    """
+    The database of a legislatura is filled with synthetic
+    parliamentarians, sittings and votes, at the scale of a whole
+    legislatura by default (about 30M individual votes), to benchmark
+    the API on a local database.
+
+    Missing tables are created; databases that already contain
+    charges or votes are refused, so that real data is never touched.
+    """
+    args = '<legislatura>'
+    help = "Fill the database of a legislatura with synthetic data"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database',
+                    dest='database',
+                    default=None,
+                    help='Database alias (the one of the legislatura, by default)'),
+        make_option('--parliamentarians',
+                    dest='parliamentarians',
+                    default=945,
+                    help='Number of parliamentarians'),
+        make_option('--sittings',
+                    dest='sittings',
+                    default=2000,
+                    help='Number of sittings, alternating between the houses'),
+        make_option('--votes',
+                    dest='votes',
+                    default=32,
+                    help='Number of votes per sitting'),
+        make_option('--history',
+                    dest='history',
+                    default=100,
+                    help='Number of updates of the history cache'),
+        make_option('--seed',
+                    dest='seed',
+                    default=1,
+                    help='Seed of the random generator'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=5000,
+                    help='Number of rows inserted per query'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        if len(args) != 1:
+            raise CommandError("A single legislatura is required")
+        legislatura = lex.get_legislatura(args[0])
+        using = options['database'] or legislatura.database
+        if using not in connections:
+            raise CommandError(u"No database for {0}".format(legislatura.name))
+
+        create_unmanaged_tables(using, 'parlamento')
+        for model in (Carica, Votazione, VotazioneHasCarica):
+            if model.objects.using(using).exists():
+                raise CommandError(u"Table {0} of database {1} is not empty".format(model._meta.db_table, using))
+
+        self.logger.info(u"Generating {0} in database {1}".format(legislatura.name, using))
+        with transaction.atomic(using=using):
+            counts = build_parlamento(
+                using, parliamentarians=int(options['parliamentarians']), sittings=int(options['sittings']),
+                votes=int(options['votes']), history=int(options['history']), start_date=legislatura.start_date,
+                seed=int(options['seed']), batch_size=int(options['batch_size']), logger=self.logger
+            )
+        for table, count in sorted(counts.items()):
+            self.logger.info(u"{0}: {1} rows".format(table, count))
@@ -0,0 +1,75 @@
+# coding=utf-8
+from optparse import make_option
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from parlamento import lex
+from parlamento.snapshots import get_snapshot_alias
+from parlamento.votematrix import get_vote_matrix_path, remove_vote_matrix, update_vote_matrix
+
+__author__ = 'daniele'
+
+
+class Command(BaseCommand):
+    """
+    The votes of the sittings imported since the last run are appended
+    to the vote matrix of the legislature (the whole matrix is built
+    at the first run), in PARLAMENTO_VOTE_MATRIX_DIR.
+
+    To be run after each import: the API only reads the matrices.
+    Matrices are not rewritten if the data did not change since the last run.
+    All legislatures with a snapshot or a configured database are processed,
+    if none is given.
+    """
+    args = '<legislatura legislatura ...>'
+    help = "Build or update the vote matrices of the legislatures"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rebuild',
+                    dest='rebuild',
+                    action='store_true',
+                    default=False,
+                    help='Remove the existing matrices and build them from scratch'),
+        make_option('--chunk-size',
+                    dest='chunk_size',
+                    default=100,
+                    help='Number of votes read per query'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        if args:
+            legislature = [lex.get_legislatura(n) for n in args]
+        else:
+            legislature = [l for l in lex.get_legislature() if l.database is not None]
+
+        for legislatura in legislature:
+            db_alias = get_snapshot_alias(legislatura) or legislatura.database
+            if db_alias is None or db_alias not in connections.databases:
+                message = "Legislatura {0} has no snapshot and no configured database".format(legislatura.number)
+                if args:
+                    raise CommandError(message)
+                # legislature that were not asked for are skipped
+                self.logger.warning(message)
+                continue
+
+            path = get_vote_matrix_path(db_alias)
+            if options['rebuild']:
+                remove_vote_matrix(path)
+
+            self.logger.info(u"Updating the vote matrix of {0}".format(legislatura.name))
+            update_vote_matrix(db_alias, path, chunk_size=int(options['chunk_size']), logger=self.logger)
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+Rankings of the active parliamentarians, by productivity index,
+presences, absences and rebellions.
+
+For each database (legislature), the values of the active charges
+(deputies and senators) are kept in sorted lists, so that the position
+of a value is found by binary search. Rankings are shared by all
+requests of a process, and rebuilt when the last update
+of the parliament data (see ``parlamento.utils.watermarks``) changes.
+"""
+from bisect import bisect_left, bisect_right
+import threading
+
+from parlamento.models import Carica
+from parlamento.utils import watermarks
+
+__author__ = 'daniele'
+
+
+class Ranking(object):
+    """
+    Sorted values of the active charges of a legislature.
+    """
+    # ids of the charge types of deputies and senators
+    charge_types = (1, 4, 5)
+
+    # fields of Carica that can be ranked
+    fields = ('indice', 'presenze', 'assenze', 'ribelle')
+
+    def __init__(self, db_alias, last_update=None):
+        self.db_alias = db_alias
+        self.last_update = last_update
+
+        rows = Carica.objects.using(db_alias).filter(
+            charge_type_id__in=self.charge_types,
+            end_date__isnull=True,
+        ).values_list(*self.fields)
+
+        columns = zip(*rows) or [()] * len(self.fields)
+        self.values = dict(
+            (field, sorted(v for v in column if v is not None))
+            for field, column in zip(self.fields, columns)
+        )
+
+    def position(self, field, value):
+        """
+        Return the position of the value among the values of the
+        active charges, in descending order (1 is the highest value),
+        or None if the value is not found.
+
+        Equal values share the same position.
+        """
+        if value is None:
+            return None
+        values = self.values[field]
+        i = bisect_left(values, value)
+        if i == len(values) or values[i] != value:
+            return None
+        return len(values) - bisect_right(values, value) + 1
+
+
+class RankingService(object):
+    """
+    Gives the up-to-date ranking of a database.
+    """
+
+    def __init__(self):
+        self._rankings = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_alias):
+        ranking = self._rankings.get(db_alias)
+        if ranking is None or watermarks.has_changed(db_alias, ranking.last_update):
+            with self._lock:
+                ranking = self._rankings.get(db_alias)
+                if ranking is None or watermarks.has_changed(db_alias, ranking.last_update):
+                    ranking = Ranking(db_alias, watermarks.get(db_alias))
+                    self._rankings[db_alias] = ranking
+        return ranking
+
+    def invalidate(self, db_alias=None):
+        with self._lock:
+            if db_alias is None:
+                self._rankings.clear()
+            else:
+                self._rankings.pop(db_alias, None)
+
+
+rankings = RankingService()
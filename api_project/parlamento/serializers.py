@@ -1,8 +1,10 @@
 from rest_framework import serializers
 from rest_framework import pagination
 
+from api.serializers import FlatSerializer, Hyperlink
 from parlamento import models
 from parlamento import fields
+from parlamento.utils import get_legislatura_from_request
 
 
 __author__ = 'daniele'
@@ -203,3 +205,55 @@ class VotazioneDettagliataSerializer(serializers.ModelSerializer):
         )
 
 
+class LegislaturaHyperlink(Hyperlink):
+    """
+    Url of a view of the legislatura of the request,
+    as built by ``parlamento.utils.reverse_url``.
+    """
+    def __init__(self, view_name, **kwargs):
+        super(LegislaturaHyperlink, self).__init__('parlamento:{0}'.format(view_name), **kwargs)
+
+    def get_kwargs(self, context):
+        return {'legislatura': get_legislatura_from_request(context['request'])}
+
+
+class GruppoFlatSerializer(FlatSerializer):
+    """Same as GruppoSerializer, for lists"""
+    fields = (
+        ('id', 'id'),
+        ('name', 'name'),
+        ('acronym', 'acronym'),
+        ('parliamentarians_uri', LegislaturaHyperlink('parlamentare-list', filters={'group': 'id'})),
+    )
+
+
+class SedeFlatSerializer(FlatSerializer):
+    """Same as SedeSerializer, for lists"""
+    fields = (
+        ('id', 'id'),
+        ('house', 'house'),
+        ('name', 'name'),
+        ('site_type', 'site_type'),
+        ('code', 'code'),
+        ('start_date', 'start_date'),
+        ('end_date', 'end_date'),
+        ('parliamentarians_uri', LegislaturaHyperlink('parlamentare-list', filters={'site': 'id'})),
+    )
+
+
+class VotazioneFlatSerializer(FlatSerializer):
+    """Same as VotazioneSerializer, for lists"""
+    fields = (
+        ('id', 'id'),
+        ('sitting', 'sitting'),
+        ('votazione_uri', LegislaturaHyperlink('votazione-detail', kwargs={'votazione': 'id'})),
+    ) + tuple((f, f) for f in (
+        'numero_votazione',
+        'titolo', 'titolo_aggiuntivo', 'descrizione',
+        'presenti', 'votanti', 'maggioranza', 'astenuti',
+        'favorevoli', 'contrari', 'esito', 'ribelli',
+        'margine', 'tipologia',
+        'finale', 'nb_commenti',
+        'ut_fav', 'ut_contr', 'is_maggioranza_sotto_salva',
+        'is_imported', 'url'
+    ))
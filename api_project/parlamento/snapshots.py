@@ -0,0 +1,225 @@
+# coding=utf-8
+"""
+Read-only snapshots of closed legislatures.
+
+The databases of the legislatures that have an ``end_date`` no longer
+change, so their tables can be frozen into a local SQLite file,
+one per legislature, in ``PARLAMENTO_SNAPSHOTS_DIR``.
+
+When the snapshot of a legislature exists, it is registered as a
+database alias (``parlamento16_snapshot``, ...) and the views of
+``APILegislaturaMixin`` read from it instead of the MySQL database,
+that is only needed to build the snapshot
+(see the ``parlamento_snapshot`` management command).
+
+Of the huge ``opp_politician_history_cache`` table,
+only the rows of the last update are kept.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max, ForeignKey
+
+from parlamento import lex
+from parlamento.models import TipoCarica, Politico, Gruppo, GruppoIsMaggioranza, GruppoRamo, Sede, \
+    Carica, CaricaHasGruppo, IncaricoGruppo, CaricaInterna, Seduta, Votazione, VotazioneHasCarica, \
+    PoliticianHistoryCache
+
+__author__ = 'daniele'
+
+
+# models, in the order in which they are copied
+SNAPSHOT_MODELS = (
+    TipoCarica, Politico, Gruppo, GruppoIsMaggioranza, GruppoRamo, Sede,
+    Carica, CaricaHasGruppo, IncaricoGruppo, CaricaInterna,
+    Seduta, Votazione, VotazioneHasCarica,
+    PoliticianHistoryCache,
+)
+
+# columns indexed in the snapshot, besides primary and foreign keys
+SNAPSHOT_INDEXES = {
+    PoliticianHistoryCache: ('data', 'chi_tipo'),
+    Carica: ('data_fine',),
+}
+
+_lock = threading.Lock()
+
+
+def get_snapshots_dir():
+    return getattr(settings, 'PARLAMENTO_SNAPSHOTS_DIR', None)
+
+
+def get_snapshot_path(legislatura):
+    snapshots_dir = get_snapshots_dir()
+    if not snapshots_dir:
+        return None
+    return os.path.join(snapshots_dir, 'parlamento{0}.sqlite3'.format(legislatura.number))
+
+
+def get_snapshot_alias(legislatura):
+    """
+    Return the alias of the snapshot database of the legislatura,
+    registering it, or None if the legislatura has no snapshot.
+    """
+    if legislatura.end_date is None:
+        return None
+    path = get_snapshot_path(legislatura)
+    if path is None or not os.path.exists(path):
+        return None
+
+    alias = 'parlamento{0}_snapshot'.format(legislatura.number)
+    if alias not in connections.databases:
+        with _lock:
+            connections.databases.setdefault(alias, {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+            })
+    return alias
+
+
+def get_columns(model):
+    """
+    Return the fields of a model, one for each column
+    (some models map more fields on the same column).
+    """
+    fields = []
+    columns = set()
+    for field in model._meta.local_fields:
+        if field.column not in columns:
+            columns.add(field.column)
+            fields.append(field)
+    return fields
+
+
+def get_insert_sql(model, connection):
+    """
+    Return the INSERT statement of a row of the model, with a
+    parameter for each of its columns (in the order of ``get_columns``).
+    """
+    qn = connection.ops.quote_name
+    fields = get_columns(model)
+    return "INSERT INTO {0} ({1}) VALUES ({2})".format(
+        qn(model._meta.db_table),
+        ", ".join(qn(f.column) for f in fields),
+        ", ".join(["%s"] * len(fields))
+    )
+
+
+def create_table(model, connection):
+    """
+    Create the table of an (unmanaged) model, with its indexes,
+    in the given connection.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    columns = []
+    indexes = list(SNAPSHOT_INDEXES.get(model, ()))
+    for field in get_columns(model):
+        column = "{0} {1}".format(qn(field.column), field.db_type(connection))
+        if field.primary_key:
+            column += " PRIMARY KEY"
+        elif not field.null:
+            column += " NOT NULL"
+        columns.append(column)
+        if isinstance(field, ForeignKey):
+            indexes.append(field.column)
+
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE {0} ({1})".format(qn(table), ", ".join(columns)))
+    for column in indexes:
+        cursor.execute("CREATE INDEX {0} ON {1} ({2})".format(
+            qn("{0}_{1}".format(table, column)), qn(table), qn(column)
+        ))
+
+
+def copy_table(model, queryset, connection, chunk_size=5000):
+    """
+    Copy the rows of the queryset into the table of the model,
+    in the given connection, in chunks, sorted by primary key.
+    Return the number of copied rows.
+    """
+    fields = get_columns(model)
+    pk = model._meta.pk.attname
+    queryset = queryset.order_by(pk).values_list(*[f.attname for f in fields])
+    pk_index = [f.attname for f in fields].index(pk)
+    sql = get_insert_sql(model, connection)
+
+    cursor = connection.cursor()
+    n = 0
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(**{'{0}__gt'.format(pk): last_pk})
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            break
+        cursor.executemany(sql, rows)
+        n += len(rows)
+        last_pk = rows[-1][pk_index]
+    return n
+
+
+def build_snapshot(legislatura, path=None, chunk_size=5000, logger=None):
+    """
+    Build the snapshot of a closed legislatura, from its database.
+
+    The snapshot is written into a temporary file, that replaces
+    the existing snapshot only when complete.
+    """
+    if legislatura.end_date is None:
+        raise ValueError("Legislatura {0} is not closed: no snapshot can be built".format(legislatura.number))
+    if legislatura.database is None:
+        raise ValueError("Legislatura {0} has no database".format(legislatura.number))
+    if legislatura.database not in connections.databases:
+        raise ValueError("Legislatura {0}: database {1} is not configured".format(
+            legislatura.number, legislatura.database
+        ))
+
+    path = path or get_snapshot_path(legislatura)
+    if path is None:
+        raise ValueError("PARLAMENTO_SNAPSHOTS_DIR is not set")
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = legislatura.database
+    target = 'parlamento{0}_snapshot_build'.format(legislatura.number)
+    connections.databases[target] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': tmp_path,
+    }
+    try:
+        connection = connections[target]
+        with transaction.atomic(using=target):
+            for model in SNAPSHOT_MODELS:
+                create_table(model, connection)
+
+                queryset = model._default_manager.using(source).all()
+                if model is PoliticianHistoryCache:
+                    last_update = queryset.aggregate(last_update=Max('update_date'))['last_update']
+                    queryset = queryset.filter(update_date=last_update)
+
+                n = copy_table(model, queryset, connection, chunk_size=chunk_size)
+                if logger:
+                    logger.info(u"{0}: {1} rows copied".format(model._meta.db_table, n))
+    finally:
+        connections[target].close()
+        del connections[target]
+        del connections.databases[target]
+
+    os.rename(tmp_path, path)
+    return path
+
+
+def get_closed_legislature():
+    """Return the closed legislature that have a configured database"""
+    return [
+        l for l in lex.get_legislature()
+        if l.end_date is not None and l.database is not None and l.database in connections.databases
+    ]
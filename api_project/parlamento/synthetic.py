@@ -0,0 +1,204 @@
+# coding=utf-8
+"""
+Synthetic data of a legislatura: groups, sites, parliamentarians with their
+charges, groups and internal charges, the history cache, sittings and votes,
+generated from a seed, to test and benchmark the API on a local database
+(see the ``parlamento_synthetic`` management command).
+
+Sittings alternate between the two houses, and the parliamentarians
+of the house vote; they mostly vote as their group does, and are rebels
+when they do not. Presences, absences and rebellions of the charges,
+and of the history cache, are counted on the generated votes.
+
+Rows are inserted with raw queries, in batches of ``batch_size`` rows,
+so that millions of votes can be generated.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+import random
+
+from django.db import connections
+
+from parlamento.models import TipoCarica, Politico, Gruppo, GruppoIsMaggioranza, GruppoRamo, Sede, \
+    Carica, CaricaHasGruppo, IncaricoGruppo, CaricaInterna, Seduta, Votazione, VotazioneHasCarica, \
+    PoliticianHistoryCache
+from parlamento.snapshots import get_columns, get_insert_sql
+
+__author__ = 'daniele'
+
+
+CHARGE_TYPES = ((1, 'Deputato'), (2, 'Presidente'), (3, 'Componente'), (4, 'Senatore'), (5, 'Senatore a vita'))
+
+# groups, the first ones in the majority
+GROUPS = (
+    ('Partito Democratico', 'PD'), ('Movimento 5 Stelle', 'M5S'), ('Lega', 'LEGA'),
+    ('Forza Italia', 'FI'), ('Fratelli d\'Italia', 'FDI'), ('Misto', 'MISTO'),
+)
+MAJORITY = 3
+
+DISTRICTS = ('Piemonte 1', 'Lombardia 1', 'Lombardia 2', 'Veneto 1', 'Emilia-Romagna', 'Toscana',
+             'Lazio 1', 'Lazio 2', 'Campania 1', 'Puglia', 'Sicilia 1', 'Sardegna')
+
+VOTINGS = ('Favorevole', 'Contrario', 'Astenuto')
+ABSENCES = ('Assente', 'In missione')
+
+
+class RowWriter(object):
+    """
+    Buffers the rows of a model, as tuples of the values of its columns,
+    and inserts them with a single query every ``batch_size`` rows.
+    """
+
+    def __init__(self, using, model, batch_size=5000):
+        self.connection = connections[using]
+        self.sql = get_insert_sql(model, self.connection)
+        self.attnames = [f.attname for f in get_columns(model)]
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+
+    def add(self, **values):
+        self.rows.append(tuple(values.get(attname) for attname in self.attnames))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.connection.cursor().executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def build_parlamento(using, parliamentarians=40, sittings=10, votes=20, history=2,
+                     start_date=date(2018, 4, 24), seed=1, batch_size=5000, logger=None):
+    """
+    Create the data of a legislatura started on ``start_date``, with
+    ``parliamentarians`` charges (a third of them in the senate),
+    ``sittings`` sittings, one every few days, of ``votes`` votes each,
+    and ``history`` updates of the history cache.
+
+    Return the number of rows written in each table.
+    """
+    rnd = random.Random(seed)
+    writers = dict((model, RowWriter(using, model, batch_size)) for model in (
+        TipoCarica, Politico, Gruppo, GruppoIsMaggioranza, GruppoRamo, Sede,
+        Carica, CaricaHasGruppo, IncaricoGruppo, CaricaInterna, Seduta, Votazione, VotazioneHasCarica,
+        PoliticianHistoryCache,
+    ))
+
+    for i, name in CHARGE_TYPES:
+        writers[TipoCarica].add(id=i, name=name)
+    for i, (name, acronym) in enumerate(GROUPS, 1):
+        writers[Gruppo].add(id=i, name=name, acronym=acronym)
+        writers[GruppoIsMaggioranza].add(id=i, group_id=i, start_date=start_date, maggioranza=int(i <= MAJORITY))
+        for house in 'CS':
+            writers[GruppoRamo].add(id=2 * i - (house == 'C'), group_id=i, house=house, start_date=start_date)
+    for i in range(1, 15):
+        writers[Sede].add(id=i, house='CS'[i % 2], name=u'{0} Commissione'.format(i),
+                          site_type='Commissione permanente', code=str(i), start_date=start_date)
+
+    # charges, by house
+    charges = {'C': [], 'S': []}
+    groups = {}
+    end_dates = {}
+    for p in range(1, parliamentarians + 1):
+        house = 'S' if p % 3 == 0 else 'C'
+        charge_type = 1 if house == 'C' else (5 if p % 300 == 0 else 4)
+        charges[house].append(p)
+        groups[p] = rnd.randint(1, len(GROUPS))
+        end_dates[p] = None if p % 20 else start_date + timedelta(days=rnd.randint(30, 365))
+        writers[Politico].add(id=p, name=u'Nome{0}'.format(p), surname=u'Cognome{0}'.format(p),
+                              gender=rnd.choice('MF'), monitoring_users=rnd.randint(0, 100))
+        writers[Carica].add(
+            id=p, politician_id=p, charge_type_id=charge_type, charge=dict(CHARGE_TYPES)[charge_type],
+            start_date=start_date, end_date=end_dates[p], district=rnd.choice(DISTRICTS),
+            maggioranza_sotto=0, maggioranza_sotto_assente=0, maggioranza_salva=0, maggioranza_salva_assente=0,
+        )
+        writers[CaricaHasGruppo].add(id=p, charge_id=p, group_id=groups[p], start_date=start_date)
+        if p % 10 == 0:
+            writers[IncaricoGruppo].add(id=p // 10, charge_group_id=p, start_date=start_date, charge='Capogruppo')
+        if p % 3 == 0:
+            writers[CaricaInterna].add(id=p // 3, charge_id=p, charge_type_id=3, site_id=1 + p % 14,
+                                       start_date=start_date + timedelta(days=30))
+
+    # votes, counting the presences, absences and rebellions of each charge
+    stats = defaultdict(lambda: defaultdict(int))
+    vote_id = 0
+    vote_charge_id = 0
+    sitting_date = start_date
+    for s in range(1, sittings + 1):
+        house = 'CS'[s % 2 == 0]
+        if house == 'C':
+            sitting_date += timedelta(days=rnd.randint(1, 4))
+        writers[Seduta].add(id=s, date=sitting_date, number=s, house=house, reference_url='', is_imported=1)
+        present = [c for c in charges[house] if end_dates[c] is None or end_dates[c] >= sitting_date]
+        for v in range(1, votes + 1):
+            vote_id += 1
+            majority = rnd.choice(VOTINGS)
+            lines = dict(
+                (g, majority if g <= MAJORITY and rnd.random() < 0.9 else rnd.choice(VOTINGS))
+                for g in range(1, len(GROUPS) + 1)
+            )
+            counts = defaultdict(int)
+            rebels = 0
+            for charge in present:
+                line = lines[groups[charge]]
+                if rnd.random() < 0.1:
+                    voting = rnd.choice(ABSENCES)
+                elif rnd.random() < 0.05:
+                    voting = rnd.choice(VOTINGS)
+                else:
+                    voting = line
+                rebel = int(voting in VOTINGS and voting != line)
+                counts[voting] += 1
+                rebels += rebel
+                charge_stats = stats[charge]
+                charge_stats[voting] += 1
+                charge_stats['ribelle'] += rebel
+                vote_charge_id += 1
+                writers[VotazioneHasCarica].add(id=vote_charge_id, vote_id=vote_id, charge_id=charge, voting=voting,
+                                                rebel=rebel, maggioranza_sotto_salva=0)
+            voters = counts['Favorevole'] + counts['Contrario'] + counts['Astenuto']
+            writers[Votazione].add(
+                id=vote_id, sitting_id=s, numero_votazione=v, titolo=u'Votazione {0}'.format(vote_id),
+                titolo_aggiuntivo='', presenti=voters, votanti=voters - counts['Astenuto'],
+                maggioranza=(voters - counts['Astenuto']) // 2 + 1, astenuti=counts['Astenuto'],
+                favorevoli=counts['Favorevole'], contrari=counts['Contrario'],
+                esito='APPROVATA' if counts['Favorevole'] > counts['Contrario'] else 'RESPINTA',
+                ribelli=rebels, margine=abs(counts['Favorevole'] - counts['Contrario']),
+                tipologia='nominale', descrizione='', url='', finale=int(v == votes), nb_commenti=0,
+                is_imported=1, ut_fav=0, ut_contr=0, is_maggioranza_sotto_salva=0,
+            )
+        if logger and s % 100 == 0:
+            logger.info(u"{0} sittings, {1} votes, {2} individual votes".format(s, vote_id, vote_charge_id))
+
+    # the statistics of the charges are updated on their rows
+    writers[Carica].flush()
+
+    # the history cache is updated at regular intervals, until the last sitting
+    interval = (sitting_date - start_date) / max(history, 1)
+    history_id = 0
+    for house in 'CS':
+        for charge in charges[house]:
+            charge_stats = stats[charge]
+            presenze = sum(charge_stats[voting] for voting in VOTINGS)
+            indice = rnd.uniform(0, 100)
+            for k in range(1, history + 1):
+                history_id += 1
+                share = float(k) / history
+                indice = min(max(indice + rnd.uniform(-5, 5), 0), 100)
+                writers[PoliticianHistoryCache].add(
+                    id=history_id, update_date=start_date + interval * k, chi_tipo='P', chi_id=charge,
+                    group_id=groups[charge], house=house, indice=round(indice, 1),
+                    presenze=round(presenze * share), assenze=round(charge_stats['Assente'] * share),
+                    missioni=round(charge_stats['In missione'] * share),
+                    ribellioni=round(charge_stats['ribelle'] * share),
+                )
+            Carica.objects.using(using).filter(pk=charge).update(
+                presenze=presenze, assenze=charge_stats['Assente'], missioni=charge_stats['In missione'],
+                ribelle=charge_stats['ribelle'], indice=round(indice, 1),
+            )
+
+    for writer in writers.values():
+        writer.flush()
+    return dict((model._meta.db_table, writer.count) for model, writer in writers.items())
@@ -0,0 +1,250 @@
+# coding=utf-8
+from datetime import date
+import glob
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+import numpy as np
+
+from api import testing
+from api.testing import ApiTestCase, Budget, QueryBudgetMixin
+from parlamento.history import VotingHistory
+from parlamento.snapshots import build_snapshot, get_closed_legislature
+from parlamento import lex
+from parlamento.models import Carica, PoliticianHistoryCache, Votazione, VotazioneHasCarica
+from parlamento.synthetic import build_parlamento
+from parlamento.utils import watermarks
+from parlamento.votematrix import VoteMatrix, VoteMatrixNotFound, VoteMatrixWriter, encode_voting, \
+    get_vote_matrix_path, update_vote_matrix, vote_matrices
+
+__author__ = 'daniele'
+
+
+def legislatura(**kwargs):
+    return dict(kwargs, legislatura='18')
+
+
+class ParlamentoQueryBudgetTest(QueryBudgetMixin, ApiTestCase):
+    """
+    Queries and time of each URL, at page sizes 25 and 1000,
+    in the current legislatura.
+    """
+    unmanaged_apps = {'parlamento18': ('parlamento',)}
+    urls_module = 'parlamento.urls'
+    namespace = 'parlamento'
+    budgets = {
+        'legislatura-list': Budget(queries=0),
+        'legislatura-detail': Budget(queries=0, kwargs=legislatura()),
+        'gruppo-list': Budget(queries=2, kwargs=legislatura()),
+        'gruppo-agreement': Budget(queries=0, kwargs=legislatura()),
+        # not implemented
+        'gruppo-detail': Budget(queries=0, kwargs=legislatura(gruppo='1'), status=405),
+        'gruppo-cohesion': Budget(queries=0, kwargs=legislatura(gruppo='1')),
+        'circoscrizione-list': Budget(queries=1, kwargs=legislatura()),
+        # not implemented
+        'circoscrizione-detail': Budget(queries=0, kwargs=legislatura(circoscrizione='Lazio'), status=405),
+        'parlamentare-cache-list': Budget(queries=4, seconds=1.0, kwargs=legislatura()),
+        'parlamentare-cache-detail': Budget(queries=2, kwargs=legislatura(politician_id='1')),
+        'parlamentare-list': Budget(queries=4, seconds=1.0, kwargs=legislatura()),
+        'parlamentare-detail': Budget(queries=7, kwargs=legislatura(politician_id='1')),
+        'parlamentare-votes': Budget(queries=2, seconds=1.0, kwargs=legislatura(politician_id='1')),
+        'sede-list': Budget(queries=2, kwargs=legislatura()),
+        'carica-list': Budget(queries=2, seconds=1.0, kwargs=legislatura()),
+        'seduta-list': Budget(queries=3, kwargs=legislatura()),
+        'seduta-detail': Budget(queries=2, kwargs=legislatura(seduta='1')),
+        'votazione-list': Budget(queries=2, seconds=1.0, kwargs=legislatura()),
+        'votazione-detail': Budget(queries=3, kwargs=legislatura(votazione='1')),
+        'vote-matrix': Budget(queries=0, seconds=1.0, kwargs=legislatura()),
+    }
+
+    def build_data(self):
+        build_parlamento('parlamento18', parliamentarians=60, sittings=15, votes=80)
+        update_vote_matrix('parlamento18')
+
+
+class VoteMatrixTest(ApiTestCase):
+    """
+    The vote matrix is built and updated by its writer,
+    and read by the API (see parlamento.votematrix).
+    """
+    unmanaged_apps = {'parlamento18': ('parlamento',)}
+
+    def build_data(self):
+        build_parlamento('parlamento18', parliamentarians=20, sittings=3, votes=10)
+        self.path = get_vote_matrix_path('parlamento18')
+
+    def test_update(self):
+        self.assertEqual(update_vote_matrix('parlamento18'), Votazione.objects.using('parlamento18').count())
+        matrix = VoteMatrix(self.path)
+        for vote_id, charge_id, voting in VotazioneHasCarica.objects.using('parlamento18').values_list(
+            'vote_id', 'charge_id', 'voting'
+        ):
+            self.assertEqual(matrix.votes[matrix.rows[charge_id], matrix.columns[vote_id]], encode_voting(voting))
+
+        # the matrix is not rewritten, if the data did not change
+        self.assertEqual(update_vote_matrix('parlamento18'), 0)
+        self.assertTrue(matrix.is_current())
+
+    def test_command(self):
+        # legislature with no configured database are skipped, unless asked for
+        unconfigured = lex.LEGISLATURE[16:18]
+        lex.LEGISLATURE[16:18] = [l._replace(database=l.database + '_unconfigured') for l in unconfigured]
+        try:
+            call_command('parlamento_vote_matrix', verbosity=0)
+            self.assertRaises(CommandError, call_command, 'parlamento_vote_matrix', '16', verbosity=0)
+        finally:
+            lex.LEGISLATURE[16:18] = unconfigured
+        self.assertEqual(VoteMatrix(self.path).shape[1], Votazione.objects.using('parlamento18').count())
+
+    def test_readers_of_grown_files(self):
+        update_vote_matrix('parlamento18')
+        reader = VoteMatrix(self.path)
+        expected = np.array(reader.votes)
+        n_rows, n_columns = reader.capacity
+
+        writer = VoteMatrixWriter(self.path)
+        writer.add_votes([(10 ** 6 + n, 1, date(2014, 1, 1)) for n in range(n_columns)])
+        # the index, read while the files are grown, still points to the old files
+        self.assertTrue(np.array_equal(VoteMatrix(self.path).votes, expected))
+        writer.add_charges([(10 ** 6 + n, 1) for n in range(n_rows)])
+        writer.save([], reader.last_update)
+
+        matrix = VoteMatrix(self.path)
+        self.assertEqual(matrix.generation, reader.generation + 2)
+        self.assertEqual(matrix.shape, (expected.shape[0] + n_rows, expected.shape[1] + n_columns))
+        self.assertTrue(np.array_equal(matrix.votes[:expected.shape[0], :expected.shape[1]], expected))
+        self.assertTrue(np.array_equal(reader.votes, expected))
+        self.assertFalse(reader.is_current())
+        # files grown twice are removed, those of the previous index are kept
+        self.assertEqual(sorted(glob.glob(self.path + '.*.votes')), [
+            '{0}.{1}.votes'.format(self.path, reader.generation),
+            '{0}.{1}.votes'.format(self.path, matrix.generation),
+        ])
+
+    def test_service(self):
+        url = reverse('parlamento:vote-matrix', kwargs=legislatura())
+        self.assertRaises(VoteMatrixNotFound, vote_matrices.get, 'parlamento18')
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').status_code, 503)
+
+        update_vote_matrix('parlamento18')
+        matrix = vote_matrices.get('parlamento18')
+        self.assertIs(vote_matrices.get('parlamento18'), matrix)
+        update_vote_matrix('parlamento18', force=True)
+        self.assertIsNot(vote_matrices.get('parlamento18'), matrix)
+
+        self.assertEqual(self.client.get(url, {'limit': 10}, HTTP_ACCEPT='application/json').status_code, 200)
+        self.assertEqual(self.client.get(url, {'limit': 0}, HTTP_ACCEPT='application/json').status_code, 400)
+
+
+class SnapshotsTest(TestCase):
+    """
+    Snapshots are only built for legislature with a configured database
+    (see parlamento.snapshots).
+    """
+
+    def test_unconfigured_database(self):
+        current = lex.LEGISLATURE[16]
+        lex.LEGISLATURE[16] = current._replace(database='parlamento16_unconfigured')
+        try:
+            self.assertNotIn(16, [l.number for l in get_closed_legislature()])
+            self.assertRaises(ValueError, build_snapshot, lex.LEGISLATURE[16], path='/nowhere/16.sqlite')
+        finally:
+            lex.LEGISLATURE[16] = current
+
+
+class SyntheticDataTest(ApiTestCase):
+    """
+    Synthetic data are consistent (see parlamento.synthetic).
+    """
+    unmanaged_apps = {'parlamento18': ('parlamento',)}
+
+    def test_charge_statistics(self):
+        build_parlamento('parlamento18', parliamentarians=10, sittings=3, votes=10)
+        # the statistics of the charges are counted on their votes
+        for charge in Carica.objects.using('parlamento18').all():
+            votes = VotazioneHasCarica.objects.using('parlamento18').filter(charge=charge)
+            self.assertEqual(charge.assenze, votes.filter(voting='Assente').count())
+            self.assertEqual(charge.ribelle, votes.filter(rebel=1).count())
+            self.assertIsNotNone(charge.presenze)
+            self.assertIsNotNone(charge.indice)
+
+
+class VotingHistoryTest(ApiTestCase):
+    """
+    Pages of the voting history are walked with cursors
+    (see parlamento.history).
+    """
+    unmanaged_apps = {'parlamento18': ('parlamento',)}
+
+    def build_data(self):
+        build_parlamento('parlamento18', parliamentarians=10, sittings=3, votes=10)
+
+    def test_pages(self):
+        # charges that voted on the same votes, as the charges of a politician may
+        charge_ids = list(Carica.objects.using('parlamento18').values_list('id', flat=True)[:3])
+        history = VotingHistory('parlamento18', charge_ids, chunk_size=7)
+        rows = list(history.rows())
+        self.assertEqual(len(rows), VotazioneHasCarica.objects.using('parlamento18').filter(
+            charge__in=charge_ids
+        ).count())
+        self.assertEqual(len(set((r['vote_id'], r['charge_id']) for r in rows)), len(rows))
+
+        pages, position = [], None
+        while True:
+            page, position = history.page(position, size=4)
+            pages.extend(page)
+            if position is None:
+                break
+            position = history.decode_cursor(history.encode_cursor(position))
+        self.assertEqual(pages, rows)
+
+
+class ConditionalGetTest(ApiTestCase):
+    """
+    Conditional GETs are answered with 304 from the last update
+    of the legislatura, or from its end date, once closed
+    (see api.mixins.ConditionalGetMixin).
+    """
+    unmanaged_apps = {'parlamento18': ('parlamento',)}
+
+    def build_data(self):
+        build_parlamento('parlamento18', parliamentarians=10, sittings=2, votes=5)
+
+    def get(self, **headers):
+        with testing.CaptureAllQueriesContext() as context:
+            response = self.client.get(
+                reverse('parlamento:gruppo-list', kwargs=legislatura()), HTTP_ACCEPT='application/json', **headers
+            )
+        return response, len(context)
+
+    def test_not_modified(self):
+        response, queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response, queries = self.get(**headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(queries, 0)
+
+        # a new import gives a new ETag
+        PoliticianHistoryCache.objects.using('parlamento18').update(update_date=date(2030, 1, 1))
+        watermarks.invalidate()
+        response, queries = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        # once closed, the data are valid until the end date, and cached longer
+        current = lex.LEGISLATURE[18]
+        lex.LEGISLATURE[18] = current._replace(end_date=date(2031, 1, 1))
+        try:
+            response, queries = self.get(HTTP_IF_NONE_MATCH=etag)
+        finally:
+            lex.LEGISLATURE[18] = current
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=2592000')
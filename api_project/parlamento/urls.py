@@ -7,7 +7,9 @@ __author__ = 'daniele'
 
 urls = [
     url(r'^groups$', views.GruppoListView.as_view(), name='gruppo-list'),
+    url(r'^groups/agreement$', views.GruppoAgreementView.as_view(), name='gruppo-agreement'),
     url(r'^groups/(?P<gruppo>[\w_.-]+)$', views.GruppoDetail.as_view(), name='gruppo-detail'),
+    url(r'^groups/(?P<gruppo>[0-9]+)/cohesion$', views.GruppoCohesionView.as_view(), name='gruppo-cohesion'),
     url(r'^districts$', views.CircoscrizioneListView.as_view(), name='circoscrizione-list'),
     url(r'^districts/(?P<circoscrizione>[\w_.-]+)$', views.CircoscrizioneDetailView.as_view(), name='circoscrizione-detail'),
 
@@ -24,6 +26,9 @@ urls = [
     url(r'^parliamentarians/(?P<politician_id>[0-9]+)$',
         views.ParlamentareDetailView.as_view(),
         name='parlamentare-detail'),
+    url(r'^parliamentarians/(?P<politician_id>[0-9]+)/votes$',
+        views.ParlamentareVotesView.as_view(),
+        name='parlamentare-votes'),
 
     url(r'^sites$', views.SedeListView.as_view(), name='sede-list'),
     url(r'^charges$', views.CaricaListView.as_view(), name='carica-list'),
@@ -31,6 +36,7 @@ urls = [
     url(r'^sittings/(?P<seduta>[0-9]+)$', views.SedutaDetailView.as_view(), name='seduta-detail'),
     url(r'^votes$', views.VotazioneListView.as_view(), name='votazione-list'),
     url(r'^votes/(?P<votazione>[0-9]+)$', views.VotazioneDetailView.as_view(), name='votazione-detail'),
+    url(r'^vote-matrix$', views.VoteMatrixView.as_view(), name='vote-matrix'),
 ]
 
 urlpatterns = [
@@ -1,7 +1,9 @@
 from urllib import urlencode
 
+from django.conf import settings
 from django.db.models import Max
-from rest_framework.reverse import reverse
+from api.reverse import reverse
+from api.watermarks import Watermark
 
 from parlamento.models import PoliticianHistoryCache
 
@@ -16,10 +18,34 @@ def get_legislatura_from_request(request):
     return request.resolver_match.kwargs.get('legislatura', None)
 
 
+class LastUpdateWatermark(Watermark):
+    """
+    Last update date of the parliament data, for each database,
+    taken from the latest snapshot in ``opp_politician_history_cache``.
+
+    The aggregate is slow on the huge snapshot table, so its value is kept
+    for ``PARLAMENTO_LAST_UPDATE_TTL`` seconds (60 by default).
+    """
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'PARLAMENTO_LAST_UPDATE_TTL', 60)
+
+    def query(self, db_alias):
+        return PoliticianHistoryCache.objects.using(db_alias).aggregate(
+            last_update=Max('update_date')
+        )['last_update']
+
+
+watermarks = LastUpdateWatermark()
+
+
 def get_last_update(db_alias):
-    return PoliticianHistoryCache.objects.using(db_alias).aggregate(
-        last_update=Max('update_date')
-    )['last_update']
+    """
+    Return the last update date of the data of the given database (memoized).
+    """
+    return watermarks.get(db_alias)
 
 
 def reverse_url(name, request, format=None, legislatura=None, args=None, kwargs=None, filters=None):
@@ -2,23 +2,33 @@
 from datetime import date
 from collections import OrderedDict as odict
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections
 from django.db.models import Q
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.compat import parse_date
+from rest_framework.exceptions import APIException, ParseError
 from rest_framework.filters import DjangoFilterBackend
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.templatetags.rest_framework import replace_query_param
 
-from rest_framework import generics, filters
+from rest_framework import generics, filters, status
+from api.mixins import ConditionalGetMixin, StreamingRenderMixin
 from parlamento import lex
+from parlamento.rankings import rankings
+from parlamento.snapshots import get_snapshot_alias
+from parlamento.history import VotingHistory
+from parlamento.cohesion import group_cohesion, groups_agreement
+from parlamento.votematrix import vote_matrices, VoteMatrixNotFound, VOTINGS, NO_VOTE, OTHER, decode_voting
 from parlamento.models import Carica, Gruppo, PoliticianHistoryCache, Seduta, Votazione, Sede, \
     Politico
-from parlamento.serializers import CaricaSerializer, GruppoSerializer, CustomPaginationSerializer, ParlamentareCacheSerializer, \
-       ParlamentareInlineSerializer, VotazioneSerializer, SedutaSerializer, VotazioneDettagliataSerializer, SedeSerializer, \
-    PoliticoSerializer, CaricaInlineSerializer, \
-    ParlamentareCacheInlineSerializer
+from parlamento.serializers import CustomPaginationSerializer, ParlamentareCacheSerializer, \
+       ParlamentareInlineSerializer, SedutaSerializer, VotazioneDettagliataSerializer, CaricaInlineSerializer, \
+    ParlamentareCacheInlineSerializer, GruppoFlatSerializer, SedeFlatSerializer, VotazioneFlatSerializer
 from parlamento.utils import reverse_url, get_legislatura_from_request, get_last_update
 
 
@@ -32,16 +42,44 @@ class DBSelectBackend(object):
         return queryset.using(db_alias)
 
 
-class APILegislaturaMixin(object):
+class APILegislaturaMixin(ConditionalGetMixin, StreamingRenderMixin):
     """
-    All views in this module extends this class
+    All views in this module extends this class;
+    responses are cached, and validated by conditional requests,
+    until the data of the legislatura is updated
+    (see ``api.mixins.ConditionalGetMixin``), and large lists are streamed
+    (see ``api.mixins.StreamingRenderMixin``)
     """
     filter_backends = (DBSelectBackend, DjangoFilterBackend)
 
+    def get_response_cache_namespace(self):
+        return self.db_alias
+
+    def get_response_cache_watermark(self):
+        """
+        The data of closed legislatures do not change after their end date
+        """
+        legislatura = lex.get_legislatura(self.legislatura)
+        if legislatura.end_date is not None:
+            return legislatura.end_date
+        return get_last_update(self.db_alias)
+
+    def get_cache_max_age(self):
+        if lex.get_legislatura(self.legislatura).end_date is not None:
+            return getattr(settings, 'PARLAMENTO_CLOSED_MAX_AGE', 30 * 86400)
+        return getattr(settings, 'PARLAMENTO_MAX_AGE', 3600)
+
     @property
     def db_alias(self):
+        """
+        Closed legislatures are read from their snapshot, when it exists
+        (see ``parlamento.snapshots``), others from their database.
+        """
         legislatura = lex.get_legislatura(self.legislatura)
-        if legislatura.database is None:
+        snapshot_alias = get_snapshot_alias(legislatura)
+        if snapshot_alias is not None:
+            return snapshot_alias
+        if legislatura.database is None or legislatura.database not in connections.databases:
             raise Http404("Legislatura {0} not found".format(legislatura))
         return legislatura.database
 
@@ -109,7 +147,7 @@ class LegislaturaDetailView(APILegislaturaMixin, APIView):
 
 class GruppoListView(APILegislaturaMixin, generics.ListAPIView):
     queryset = Gruppo.objects.all()
-    serializer_class = GruppoSerializer
+    serializer_class = GruppoFlatSerializer
 
 
 class GruppoDetail(APILegislaturaMixin, APIView):
@@ -118,7 +156,7 @@ class GruppoDetail(APILegislaturaMixin, APIView):
 
 class SedeListView(APILegislaturaMixin, generics.ListAPIView):
     queryset = Sede.objects.all()
-    serializer_class = SedeSerializer
+    serializer_class = SedeFlatSerializer
 
 
 class CircoscrizioneListView(APILegislaturaMixin, APIView):
@@ -302,7 +340,7 @@ class ParlamentareListView(APILegislaturaMixin, generics.ListAPIView):
     serializer_class = ParlamentareInlineSerializer
     pagination_serializer_class = CustomPaginationSerializer
     queryset = Politico.objects\
-        .select_related('charge', 'charge__charge_type')
+        .prefetch_related('charges__charge_type')
     filter_backends = APILegislaturaMixin.filter_backends + (filters.OrderingFilter,)
     ordering = ('surname', 'name')
 
@@ -441,19 +479,9 @@ class ParlamentareDetailView(APILegislaturaMixin, generics.RetrieveAPIView):
         explicitly build the queryset using ``using``.
         """
 
-        # list of all indici, sorted,
-        # used to get the position of the politician
-        # in a global ranking
-        # TODO: this could be cached into a redis key
-        #       with a 120 minutes timeout
-        indici = list(
-            Carica.objects.using('parlamento17').filter(
-                charge_type_id__in=[1, 4, 5],
-                end_date__isnull=True,
-                indice__isnull=False
-            ).values_list('indice', flat=True).
-                order_by('-indice')
-        )
+        # positions of the politician in the global rankings
+        # of the active parliamentarians, shared by all requests
+        ranking = rankings.get(self.db_alias)
 
         # huge prefetch, to make all queries at once
         # usually it gets faster
@@ -530,11 +558,6 @@ class ParlamentareDetailView(APILegislaturaMixin, generics.RetrieveAPIView):
             except TypeError:
                 show_statistics = False
 
-            try:
-                indice_pos = indici.index(c.indice) + 1
-            except ValueError:
-                indice_pos = None
-
             try:
                 rebellions_perc = "{0:.2f}".format(100. * c.ribelle / c.presenze)
             except (ZeroDivisionError,TypeError) as e:
@@ -555,7 +578,10 @@ class ParlamentareDetailView(APILegislaturaMixin, generics.RetrieveAPIView):
                     ('rebellions', c.ribelle),
                     ('rebellions_perc', rebellions_perc),
                     ('productivity_index', c.indice),
-                    ('productivity_index_pos', indice_pos)
+                    ('productivity_index_pos', ranking.position('indice', c.indice)),
+                    ('presences_pos', ranking.position('presenze', c.presenze)),
+                    ('absences_pos', ranking.position('assenze', c.assenze)),
+                    ('rebellions_pos', ranking.position('ribelle', c.ribelle)),
                 ])
 
             charges.append(c_dict)
@@ -599,6 +625,7 @@ class CaricaListView(APILegislaturaMixin, generics.ListAPIView):
     """
 
     model = Carica
+    queryset = model.objects.select_related('politician', 'charge_type')
     serializer_class = CaricaInlineSerializer
     pagination_serializer_class = CustomPaginationSerializer
 
@@ -674,7 +701,7 @@ class SedutaDetailView(APILegislaturaMixin, generics.RetrieveAPIView):
 class VotazioneListView(APILegislaturaMixin, generics.ListAPIView):
     queryset = Votazione.objects.select_related('seduta')
     model = Votazione
-    serializer_class = VotazioneSerializer
+    serializer_class = VotazioneFlatSerializer
     filter_fields = ('esito', 'is_imported', 'tipologia', )
 
     def filter_queryset(self, *args, **kwargs):
@@ -696,3 +723,199 @@ class VotazioneDetailView(APILegislaturaMixin, generics.RetrieveAPIView):
     serializer_class = VotazioneDettagliataSerializer
 
 
+
+
+class VoteMatrixUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The vote matrix of the legislatura has not been built yet.'
+
+
+class VoteMatrixMixin(APILegislaturaMixin):
+    """
+    Parsing of the filters of the views on the vote matrix.
+    """
+
+    def get_vote_matrix(self):
+        try:
+            return vote_matrices.get(self.db_alias)
+        except VoteMatrixNotFound:
+            raise VoteMatrixUnavailable()
+
+    def get_int_list(self, name):
+        value = self.request.QUERY_PARAMS.get(name, None)
+        if not value:
+            return None
+        try:
+            return [int(v) for v in value.split(',')]
+        except ValueError:
+            raise ParseError("{0} must be a comma separated list of integers".format(name))
+
+    def get_date(self, name):
+        value = self.request.QUERY_PARAMS.get(name, None)
+        if not value:
+            return None
+        try:
+            d = parse_date(value)
+        except ValueError:
+            d = None
+        if d is None:
+            raise ParseError("{0} must be a date (YYYY-MM-DD)".format(name))
+        return d
+
+
+class VoteMatrixView(VoteMatrixMixin, APIView):
+    """
+    Votes of the parliamentarians, read from the vote matrix
+    of the legislature (see ``parlamento.votematrix``).
+
+    Filters:
+
+    - `charges` - comma separated list of charge ids
+    - `group` - members of the group (votes cast out of the group are `0`)
+    - `date_from`, `date_to` - votes in the given period (YYYY-MM-DD)
+    - `offset`, `limit` - page of the votes (at most 5000)
+
+    Votes are encoded as in `votings`; the `rebels` of each charge
+    are the ids of the votes in which the charge rebelled.
+    """
+    default_limit = 500
+    max_limit = 5000
+
+    def get(self, request, **kwargs):
+        charge_ids = self.get_int_list('charges')
+        group_id = self.get_int_list('group')
+        if group_id is not None and len(group_id) != 1:
+            raise ParseError("group must be a single group id")
+        date_from, date_to = self.get_date('date_from'), self.get_date('date_to')
+        try:
+            offset = max(int(request.QUERY_PARAMS.get('offset', 0)), 0)
+            limit = min(int(request.QUERY_PARAMS.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ParseError("offset and limit must be integers")
+        if limit <= 0:
+            raise ParseError("limit must be a positive integer")
+
+        matrix = self.get_vote_matrix()
+        rows, columns, votes, rebels = matrix.slice(
+            charge_ids=charge_ids,
+            group_id=group_id[0] if group_id else None,
+            date_from=date_from, date_to=date_to
+        )
+        page = slice(offset, offset + limit)
+        vote_ids = matrix.vote_ids[columns[page]].tolist()
+
+        parliamentarians = []
+        for n, row in enumerate(rows.tolist()):
+            parliamentarians.append(odict([
+                ('charge_id', int(matrix.charge_ids[row])),
+                ('politician_id', int(matrix.politician_ids[row])),
+                ('votes', votes[n, page].tolist()),
+                ('rebels', [vote_ids[i] for i in rebels[n, page].nonzero()[0].tolist()]),
+            ]))
+
+        return Response(odict([
+            ('votings', [
+                odict([('code', code), ('voting', decode_voting(code))])
+                for code in [NO_VOTE] + range(1, len(VOTINGS) + 1) + [OTHER]
+            ]),
+            ('count', len(columns)),
+            ('offset', offset),
+            ('limit', limit),
+            ('votes', vote_ids),
+            ('parliamentarians', parliamentarians),
+        ]))
+
+
+class GruppoCohesionView(VoteMatrixMixin, APIView):
+    """
+    Cohesion of a **Group** in the votes, computed on the votes cast
+    by its members while they were members:
+
+    - `cohesion` - mean agreement index of the group in the votes
+    - `unanimous_votes` - votes in which all members voted the same way
+    - `rebellion_rate` - rebellions of the members, over their votes
+
+    and for each member the `votes` cast, the `rebellions`
+    and the `loyalty`, the share of the votes in which the member
+    voted as the majority of the group.
+
+    Filters: `date_from`, `date_to` (YYYY-MM-DD).
+    """
+
+    def get(self, request, **kwargs):
+        date_from, date_to = self.get_date('date_from'), self.get_date('date_to')
+        try:
+            group_id = int(kwargs['gruppo'])
+        except ValueError:
+            raise Http404("Gruppo {0} not found".format(kwargs['gruppo']))
+
+        matrix = self.get_vote_matrix()
+        if group_id not in matrix.membership_groups:
+            raise Http404("Gruppo {0} not found".format(group_id))
+        return Response(group_cohesion(matrix, group_id, date_from, date_to))
+
+
+class GruppoAgreementView(VoteMatrixMixin, APIView):
+    """
+    Agreement between each pair of **Groups**: the share of the votes
+    in which both groups took a position, and it was the same.
+
+    `votes` holds the number of votes in which both groups took a position,
+    `agreement` the share, in the same order of `groups`.
+
+    Filters: `date_from`, `date_to` (YYYY-MM-DD).
+    """
+
+    def get(self, request, **kwargs):
+        date_from, date_to = self.get_date('date_from'), self.get_date('date_to')
+        matrix = self.get_vote_matrix()
+        return Response(groups_agreement(matrix, date_from, date_to))
+
+
+class ParlamentareVotesView(APILegislaturaMixin, APIView):
+    """
+    All votes cast by a **Parliamentarian**, in all its charges,
+    sorted by sitting date and vote number.
+
+    Pages are walked with the opaque `next` cursor url;
+    the page size can be set with `page_size`.
+
+    With `stream=ndjson` the whole history is streamed,
+    one json object per line.
+    """
+
+    def get(self, request, **kwargs):
+        charge_ids = list(Carica.objects.using(self.db_alias).filter(
+            politician_id=kwargs['politician_id']
+        ).values_list('id', flat=True))
+        if not charge_ids:
+            raise Http404("Parliamentarian {0} not found".format(kwargs['politician_id']))
+        history = VotingHistory(self.db_alias, charge_ids)
+
+        stream_format = request.QUERY_PARAMS.get('stream', None)
+        if stream_format:
+            if stream_format != 'ndjson':
+                raise ParseError("stream must be one of: ndjson")
+            return StreamingHttpResponse(history.ndjson(), content_type=VotingHistory.content_type)
+
+        try:
+            page_size = int(request.QUERY_PARAMS.get(
+                api_settings.PAGINATE_BY_PARAM or 'page_size', api_settings.PAGINATE_BY or 25
+            ))
+            if api_settings.MAX_PAGINATE_BY:
+                page_size = min(page_size, api_settings.MAX_PAGINATE_BY)
+            token = request.QUERY_PARAMS.get('cursor', None)
+            position = history.decode_cursor(token) if token else None
+        except ValueError as e:
+            raise ParseError(str(e))
+
+        rows, next_position = history.page(position, max(page_size, 1))
+        next_url = None
+        if next_position is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', history.encode_cursor(next_position)
+            )
+        return Response(odict([
+            ('next', next_url),
+            ('results', rows),
+        ]))
@@ -0,0 +1,498 @@
+# coding=utf-8
+"""
+Vote matrix of a legislature: one row for each charge (``Carica``),
+one column for each vote (``Votazione``), and the encoded ``voting``
+of ``VotazioneHasCarica`` as ``int8`` values (see ``VOTINGS``).
+
+The rebels are kept in a bitmap with the same rows and columns,
+packed in bytes (8 votes in a byte).
+
+Both are memory-mapped files, one pair for each database alias,
+in ``PARLAMENTO_VOTE_MATRIX_DIR``, with an index (``.npz``) of
+the ids of the rows and columns, the dates of the votes and the
+group memberships of the charges. Files are allocated with spare
+rows and columns, so that the votes of new sittings are appended
+in place (see ``update_vote_matrix``), and only the index is
+rewritten; readers see the new votes once the index is replaced.
+When more room is needed, the files are copied into larger ones,
+with a new generation number, that only the new index points to:
+readers of the old index keep reading the old files.
+
+Matrices are built and updated by the ``parlamento_vote_matrix``
+management command, after each import, never by the API:
+they are shared by all requests of a process, and read again
+when their index is replaced.
+"""
+from datetime import date
+import fcntl
+import glob
+import os
+import threading
+
+from django.conf import settings
+import numpy as np
+
+from parlamento.models import Carica, CaricaHasGruppo, Votazione, VotazioneHasCarica
+from parlamento.utils import watermarks
+
+__author__ = 'daniele'
+
+
+# values of ``VotazioneHasCarica.voting``, encoded with their position + 1
+VOTINGS = (
+    'Favorevole',
+    'Contrario',
+    'Astenuto',
+    'Assente',
+    'In missione',
+    'Presidente',
+    'Richiedente la votazione e non votante',
+    'Voto segreto',
+)
+NO_VOTE = 0  # the charge was not in office
+OTHER = -1   # any other (or empty) voting
+
+VOTE_CODES = dict((voting.lower(), n + 1) for n, voting in enumerate(VOTINGS))
+
+# dates are stored as ordinals; memberships with no end are open
+NO_DATE = 0
+MAX_DATE = date.max.toordinal()
+
+# minimum rows and columns allocated in the files
+MIN_ROWS = 64
+MIN_COLUMNS = 256
+
+
+def encode_voting(voting):
+    return VOTE_CODES.get((voting or '').strip().lower(), OTHER)
+
+
+def decode_voting(code):
+    if code == NO_VOTE:
+        return None
+    if 0 < code <= len(VOTINGS):
+        return VOTINGS[code - 1]
+    return 'Altro'
+
+
+def to_ordinal(d):
+    return d.toordinal() if d is not None else NO_DATE
+
+
+def from_ordinal(n):
+    return date.fromordinal(n) if n != NO_DATE else None
+
+
+def get_vote_matrix_dir():
+    return getattr(settings, 'PARLAMENTO_VOTE_MATRIX_DIR', None)
+
+
+def get_vote_matrix_path(db_alias):
+    """Return the path of the files of the matrix, without extension"""
+    matrix_dir = get_vote_matrix_dir()
+    if not matrix_dir:
+        raise ValueError("PARLAMENTO_VOTE_MATRIX_DIR is not set")
+    return os.path.join(matrix_dir, db_alias)
+
+
+def get_data_path(path, generation, ext):
+    """Return the path of the .votes or .rebels file of a generation"""
+    return '{0}.{1}{2}'.format(path, generation, ext)
+
+
+def remove_data_files(path, keep=()):
+    """Remove the data files of all generations of the matrix, but the ``keep`` ones"""
+    for ext in ('.votes', '.rebels'):
+        for data_path in glob.glob(get_data_path(path, '*', ext)):
+            generation = data_path[len(path) + 1:-len(ext)]
+            if generation.isdigit() and int(generation) not in keep:
+                os.remove(data_path)
+
+
+def remove_vote_matrix(path):
+    """Remove the index and the data files of the matrix"""
+    if os.path.exists(path + '.npz'):
+        os.remove(path + '.npz')
+    remove_data_files(path)
+
+
+class VoteMatrixNotFound(Exception):
+    """The matrix of the database has not been built yet"""
+
+
+class VoteMatrix(object):
+    """
+    Read-only view of the vote matrix files of a database.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.stat = self.get_index_stat(path)
+
+        index = np.load(path + '.npz')
+        self.charge_ids = index['charge_ids']
+        self.politician_ids = index['politician_ids']
+        self.vote_ids = index['vote_ids']
+        self.vote_dates = index['vote_dates']
+        self.sitting_ids = index['sitting_ids']
+        self.membership_rows = index['membership_rows']
+        self.membership_groups = index['membership_groups']
+        self.membership_starts = index['membership_starts']
+        self.membership_ends = index['membership_ends']
+        self.capacity = tuple(int(n) for n in index['capacity'])
+        self.generation = int(index['generation'])
+        self.last_update = from_ordinal(int(index['last_update']))
+        index.close()
+
+        rows, columns = self.capacity
+        self._votes = np.memmap(get_data_path(path, self.generation, '.votes'),
+                                dtype=np.int8, mode=mode, shape=(rows, columns))
+        self._rebels = np.memmap(get_data_path(path, self.generation, '.rebels'),
+                                 dtype=np.uint8, mode=mode, shape=(rows, columns // 8))
+
+        self.rows = dict((charge_id, n) for n, charge_id in enumerate(self.charge_ids.tolist()))
+        self.columns = dict((vote_id, n) for n, vote_id in enumerate(self.vote_ids.tolist()))
+
+    @property
+    def shape(self):
+        return len(self.charge_ids), len(self.vote_ids)
+
+    @property
+    def votes(self):
+        """The (memory-mapped) encoded votes"""
+        n_rows, n_columns = self.shape
+        return self._votes[:n_rows, :n_columns]
+
+    @staticmethod
+    def get_index_stat(path):
+        st = os.stat(path + '.npz')
+        return st.st_ino, st.st_mtime
+
+    def is_current(self):
+        """
+        Tell if the index was not replaced since the matrix was read.
+        """
+        try:
+            return self.get_index_stat(self.path) == self.stat
+        except OSError:
+            return False
+
+    def charge_rows(self, charge_ids):
+        """Return the rows of the given charges (unknown charges are skipped)"""
+        return np.array([self.rows[c] for c in charge_ids if c in self.rows], dtype=np.intp)
+
+    def group_rows(self, group_id, date_from=None, date_to=None):
+        """
+        Return the rows of the charges that were members of the group
+        (in the given period, if any).
+        """
+        mask = self.membership_groups == group_id
+        if date_from is not None:
+            mask &= self.membership_ends >= to_ordinal(date_from)
+        if date_to is not None:
+            mask &= self.membership_starts <= to_ordinal(date_to)
+        return np.unique(self.membership_rows[mask])
+
+    def date_columns(self, date_from=None, date_to=None):
+        """Return the columns of the votes in the given period"""
+        mask = np.ones(len(self.vote_ids), dtype=bool)
+        if date_from is not None:
+            mask &= self.vote_dates >= to_ordinal(date_from)
+        if date_to is not None:
+            mask &= self.vote_dates <= to_ordinal(date_to)
+        return np.flatnonzero(mask)
+
+    def membership_mask(self, group_id, rows, columns):
+        """
+        Return a boolean matrix, for the given rows and columns,
+        telling if the charge was a member of the group at the date of the vote.
+        """
+        mask = np.zeros((len(rows), len(columns)), dtype=bool)
+        positions = dict((row, n) for n, row in enumerate(np.asarray(rows).tolist()))
+        dates = self.vote_dates[columns]
+        group = self.membership_groups == group_id
+        for row, start, end in zip(
+            self.membership_rows[group].tolist(),
+            self.membership_starts[group].tolist(),
+            self.membership_ends[group].tolist(),
+        ):
+            if row in positions:
+                mask[positions[row]] |= (dates >= start) & (dates <= end)
+        return mask
+
+    def select(self, rows, columns):
+        """Return (a copy of) the encoded votes of the given rows and columns"""
+        n_rows, n_columns = self.shape
+        return np.array(self._votes[:n_rows, :n_columns][np.ix_(rows, columns)])
+
+    def select_rebels(self, rows, columns):
+        """Return the rebel bitmap (as booleans) of the given rows and columns"""
+        n_bytes = (len(self.vote_ids) + 7) // 8
+        bits = np.unpackbits(self._rebels[np.asarray(rows, dtype=np.intp), :n_bytes], axis=1)
+        return bits[:, columns].astype(bool)
+
+    def slice(self, charge_ids=None, group_id=None, date_from=None, date_to=None):
+        """
+        Return the rows, the columns, the encoded votes and the rebels
+        of the given charges, or of the members of the group, in the given period.
+
+        Votes of charges out of the group, at the date of the vote,
+        are returned as NO_VOTE.
+        """
+        if group_id is not None:
+            rows = self.group_rows(group_id, date_from, date_to)
+        elif charge_ids is not None:
+            rows = self.charge_rows(charge_ids)
+        else:
+            rows = np.arange(len(self.charge_ids))
+        if charge_ids is not None and group_id is not None:
+            rows = np.intersect1d(rows, self.charge_rows(charge_ids))
+        columns = self.date_columns(date_from, date_to)
+
+        votes = self.select(rows, columns)
+        rebels = self.select_rebels(rows, columns)
+        if group_id is not None:
+            mask = self.membership_mask(group_id, rows, columns)
+            votes[~mask] = NO_VOTE
+            rebels &= mask
+        return rows, columns, votes, rebels
+
+
+class VoteMatrixWriter(object):
+    """
+    Appends the votes of new sittings to the files of a matrix,
+    creating them at the first run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path + '.npz'):
+            matrix = VoteMatrix(path)
+            self.charge_ids = matrix.charge_ids.tolist()
+            self.politician_ids = matrix.politician_ids.tolist()
+            self.vote_ids = matrix.vote_ids.tolist()
+            self.vote_dates = matrix.vote_dates.tolist()
+            self.sitting_ids = matrix.sitting_ids.tolist()
+            self.capacity = matrix.capacity
+            self.generation = matrix.generation
+            self.last_update = matrix.last_update
+            del matrix
+        else:
+            self.charge_ids, self.politician_ids = [], []
+            self.vote_ids, self.vote_dates, self.sitting_ids = [], [], []
+            self.capacity = (0, 0)
+            self.generation = 0
+            self.last_update = None
+        # generation of the files of the current index
+        self.saved_generation = self.generation
+        self.rows = dict((charge_id, n) for n, charge_id in enumerate(self.charge_ids))
+        self.columns = dict((vote_id, n) for n, vote_id in enumerate(self.vote_ids))
+        self.votes = self.rebels = None
+        if self.capacity != (0, 0):
+            self._open()
+
+    def _open(self):
+        rows, columns = self.capacity
+        self.votes = np.memmap(get_data_path(self.path, self.generation, '.votes'),
+                               dtype=np.int8, mode='r+', shape=(rows, columns))
+        self.rebels = np.memmap(get_data_path(self.path, self.generation, '.rebels'),
+                                dtype=np.uint8, mode='r+', shape=(rows, columns // 8))
+
+    def reserve(self, n_rows, n_columns):
+        """
+        Make room for n_rows rows and n_columns columns,
+        doubling the allocated size, when needed.
+
+        Grown files are written with a new generation number,
+        and only used by the index written by ``save``,
+        so that the readers of the old files are not affected.
+        """
+        rows, columns = self.capacity
+        if self.votes is not None and n_rows <= rows and n_columns <= columns:
+            return
+        new_rows = max(n_rows, rows * 2 if n_rows > rows else rows, MIN_ROWS)
+        new_columns = max(n_columns, columns * 2 if n_columns > columns else columns, MIN_COLUMNS)
+        new_columns += -new_columns % 8
+
+        generation = self.generation + 1
+        used_rows, used_columns = len(self.charge_ids), len(self.vote_ids)
+        for ext, dtype, width, old, used in (
+            ('.votes', np.int8, new_columns, self.votes, used_columns),
+            ('.rebels', np.uint8, new_columns // 8, self.rebels, (used_columns + 7) // 8),
+        ):
+            data = np.memmap(get_data_path(self.path, generation, ext), dtype=dtype, mode='w+', shape=(new_rows, width))
+            if old is not None:
+                data[:used_rows, :used] = old[:used_rows, :used]
+            data.flush()
+            del data
+
+        # files grown twice in the same update are not used by any index
+        self.votes = self.rebels = None
+        if self.generation != self.saved_generation:
+            remove_data_files(self.path, keep=(self.saved_generation, generation))
+        self.generation = generation
+        self.capacity = (new_rows, new_columns)
+        self._open()
+
+    def add_votes(self, votes):
+        """Add the (id, sitting id, date) of new votes as columns"""
+        self.reserve(len(self.charge_ids), len(self.vote_ids) + len(votes))
+        for vote_id, sitting_id, vote_date in votes:
+            self.columns[vote_id] = len(self.vote_ids)
+            self.vote_ids.append(vote_id)
+            self.sitting_ids.append(sitting_id)
+            self.vote_dates.append(to_ordinal(vote_date))
+
+    def add_charges(self, charges):
+        """Add the (id, politician id) of new charges as rows"""
+        self.reserve(len(self.charge_ids) + len(charges), len(self.vote_ids))
+        for charge_id, politician_id in charges:
+            self.rows[charge_id] = len(self.charge_ids)
+            self.charge_ids.append(charge_id)
+            self.politician_ids.append(politician_id)
+
+    def set_votes(self, rows):
+        """Write the (vote id, charge id, voting, rebel) rows"""
+        if not rows:
+            return
+        vote_ids, charge_ids, votings, rebels = zip(*rows)
+        r = np.array([self.rows[c] for c in charge_ids], dtype=np.intp)
+        c = np.array([self.columns[v] for v in vote_ids], dtype=np.intp)
+        self.votes[r, c] = np.array([encode_voting(v) for v in votings], dtype=np.int8)
+
+        rebel = np.array(rebels, dtype=bool)
+        r, c = r[rebel], c[rebel]
+        np.bitwise_or.at(self.rebels, (r, c >> 3), (0x80 >> (c & 7)).astype(np.uint8))
+
+    def save(self, memberships, last_update):
+        """
+        Flush the matrices and replace the index,
+        with the given (charge id, group id, start date, end date) memberships.
+
+        The files of the generation before the previous index are removed:
+        those of the previous one may still be opened by readers that just
+        read the previous index.
+        """
+        self.votes.flush()
+        self.rebels.flush()
+
+        memberships = [m for m in memberships if m[0] in self.rows]
+        index = dict(
+            charge_ids=np.array(self.charge_ids, dtype=np.int64),
+            politician_ids=np.array(self.politician_ids, dtype=np.int64),
+            vote_ids=np.array(self.vote_ids, dtype=np.int64),
+            vote_dates=np.array(self.vote_dates, dtype=np.int32),
+            sitting_ids=np.array(self.sitting_ids, dtype=np.int64),
+            membership_rows=np.array([self.rows[m[0]] for m in memberships], dtype=np.intp),
+            membership_groups=np.array([m[1] for m in memberships], dtype=np.int64),
+            membership_starts=np.array([to_ordinal(m[2]) for m in memberships], dtype=np.int32),
+            membership_ends=np.array([to_ordinal(m[3]) if m[3] else MAX_DATE for m in memberships], dtype=np.int32),
+            capacity=np.array(self.capacity, dtype=np.int64),
+            generation=np.array(self.generation, dtype=np.int64),
+            last_update=np.array(to_ordinal(last_update), dtype=np.int64),
+        )
+        tmp_path = self.path + '.npz.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **index)
+        os.rename(tmp_path, self.path + '.npz')
+
+        remove_data_files(self.path, keep=(self.saved_generation, self.generation))
+        self.saved_generation = self.generation
+        self.last_update = last_update
+
+
+def update_vote_matrix(db_alias, path=None, chunk_size=100, force=False, logger=None):
+    """
+    Append the votes that are not yet in the matrix of the database
+    (all of them, the first time), and refresh the group memberships.
+
+    Nothing is done if the last update of the parliament data did not
+    change since the matrix was saved (unless ``force`` is true).
+    A lock on the files prevents concurrent updates by other processes.
+    Return the number of new votes.
+    """
+    path = path or get_vote_matrix_path(db_alias)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # read before the votes, so that later imports are seen by the next update
+            last_update = watermarks.query(db_alias)
+
+            writer = VoteMatrixWriter(path)
+            if not force and writer.votes is not None and writer.last_update == last_update:
+                if logger:
+                    logger.info(u"{0}: vote matrix up to date".format(db_alias))
+                return 0
+
+            votes = [
+                v for v in Votazione.objects.using(db_alias).order_by(
+                    'sitting__date', 'sitting', 'numero_votazione', 'id'
+                ).values_list('id', 'sitting_id', 'sitting__date')
+                if v[0] not in writer.columns
+            ]
+            writer.add_votes(votes)
+
+            for n in range(0, len(votes), chunk_size):
+                vote_ids = [v[0] for v in votes[n:n + chunk_size]]
+                rows = list(VotazioneHasCarica.objects.using(db_alias).filter(
+                    vote_id__in=vote_ids
+                ).values_list('vote_id', 'charge_id', 'voting', 'rebel'))
+
+                new_charges = set(r[1] for r in rows if r[1] not in writer.rows)
+                if new_charges:
+                    writer.add_charges(list(
+                        Carica.objects.using(db_alias).filter(id__in=new_charges).order_by('id').values_list('id', 'politician_id')
+                    ))
+                writer.set_votes(rows)
+                if logger:
+                    logger.debug(u"{0}: {1}/{2} votes".format(db_alias, n + len(vote_ids), len(votes)))
+
+            if writer.votes is None:
+                writer.reserve(0, 0)
+            memberships = CaricaHasGruppo.objects.using(db_alias).values_list(
+                'charge_id', 'group_id', 'start_date', 'end_date'
+            )
+            writer.save(list(memberships), last_update)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if logger:
+        logger.info(u"{0}: {1} new votes".format(db_alias, len(votes)))
+    return len(votes)
+
+
+class VoteMatrixService(object):
+    """
+    Gives the last saved vote matrix of a database
+    (``VoteMatrixNotFound`` is raised, if it was not built).
+    """
+
+    def __init__(self):
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_alias):
+        matrix = self._matrices.get(db_alias)
+        if matrix is None or not matrix.is_current():
+            with self._lock:
+                matrix = self._matrices.get(db_alias)
+                if matrix is None or not matrix.is_current():
+                    try:
+                        matrix = VoteMatrix(get_vote_matrix_path(db_alias))
+                    except (IOError, OSError):
+                        raise VoteMatrixNotFound("The vote matrix of {0} has not been built".format(db_alias))
+                    self._matrices[db_alias] = matrix
+        return matrix
+
+    def invalidate(self, db_alias=None):
+        with self._lock:
+            if db_alias is None:
+                self._matrices.clear()
+            else:
+                self._matrices.pop(db_alias, None)
+
+
+vote_matrices = VoteMatrixService()
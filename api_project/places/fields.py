@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from rest_framework.reverse import reverse
+from api.reverse import reverse
 
 __author__ = 'guglielmo'
 
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from rest_framework import serializers
-from rest_framework.reverse import reverse
+from api.reverse import reverse
 from .fields import HyperlinkedTreeNodeField, HyperlinkedTreeNodeManyField, ClassificationTreeTagFromURLField
 from rest_framework_gis.serializers import GeoModelSerializer
 from .models import Place, PlaceType, PlaceIdentifier, Identifier, PlaceAcronym, PlaceLink, PlaceGEOInfo, \
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of politicians, with all details.
+
+Politicians are walked in chunks, sorted by primary key, seeking past
+the last key of the previous chunk, so that memory usage stays flat
+whatever the size of the export. Related details (profession,
+education levels and institution charges) are fetched in bulk,
+once per chunk.
+
+Rows are the same structures produced by ``PoliticianExportSerializer``
+and are written out as NDJSON (one json object per line)
+or as CSV (one line per institution charge).
+"""
+import csv
+
+from django.db import reset_queries
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import OpPolitician
+from .serializers import PoliticianExportSerializer
+
+__author__ = 'guglielmo'
+
+
+class Echo(object):
+    """
+    A file-like object that returns what is written,
+    used to let the csv writer produce single lines.
+    """
+    def write(self, value):
+        return value
+
+
+class PoliticiansExporter(object):
+    """
+    Streams the politicians in the given queryset as NDJSON or CSV lines.
+    """
+    formats = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    charges_related = (
+        'institution', 'charge_type', 'location',
+        'constituency', 'constituency__election_type',
+        'party', 'group',
+    )
+
+    politician_csv_fields = (
+        'id', 'first_name', 'last_name',
+        'birth_date', 'death_date', 'birth_location', 'sex',
+        'profession', 'education_levels',
+    )
+    charge_csv_fields = (
+        'date_start', 'date_end',
+        'charge_extended_description',
+        'charge_type_descr', 'institution_descr',
+        'location_descr',
+        'location_istat_reg', 'location_istat_prov', 'location_istat_city',
+        'constituency_descr', 'constituency_election_type',
+        'description',
+        'party', 'group',
+    )
+
+    def __init__(self, queryset, chunk_size=1000):
+        self.queryset = queryset
+        self.db = queryset.db
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        """
+        Yield lists of politicians, with all details attached.
+        """
+        queryset = self.queryset.select_related('profession').order_by('pk')
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:self.chunk_size])
+            if not chunk:
+                break
+            yield OpPolitician.objects.db_manager(self.db).attach_details(
+                chunk, ('education_levels', 'institution_charges'), self.charges_related
+            )
+            last_pk = chunk[-1].pk
+
+            # avoid the growth of the queries log, when DEBUG is on
+            reset_queries()
+
+    def rows(self):
+        """
+        Yield a serialized structure for each politician.
+        """
+        for chunk in self.chunks():
+            for politician in chunk:
+                row = PoliticianExportSerializer(politician).data
+                row['id'] = politician.pk
+                yield row
+
+    def ndjson(self):
+        encoder = JSONEncoder(ensure_ascii=False)
+        for row in self.rows():
+            yield encoder.encode(row).encode('utf8') + '\n'
+
+    def csv(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.politician_csv_fields + self.charge_csv_fields)
+        for row in self.rows():
+            politician = [
+                row['id'], row['first_name'], row['last_name'],
+                row['birth_date'], row['death_date'], row['birth_location'], row['sex'],
+                row['profession'] and row['profession']['description'],
+                '; '.join(
+                    e['education_level']['description'] for e in row['education_levels']
+                ),
+            ]
+            charges = row['institution_charges'] or [None]
+            for charge in charges:
+                values = []
+                if charge is not None:
+                    for field in self.charge_csv_fields:
+                        value = charge[field]
+                        if isinstance(value, dict):
+                            value = value['acronym'] or value['name']
+                        values.append(value)
+                yield writer.writerow([self._csv_value(v) for v in politician + values])
+
+    @staticmethod
+    def _csv_value(value):
+        if value is None:
+            return ''
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, unicode):
+            return value.encode('utf8')
+        return value
+
+    def stream(self, format):
+        """
+        Return an iterator over the lines of the export, in the given format.
+        """
+        if format not in self.formats:
+            raise ValueError("'{0}' is not a valid export format".format(format))
+        return getattr(self, format)()
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory interval index of the institution charges.
+
+Which charges were active on a day, started or ended in a period,
+or are current, is asked by many views, with conditions on
+``date_start`` and ``date_end`` over ``op_institution_charge``,
+joined to ``op_open_content`` to drop the deleted charges.
+
+The index keeps the non-deleted charges grouped by location,
+institution and charge type; the charges of each group are kept
+in arrays sorted by start date (dates as ordinals, current charges
+with no end date as ``OPEN_END``), so that bounds on the start are
+found by binary search, and only the charges within them are scanned.
+Queries are answered without any join, or query at all.
+
+The index is built with a single query, then refreshed incrementally:
+when the ``op_content`` watermark (see ``politici.watermarks``) moves,
+only the charges whose content was updated since the last refresh
+are read, and the groups they left or joined (found in a map of the
+groups of the charges) are replaced in a new index, so that the index
+seen by a request never changes.
+Charges deleted from the table (not marked as deleted) are only
+dropped by a rebuild (``invalidate``).
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+import threading
+
+from politici.models import OpInstitutionCharge
+from politici.watermarks import contents
+
+__author__ = 'guglielmo'
+
+
+# end of the charges with no end date, after any date
+OPEN_END = date.max.toordinal() + 1
+# start of the charges with no start date, that match no bound on the start
+NO_START = 0
+
+FIELDS = ('location_id', 'institution_id', 'charge_type_id', 'date_start', 'date_end', 'content_id', 'politician_id')
+
+
+class ChargeGroup(object):
+    """
+    The charges of a location, institution and charge type,
+    sorted by start date and id.
+    """
+    __slots__ = ('starts', 'ends', 'ids', 'politicians')
+
+    def __init__(self, charges=()):
+        charges = sorted(charges)
+        self.starts = array('i', [c[0] for c in charges])
+        self.ends = array('i', [c[1] for c in charges])
+        self.ids = array('i', [c[2] for c in charges])
+        self.politicians = array('i', [c[3] for c in charges])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def charges(self):
+        """Return the (start, end, id, politician_id) tuples of the charges"""
+        return zip(self.starts, self.ends, self.ids, self.politicians)
+
+    def find(self, start_min=None, start_max=None, end_min=None, end_max=None):
+        """
+        Yield the (start, end, id, politician_id) tuples of the charges
+        within the bounds (inclusive, as ordinals).
+        """
+        lo = bisect_left(self.starts, start_min) if start_min is not None else 0
+        if start_max is not None:
+            lo = max(lo, bisect_right(self.starts, NO_START))
+        hi = bisect_right(self.starts, start_max) if start_max is not None else len(self.starts)
+        ends = self.ends
+        for n in xrange(lo, hi):
+            end = ends[n]
+            if (end_min is None or end >= end_min) and (end_max is None or end <= end_max):
+                yield self.starts[n], end, self.ids[n], self.politicians[n]
+
+
+class ChargeIntervals(object):
+    """
+    Snapshot of the non-deleted institution charges of a database,
+    in groups keyed by (location_id, institution_id, charge_type_id).
+
+    The keys of the groups are indexed by location, institution and
+    charge type; ``charge_keys`` maps the ids of the charges to the
+    keys of their groups, and is only used (and updated) by
+    ``refreshed``, so it is handed over to the refreshed index.
+    """
+
+    def __init__(self, using, groups, last_update=None, charge_keys=None, key_indexes=None):
+        self.using = using
+        self.groups = groups
+        self.last_update = last_update
+
+        if charge_keys is None:
+            charge_keys = {}
+            for key, group in groups.items():
+                charge_keys.update(dict.fromkeys(group.ids, key))
+        self.charge_keys = charge_keys
+
+        if key_indexes is None:
+            key_indexes = ({}, {}, {})
+            for key in groups:
+                for position, index in enumerate(key_indexes):
+                    index.setdefault(key[position], []).append(key)
+        self.key_indexes = key_indexes
+        self.locations, self.institutions, self.charge_types = key_indexes
+
+    @classmethod
+    def build(cls, using):
+        """
+        Build the index of the database, with a single query.
+        """
+        # the watermark is read first: charges updated meanwhile are read again by the next refresh
+        last_update = contents.get(using)
+        charges = defaultdict(list)
+        rows = OpInstitutionCharge.objects.using(using).filter(content__deleted_at__isnull=True).values_list(*FIELDS)
+        for row in rows.iterator():
+            key, charge = cls.split_row(row)
+            charges[key].append(charge)
+        return cls(using, dict((key, ChargeGroup(group)) for key, group in charges.items()), last_update)
+
+    @staticmethod
+    def split_row(row):
+        location_id, institution_id, charge_type_id, date_start, date_end, content_id, politician_id = row
+        return (location_id, institution_id, charge_type_id), (
+            date_start.toordinal() if date_start else NO_START, date_end.toordinal() if date_end else OPEN_END,
+            content_id, politician_id
+        )
+
+    def refreshed(self, last_update):
+        """
+        Return a new index, with the charges updated since the
+        last refresh; unchanged groups are shared with this index,
+        and only the groups of the updated charges are rebuilt.
+        """
+        if self.last_update is None:
+            return self.build(self.using)
+        rows = OpInstitutionCharge.objects.using(self.using).filter(
+            content__content__updated_at__gte=self.last_update
+        ).values_list(*(FIELDS + ('content__deleted_at',)))
+        updated = {}
+        for row in rows:
+            key, charge = self.split_row(row[:-1])
+            updated[charge[2]] = (key, charge) if row[-1] is None else None
+        if not updated:
+            return ChargeIntervals(self.using, self.groups, last_update, self.charge_keys, self.key_indexes)
+
+        # updated charges are removed from their groups, and added to their new groups
+        changes = {}
+        for charge_id, value in updated.items():
+            for key in (self.charge_keys.get(charge_id), value and value[0]):
+                if key is not None and key not in changes:
+                    changes[key] = [c for c in self.groups[key].charges() if c[2] not in updated] \
+                        if key in self.groups else []
+        for value in updated.values():
+            if value is not None:
+                key, charge = value
+                changes[key].append(charge)
+
+        groups = dict(self.groups)
+        added, removed = [], []
+        for key, charges in changes.items():
+            if charges:
+                if key not in groups:
+                    added.append(key)
+                groups[key] = ChargeGroup(charges)
+            elif key in groups:
+                del groups[key]
+                removed.append(key)
+
+        charge_keys = self.charge_keys
+        for charge_id, value in updated.items():
+            if value is None:
+                charge_keys.pop(charge_id, None)
+            else:
+                charge_keys[charge_id] = value[0]
+
+        return ChargeIntervals(
+            self.using, groups, last_update, charge_keys, self.updated_key_indexes(added, removed)
+        )
+
+    def updated_key_indexes(self, added, removed):
+        """
+        Return copies of the indexes of the keys, with the keys of
+        the added groups, and without those of the removed ones;
+        only the lists of the changed ids are copied.
+        """
+        if not added and not removed:
+            return self.key_indexes
+        key_indexes = []
+        for position, index in enumerate(self.key_indexes):
+            index = dict(index)
+            for key in removed:
+                index[key[position]] = [k for k in index[key[position]] if k != key]
+                if not index[key[position]]:
+                    del index[key[position]]
+            for key in added:
+                index[key[position]] = index.get(key[position], []) + [key]
+            key_indexes.append(index)
+        return tuple(key_indexes)
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups.values())
+
+    def select(self, location_ids=None, institution_ids=None, charge_type_ids=None):
+        """
+        Return the keys of the groups of the given locations,
+        institutions and charge types (all, if None).
+        """
+        keys = None
+        for index, ids in ((self.locations, location_ids), (self.institutions, institution_ids),
+                           (self.charge_types, charge_type_ids)):
+            if ids is None:
+                continue
+            selected = set()
+            for i in ids:
+                selected.update(index.get(i, ()))
+            keys = selected if keys is None else keys & selected
+        return self.groups.keys() if keys is None else list(keys)
+
+    def find(self, bounds, location_ids=None, institution_ids=None, charge_type_ids=None):
+        """
+        Return the charges of the given locations, institutions and
+        charge types within the ``bounds`` (see ``Bounds``),
+        as (start, end, id, politician_id) tuples, in no particular order.
+        """
+        if bounds.empty:
+            return []
+        limits = bounds.as_ordinals()
+        charges = []
+        for key in self.select(location_ids, institution_ids, charge_type_ids):
+            charges.extend(self.groups[key].find(*limits))
+        return charges
+
+
+class Bounds(object):
+    """
+    Inclusive bounds on the start and end dates of charges;
+    ``current`` selects current charges (True), ended ones (False),
+    or both (None). Current charges end after any date.
+
+    Bounds are narrowed by the ``narrow`` method, and are ``empty``
+    when no charge can be within them.
+    """
+
+    def __init__(self, start_min=None, start_max=None, end_min=None, end_max=None, current=None):
+        self.start_min = self.start_max = self.end_min = self.end_max = self.current = None
+        self.empty = False
+        self.narrow(start_min=start_min, start_max=start_max, end_min=end_min, end_max=end_max, current=current)
+
+    def narrow(self, start_min=None, start_max=None, end_min=None, end_max=None, current=None):
+        if start_min is not None:
+            self.start_min = max(self.start_min, start_min) if self.start_min is not None else start_min
+        if start_max is not None:
+            self.start_max = min(self.start_max, start_max) if self.start_max is not None else start_max
+        if end_min is not None:
+            self.end_min = max(self.end_min, end_min) if self.end_min is not None else end_min
+        if end_max is not None:
+            self.end_max = min(self.end_max, end_max) if self.end_max is not None else end_max
+        if current is not None:
+            if self.current is not None and self.current != current:
+                self.empty = True
+            self.current = current
+        return self
+
+    def __nonzero__(self):
+        return any(value is not None for value in (
+            self.start_min, self.start_max, self.end_min, self.end_max, self.current
+        )) or self.empty
+
+    def as_ordinals(self):
+        """
+        Return the (start_min, start_max, end_min, end_max) ordinals,
+        with the ``current`` condition applied to the end bounds.
+        """
+        ordinal = lambda d: d.toordinal() if d is not None else None
+        start_min, start_max = ordinal(self.start_min), ordinal(self.start_max)
+        end_min, end_max = ordinal(self.end_min), ordinal(self.end_max)
+        if self.current is True:
+            end_min = OPEN_END
+        elif self.current is False:
+            end_max = min(end_max, OPEN_END - 1) if end_max is not None else OPEN_END - 1
+        return start_min, start_max, end_min, end_max
+
+
+class ChargeIntervalsService(object):
+    """
+    Gives the up-to-date index of a database.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, using):
+        index = self._indexes.get(using)
+        if index is None or contents.has_changed(using, index.last_update):
+            with self._lock:
+                index = self._indexes.get(using)
+                if index is None:
+                    index = ChargeIntervals.build(using)
+                elif contents.has_changed(using, index.last_update):
+                    index = index.refreshed(contents.get(using))
+                self._indexes[using] = index
+        return index
+
+    def invalidate(self, using=None):
+        with self._lock:
+            if using is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(using, None)
+
+
+intervals = ChargeIntervalsService()
+
+
+class ChargeList(object):
+    """
+    The charges with the given ids, in their order, as a lazy sequence
+    that can be paginated: only the charges of a page are fetched,
+    with the relations of ``queryset``.
+    """
+    # number of charges fetched per query
+    chunk_size = 500
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.ids = ids
+
+    def using(self, alias):
+        return ChargeList(self.queryset.using(alias), self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        ids = self.ids[k]
+        charges = {}
+        for start in xrange(0, len(ids), self.chunk_size):
+            charges.update((charge.pk, charge) for charge in self.queryset.filter(
+                pk__in=ids[start:start + self.chunk_size]
+            ))
+        return [charges[pk] for pk in ids if pk in charges]
+
+    def __iter__(self):
+        for start in xrange(0, len(self.ids), self.chunk_size):
+            for charge in self[start:start + self.chunk_size]:
+                yield charge
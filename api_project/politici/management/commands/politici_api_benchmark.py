@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api import benchmark
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    A mix of requests to the whole API is replayed, through the
+    Django test client or against a running server (``--url``),
+    and latency percentiles, throughput, queries per request and
+    peak RSS are shown per endpoint (see ``api.benchmark``).
+
+    The mix is recorded (``--recording``, the json lines of the
+    ``profiling`` logger) or synthetic, on the data of the databases.
+
+    The summary can be written as json (``--output``), and compared
+    with the one of a previous run (``--baseline``): the command
+    fails if any endpoint regressed.
+    """
+    help = "Benchmark the API on a recorded or synthetic mix of requests"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--recording',
+                    dest='recording',
+                    default=None,
+                    help='Log of the profiling logger to replay (a synthetic mix, by default)'),
+        make_option('--requests',
+                    dest='requests',
+                    default=1000,
+                    help='Number of requests of the synthetic mix'),
+        make_option('--legislatura',
+                    dest='legislatura',
+                    default=18,
+                    help='Legislatura of the parlamento requests of the synthetic mix'),
+        make_option('--seed',
+                    dest='seed',
+                    default=1,
+                    help='Seed of the synthetic mix'),
+        make_option('--warmup',
+                    dest='warmup',
+                    default=50,
+                    help='Number of requests replayed before measuring'),
+        make_option('--url',
+                    dest='url',
+                    default=None,
+                    help='Base url of a running server (the test client, by default)'),
+        make_option('--server-pid',
+                    dest='server_pid',
+                    default=None,
+                    help='Pid of the server, for its peak RSS (Linux only)'),
+        make_option('--no-cache',
+                    action='store_true',
+                    dest='no_cache',
+                    default=False,
+                    help='Disable the response cache (test client only)'),
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='File where the json summary is written'),
+        make_option('--baseline',
+                    dest='baseline',
+                    default=None,
+                    help='Json summary of a previous run, to compare with'),
+        make_option('--tolerance',
+                    dest='tolerance',
+                    default=0.2,
+                    help='Share over the baseline tolerated before a regression'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (EnvironmentError, ValueError), e:
+                raise CommandError(u"Baseline not readable: {0}".format(e))
+
+        if options['recording']:
+            try:
+                with open(options['recording']) as f:
+                    requests = benchmark.load_recording(f)
+            except EnvironmentError, e:
+                raise CommandError(u"Recording not readable: {0}".format(e))
+        else:
+            requests = benchmark.synthetic_mix(
+                int(options['requests']), int(options['legislatura']), int(options['seed'])
+            )
+        if not requests:
+            raise CommandError("No requests to replay")
+
+        if options['url']:
+            transport = benchmark.ServerTransport(options['url'], options['server_pid'])
+        else:
+            transport = benchmark.ClientTransport()
+        self.logger.info(u"Replaying {0} requests through {1}".format(len(requests), transport.name))
+
+        if options['no_cache']:
+            with override_settings(RESPONSE_CACHE=None):
+                summary = benchmark.run(requests, transport, int(options['warmup']), self.logger)
+        else:
+            summary = benchmark.run(requests, transport, int(options['warmup']), self.logger)
+
+        self.stdout.write("{0:<40} {1:>6} {2:>6} {3:>9} {4:>9} {5:>9} {6:>8} {7:>8} {8:>10}".format(
+            'endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'rss kB'
+        ))
+        for endpoint, result in summary['endpoints'].items():
+            self.stdout.write("{0:<40} {1:>6} {2:>6} {3:>9} {4:>9} {5:>9} {6:>8} {7:>8} {8:>10}".format(
+                endpoint, result['count'], result['errors'], result['p50'], result['p95'], result['p99'],
+                result['throughput'], result['queries'], result['peak_rss']
+            ))
+        self.stdout.write("{requests} requests in {seconds}s, {throughput} requests/s".format(**summary['meta']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summary, f, indent=2)
+            self.logger.info(u"Summary written to {0}".format(options['output']))
+
+        if baseline is not None:
+            regressions = benchmark.compare(summary, baseline, float(options['tolerance']))
+            if regressions:
+                raise CommandError(u"Regressions against {0}:\n{1}".format(
+                    options['baseline'], u'\n'.join(regressions)
+                ))
+            self.logger.info(u"No regressions against {0}".format(options['baseline']))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from politici.export import PoliticiansExporter
+from politici.models import OpPolitician
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Politicians are exported with all their details
+    (profession, education levels and institution charges),
+    from the 'politici' database, as NDJSON or CSV.
+
+    Data are streamed in chunks, so that memory usage stays flat,
+    even for the whole national export.
+    """
+    help = "Export politicians, with all details, as NDJSON or CSV"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format',
+                    dest='format',
+                    default='ndjson',
+                    help='Output format: ndjson (default) or csv'),
+        make_option('--output',
+                    dest='output',
+                    default=None,
+                    help='Output file (defaults to standard output)'),
+        make_option('--regional-id',
+                    dest='regional_id',
+                    default=None,
+                    help='Only politicians with charges in the region (istat id)'),
+        make_option('--provincial-id',
+                    dest='provincial_id',
+                    default=None,
+                    help='Only politicians with charges in the province (istat id)'),
+        make_option('--chunk-size',
+                    dest='chunk_size',
+                    default=1000,
+                    help='Number of politicians fetched per query'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        export_format = options['format']
+        if export_format not in PoliticiansExporter.formats:
+            raise CommandError("format must be one of: {0}".format(
+                ', '.join(PoliticiansExporter.formats.keys())
+            ))
+
+        queryset = OpPolitician.objects.using('politici').all()
+        if options['regional_id']:
+            queryset = queryset.filter(
+                opinstitutioncharge__content__deleted_at__isnull=True,
+                opinstitutioncharge__location__regional_id=options['regional_id']).distinct()
+        if options['provincial_id']:
+            queryset = queryset.filter(
+                opinstitutioncharge__content__deleted_at__isnull=True,
+                opinstitutioncharge__location__provincial_id=options['provincial_id']).distinct()
+
+        exporter = PoliticiansExporter(queryset, chunk_size=int(options['chunk_size']))
+
+        if options['output']:
+            out = open(options['output'], 'wb')
+        else:
+            out = sys.stdout
+
+        n = 0
+        try:
+            for line in exporter.stream(export_format):
+                out.write(line)
+                n += 1
+                if n % 10000 == 0:
+                    self.logger.info("{0} lines written".format(n))
+        finally:
+            if options['output']:
+                out.close()
+
+        self.logger.info("Export finished: {0} lines written".format(n))
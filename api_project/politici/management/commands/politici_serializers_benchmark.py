@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from parlamento import views as parlamento_views
+from parlamento.serializers import GruppoSerializer, SedeSerializer, VotazioneSerializer
+from politici import views as politici_views
+from territori import views as territori_views
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    The read-only list endpoints served by flat serializers
+    (see ``api.serializers``) are requested, with the given page size,
+    with their flat serializer and with the ModelSerializer they replace.
+
+    Average response times of the two paths are shown,
+    and responses are checked to be the same.
+    """
+    help = "Benchmark the flat serializers against the model serializers"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--page-size',
+                    dest='page_size',
+                    default=1000,
+                    help='Number of results per page'),
+        make_option('--repeat',
+                    dest='repeat',
+                    default=5,
+                    help='Number of requests of each endpoint, for each path'),
+        make_option('--legislatura',
+                    dest='legislatura',
+                    default=18,
+                    help='Legislatura of the parlamento endpoints'),
+    )
+
+    @staticmethod
+    def get_content(response):
+        # large lists are streamed (see api.mixins.StreamingRenderMixin)
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def handle(self, *args, **options):
+        page_size = int(options['page_size'])
+        repeat = int(options['repeat'])
+        legislatura = {'legislatura': options['legislatura']}
+
+        # (url, view, serializer replaced by the flat one; None is the default ModelSerializer)
+        cases = (
+            (reverse('parlamento:gruppo-list', kwargs=legislatura), parlamento_views.GruppoListView, GruppoSerializer),
+            (reverse('parlamento:sede-list', kwargs=legislatura), parlamento_views.SedeListView, SedeSerializer),
+            (reverse('parlamento:votazione-list', kwargs=legislatura), parlamento_views.VotazioneListView, VotazioneSerializer),
+            (reverse('politici:institution-list'), politici_views.InstitutionList, None),
+            (reverse('politici:chargetype-list'), politici_views.ChargeTypeList, None),
+            (reverse('territori:locationtype-list'), territori_views.LocationTypeList, None),
+        )
+
+        client = Client()
+        for url, view, model_serializer in cases:
+            flat_serializer = view.serializer_class
+            timings = {}
+            contents = {}
+            for path, serializer in (('model', model_serializer), ('flat', flat_serializer)):
+                view.serializer_class = serializer
+                try:
+                    t = time.time()
+                    for _ in range(repeat):
+                        # responses are built for every request, not read from the cache
+                        with override_settings(RESPONSE_CACHE=None):
+                            response = client.get(url, {'page_size': page_size}, HTTP_ACCEPT='application/json')
+                        contents[path] = self.get_content(response)
+                    timings[path] = (time.time() - t) / repeat * 1000
+                finally:
+                    view.serializer_class = flat_serializer
+
+            self.stdout.write(
+                "{0}: model {1:.1f}ms, flat {2:.1f}ms, speedup {3:.1f}x, {4}".format(
+                    url, timings['model'], timings['flat'], timings['model'] / timings['flat'],
+                    'same response' if contents['model'] == contents['flat'] else 'DIFFERENT RESPONSE'
+                )
+            )
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from api.testing import create_unmanaged_tables
+from politici.models import OpContent, OpPolitician
+from politici.synthetic import build_politici
+from territori.models import OpLocation
+from territori.synthetic import build_locations
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    The politici database is filled with a synthetic hierarchy of
+    locations and synthetic politicians with their institution charges,
+    at the scale of the openpolis database by default (200k politicians,
+    about 2M charges), to benchmark the API on a local database.
+
+    Missing tables are created; databases that already contain
+    locations or contents are refused, so that real data is never touched.
+    """
+    help = "Fill the politici database with synthetic locations, politicians and charges"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database',
+                    dest='database',
+                    default='politici',
+                    help='Database alias'),
+        make_option('--regions',
+                    dest='regions',
+                    default=20,
+                    help='Number of regions'),
+        make_option('--provinces',
+                    dest='provinces',
+                    default=5,
+                    help='Number of provinces per region'),
+        make_option('--cities',
+                    dest='cities',
+                    default=80,
+                    help='Number of cities per province'),
+        make_option('--politicians',
+                    dest='politicians',
+                    default=200000,
+                    help='Number of politicians'),
+        make_option('--charges',
+                    dest='charges',
+                    default=10,
+                    help='Average number of charges per politician'),
+        make_option('--seed',
+                    dest='seed',
+                    default=1,
+                    help='Seed of the random generator'),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    default=500,
+                    help='Number of rows inserted per query'),
+    )
+
+    logger = logging.getLogger('management')
+
+    def handle(self, *args, **options):
+
+        verbosity = options['verbosity']
+        if verbosity == '0':
+            self.logger.setLevel(logging.ERROR)
+        elif verbosity == '1':
+            self.logger.setLevel(logging.WARNING)
+        elif verbosity == '2':
+            self.logger.setLevel(logging.INFO)
+        elif verbosity == '3':
+            self.logger.setLevel(logging.DEBUG)
+
+        using = options['database']
+        if using not in connections:
+            raise CommandError(u"No database {0}".format(using))
+
+        create_unmanaged_tables(using, 'territori', 'politici')
+        for model in (OpLocation, OpContent, OpPolitician):
+            if model.objects.using(using).exists():
+                raise CommandError(u"Table {0} of database {1} is not empty".format(model._meta.db_table, using))
+
+        seed, batch_size = int(options['seed']), int(options['batch_size'])
+        with transaction.atomic(using=using):
+            self.logger.info(u"Generating locations in database {0}".format(using))
+            cities = build_locations(
+                using, regions=int(options['regions']), provinces=int(options['provinces']),
+                cities=int(options['cities']), seed=seed, batch_size=batch_size
+            )
+            self.logger.info(u"{0} cities generated".format(len(cities)))
+            build_politici(
+                using, politicians=int(options['politicians']), charges=int(options['charges']),
+                seed=seed, batch_size=batch_size, logger=self.logger
+            )
+        self.logger.info(u"{0} politicians generated".format(options['politicians']))
@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 from django.db import models
-from django.db import connections
-from django.conf import settings
 from django.utils.encoding import smart_unicode
 from territori.models import OpLocation
+from .normalization import NormalizationRegistry
 
 
 def dict_fetchall(cursor):
@@ -95,7 +94,7 @@ class OpProfession(models.Model):
 
     def getNormalizedDescription(self):
         if self.oid is not None:
-            norm = OpProfession.objects.db_manager('politici').get(pk=self.oid)
+            norm = OpProfession.normalizations.get(self.oid)
             return norm.description
         else:
             return self.description
@@ -106,6 +105,8 @@ class OpProfession(models.Model):
     def normalized_description(self):
         return self.getNormalizedDescription()
 
+OpProfession.normalizations = NormalizationRegistry(OpProfession)
+
 
 class OpElectionType(models.Model):
     id = models.IntegerField(primary_key=True)
@@ -125,6 +126,97 @@ class OpElection(models.Model):
         managed = False
 
 
+class OpPoliticianManager(models.Manager):
+    """class to handle queries on OpPolitician"""
+
+    def attach_details(self, politicians, details, charges_related=()):
+        """
+        Attach the given ``details`` (a sequence of ``education_levels``,
+        ``institution_charges`` and ``resources``) to all the politicians,
+        with a fixed number of queries.
+
+        Returns the list of politicians.
+        """
+        politicians = list(politicians)
+        for detail in details:
+            if detail == 'institution_charges':
+                self.attach_institution_charges(politicians, *charges_related)
+            else:
+                getattr(self, 'attach_{0}'.format(detail))(politicians)
+        return politicians
+
+    def attach_institution_charges(self, politicians, *related):
+        """
+        Fetch the non-deleted institution charges of all the given politicians
+        with a single query, following the ``related`` relations,
+        and attach them to the instances, so that the ``institution_charges``
+        property does not hit the DB again.
+
+        Returns the list of politicians.
+        """
+        politicians = list(politicians)
+        charges = dict((p.pk, []) for p in politicians)
+        if charges:
+            qs = OpInstitutionCharge.objects.db_manager(self._db or 'politici').\
+                filter(politician_id__in=charges.keys(), content__deleted_at__isnull=True)
+            if related:
+                qs = qs.select_related(*related)
+            for charge in qs:
+                charges[charge.politician_id].append(charge)
+
+        for p in politicians:
+            p._institution_charges = charges[p.pk]
+        return politicians
+
+    def attach_resources(self, politicians):
+        """
+        Fetch the non-deleted resources of all the given politicians
+        with a single query, and attach them to the instances,
+        so that the ``resources`` and ``last_resource_update``
+        properties do not hit the DB again.
+
+        Returns the list of politicians.
+        """
+        politicians = list(politicians)
+        resources = dict((p.pk, []) for p in politicians)
+        if resources:
+            qs = OpResources.objects.db_manager(self._db or 'politici').\
+                filter(politician_id__in=resources.keys(), content__deleted_at__isnull=True).\
+                select_related('content__content', 'resources_type').\
+                order_by('-content__content__updated_at')
+            for resource in qs:
+                resources[resource.politician_id].append(resource)
+        for p in politicians:
+            p._resources = resources[p.pk]
+        return politicians
+
+    def attach_education_levels(self, politicians):
+        """
+        Fetch the education levels of all the given politicians with a single query,
+        and store them in the prefetch cache of the ``education_levels`` relation.
+
+        ``prefetch_related('education_levels__education_level')`` can not be used,
+        as the double primary key of the relation table fools the prefetch.
+
+        Returns the list of politicians.
+        """
+        politicians = list(politicians)
+        levels = dict((p.pk, []) for p in politicians)
+        if levels:
+            qs = OpPoliticianHasOpEducationLevel.objects.db_manager(self._db or 'politici').\
+                filter(politician_id__in=levels.keys()).select_related('education_level')
+            for level in qs:
+                levels[level.politician_id].append(level)
+        for p in politicians:
+            qs = p.education_levels.all()
+            qs._result_cache = levels[p.pk]
+            qs._prefetch_done = True
+            if not hasattr(p, '_prefetched_objects_cache'):
+                p._prefetched_objects_cache = {}
+            p._prefetched_objects_cache['education_levels'] = qs
+        return politicians
+
+
 class OpPolitician(models.Model):
     content = models.OneToOneField(OpContent, primary_key=True, db_column='content_id')
     profession = models.ForeignKey(OpProfession, null=True, blank=True)
@@ -140,6 +232,7 @@ class OpPolitician(models.Model):
     is_indexed = models.IntegerField()
     minint_aka = models.CharField(unique=True, max_length=255, blank=True)
     creator = models.ForeignKey(OpUser, null=True, blank=True, related_name='oppolitician_creator_set')
+    objects = OpPoliticianManager()
 
     class Meta:
         db_table = u'op_politician'
@@ -243,7 +336,10 @@ class OpPolitician(models.Model):
 
     @property
     def last_resource_update(self):
-        top = self.resources.first()
+        if hasattr(self, '_resources'):
+            top = self._resources[0] if self._resources else None
+        else:
+            top = self.resources.first()
         if top:
             return top.content.content.updated_at
         else:
@@ -251,7 +347,9 @@ class OpPolitician(models.Model):
 
     @property
     def resources(self):
-        """return resources, ordered by last updated"""
+        """return resources, ordered by last updated, using those attached in bulk, if any"""
+        if hasattr(self, '_resources'):
+            return self._resources
         return self.opresources_set\
             .filter(content__deleted_at__isnull=True) \
             .order_by('-content__content__updated_at')
@@ -262,6 +360,9 @@ class OpPolitician(models.Model):
 
     @property
     def institution_charges(self):
+        """return non-deleted charges, using those attached in bulk, if any"""
+        if hasattr(self, '_institution_charges'):
+            return self._institution_charges
         return self.opinstitutioncharge_set.filter(content__deleted_at__isnull=True)
 
     @property
@@ -302,7 +403,7 @@ class OpEducationLevel(models.Model):
 
     def getNormalizedDescription(self):
         if self.oid is not None:
-            norm = OpEducationLevel.objects.db_manager('politici').get(pk=self.oid)
+            norm = OpEducationLevel.normalizations.get(self.oid)
             return norm.description
         else:
             return self.description
@@ -311,6 +412,9 @@ class OpEducationLevel(models.Model):
     def normalized_description(self):
         return self.getNormalizedDescription()
 
+OpEducationLevel.normalizations = NormalizationRegistry(OpEducationLevel)
+
+
 class OpPoliticianHasOpEducationLevel(models.Model):
     politician = models.ForeignKey(OpPolitician, primary_key=True,
                                    related_name='education_levels')
@@ -410,7 +514,7 @@ class OpParty(models.Model):
     def getNormalized(self):
         """look up for normalized partied in the db"""
         if self.oid is not None and self.oid != 0:
-            return OpParty.objects.db_manager('politici').get(pk=self.oid)
+            return OpParty.normalizations.get(self.oid)
         else:
             return self
 
@@ -441,6 +545,7 @@ class OpParty(models.Model):
         norm = self.getNormalized()
         return norm.getAcronymOrName()
 
+OpParty.normalizations = NormalizationRegistry(OpParty)
 
 
 class OpPartyLocation(models.Model):
@@ -465,7 +570,7 @@ class OpGroup(models.Model):
     def getNormalized(self):
         """look up for normalized group in the db"""
         if self.oid is not None and self.oid != 0:
-            return OpGroup.objects.db_manager('politici').get(pk=self.oid)
+            return OpGroup.normalizations.get(self.oid)
         else:
             return self
 
@@ -496,7 +601,7 @@ class OpGroup(models.Model):
         norm = self.getNormalized()
         return norm.getAcronymOrName()
 
-
+OpGroup.normalizations = NormalizationRegistry(OpGroup)
 
 
 class OpGroupLocation(models.Model):
@@ -511,266 +616,33 @@ class OpInstitutionChargeManager(models.Manager):
     """class to handle queries on OpInstitutionCharge"""
 
     def get_statistics(self, request):
-        cursor = connections['politici'].cursor()
-
-        base_sql = """
-            from op_institution_charge ic, op_institution i, op_open_content oc, op_politician p,
-              op_location l, op_profession pr, op_politician_has_op_education_level pe, op_education_level e
-            where l.id=ic.location_id and ic.institution_id=i.id and
-              ic.politician_id=p.content_id and oc.content_id=ic.content_id and
-              p.profession_id=pr.id and p.content_id=pe.politician_id and
-              pe.education_level_id=e.id and
-              oc.deleted_at is null and ic.date_end is null
-            """
-        filters = {}
-        results = {}
-
-        clauses_sql = ""
-        clauses_params = []
-
-
-        #
-        # building filters
-        #
-
-        location_types = ('all', 'regional', 'provincial', 'city')
-        location_id = 0
-        if 'location_id' in request.GET:
-            location_id = request.GET['location_id']
-        location_type = 0
-        if 'location_type' in request.GET:
-            location_type = request.GET['location_type']
-        if location_id != 0:
-            if location_type in location_types:
-                location = OpLocation.objects.db_manager('politici').getFromTypeId(location_type, location_id)
-                clauses_sql += " and l.%s_id=%%s " % location_type
-                clauses_params.append(location_id)
-                filters['location_context'] = { 'type': location_type, 'id': location_id, 'name': location.name, 'op_location_id': location.id }
-            else:
-                raise Exception('wrong location type parameter: %s not in (regional, provincial, city)' % location_type)
-        elif location_type == 'all':
-            clauses_sql += " and l.location_type_id in (4, 5, 6) "
-            filters['location_context'] = { 'type': 'all' }
-
-        ages = {
-            'twenties': 20,
-            'thirties': 30,
-            'forties': 40,
-            'fifties': 50,
-            'sixties': 60,
-            'seventies': 70,
-            'eighties': 80,
-            'nineties': 90,
-            'venerables': 100
-        }
-        age = 0
-        if 'age' in request.GET:
-            age = request.GET['age']
-        if age != 0:
-            if age in ages.keys():
-                tenth = ages[age] / 10
-                clauses_sql += " and YEAR(CURDATE())-YEAR(p.birth_date) < %d5 and YEAR(CURDATE())-YEAR(p.birth_date) >= %d5 " % (tenth, tenth-1)
-                filters['age'] = age
-            else:
-                raise Exception('wrong age parameter: %s not in (twenties, thirties, ..., nineties, venerables)' % age)
-
-        sexes = ('M', 'F')
-        sex = 0
-        if 'sex' in request.GET:
-            sex = request.GET['sex']
-        if sex != 0:
-            if sex in sexes:
-                clauses_sql += " and sex = %s"
-                clauses_params.append(sex)
-                filters['sex'] = sex
-            else:
-                raise Exception('wrong sex parameter: %s not in (M, F)' % sex)
-
-        institutions = ('giunta_regionale', 'consiglio_regionale', 'giunta_provinciale', 'consiglio_provinciale', 'giunta_comunale', 'consiglio_comunale', 'commissariamento')
-        institution = 0
-        if 'institution' in request.GET:
-            institution = request.GET['institution']
-        if institution != 0:
-            if institution in institutions:
-                clauses_sql += " and i.name = %s"
-                clauses_params.append(institution.replace('_', ' '))
-                filters['institution'] = institution.replace('_', ' ')
-            else:
-                raise Exception('wrong institution parameter: %s not in (giunta_regionale, consiglio_regionale, ...)' % institution)
-
-        professions = {}
-        for profession in OpProfession.objects.db_manager('politici').getBasic().values('id', 'description', 'odescription'):
-            if profession['odescription']:
-                professions[profession['id']] = profession['odescription']
-            else:
-                professions[profession['id']] = profession['description']
-        profession_id = 0
-        if 'profession_id' in request.GET:
-            profession_id = int(request.GET['profession_id'])
-        if profession_id != 0:
-            if profession_id in professions.keys():
-                clauses_sql += " and (pr.id = %s or pr.oid = %s)"
-                clauses_params.extend([profession_id, profession_id])
-                filters['profession'] = { 'id': profession_id, 'name': professions[profession_id] }
-            else:
-                raise Exception('wrong institution parameter: %s not in professions_ids' % profession_id)
-
-        educations = {}
-        for education in OpEducationLevel.objects.db_manager('politici').getBasic().values('id', 'description'):
-            educations[education['id']] = education['description']
-        education_id = 0
-        if 'education_id' in request.GET:
-            education_id = int(request.GET['education_id'])
-        if education_id != 0:
-            if education_id in educations.keys():
-                clauses_sql += " and (e.id = %s or e.oid = %s)"
-                clauses_params.extend([education_id, education_id])
-                filters['education'] = { 'id': education_id, 'name': educations[education_id] }
-            else:
-                raise Exception('wrong institution parameter: %s not in educations_ids' % education_id)
-
-        #
-        # building results
-        #
-        total_sql = "select count(*) as n %s %s" % (base_sql, clauses_sql)
-        cursor.execute(total_sql, clauses_params)
-        row = cursor.fetchone()
-        results['total'] = row[0]
-
-        age_numbers = {
-            'twenties':   { 'count': 0 },
-            'thirties':   { 'count': 0 },
-            'fourties':   { 'count': 0 },
-            'fifties':    { 'count': 0 },
-            'sixties':    { 'count': 0 },
-            'seventies':  { 'count': 0 },
-            'eighties':   { 'count': 0 },
-            'nineties':   { 'count': 0 },
-            'venerables': { 'count': 0 }
-        }
-        if age == 0:
-            age_sql = """select YEAR(CURDATE())-YEAR(p.birth_date) as age, count(*) as n
-              %s %s
-              group by age order by n desc""" % (base_sql, clauses_sql)
-            cursor.execute(age_sql, clauses_params)
-
-            for row in cursor.fetchall():
-                age = row[0]
-                if age < 25:
-                    age_numbers['twenties']['count'] += row[1]
-                elif age >= 25 and age < 35:
-                    age_numbers['thirties']['count'] += row[1]
-                elif age >= 35 and age < 45:
-                    age_numbers['fourties']['count'] += row[1]
-                elif age >= 45 and age < 55:
-                    age_numbers['fifties']['count'] += row[1]
-                elif age >= 55 and age < 65:
-                    age_numbers['sixties']['count'] += row[1]
-                elif age >= 65 and age < 75:
-                    age_numbers['seventies']['count'] += row[1]
-                elif age >= 75 and age < 85:
-                    age_numbers['eighties']['count'] += row[1]
-                elif age >= 85 and age < 95:
-                    age_numbers['nineties']['count'] += row[1]
-                elif age >= 9:
-                    age_numbers['venerables']['count'] += row[1]
-
-            results['age'] = age_numbers
-
-
-        if sex == 0:
-            sex_sql = """select p.sex, count(*) as n
-              %s %s
-              group by p.sex order by n desc""" % (base_sql, clauses_sql)
-            cursor.execute(sex_sql, clauses_params)
-            sex_numbers = {}
-            for row in cursor.fetchall():
-                sex = row[0]
-                sex_numbers[sex] = int(row[1])
-
-            if 'M' in sex_numbers.keys():
-                sex_numbers_m = sex_numbers['M']
-            else:
-                sex_numbers_m = 0
-
-            if 'F' in sex_numbers.keys():
-                sex_numbers_f = sex_numbers['F']
-            else:
-                sex_numbers_f = 0
-
-            results['sex'] = { 'M': { 'count': sex_numbers_m }, 'F': { 'count': sex_numbers_f } }
-
-
-        institution_numbers = {}
-        for inst in OpInstitution.objects.using('politici').all().values('id', 'name'):
-            if 'giunta' in inst['name'].lower() or 'consiglio' in inst['name'].lower() or 'commissariamento' in inst['name'].lower():
-                institution_numbers[inst['id']] = { 'name': inst['name'], 'count': 0 }
-        if institution == 0:
-            institution_sql = """select i.id, count(*) as n
-              %s %s
-              group by i.id order by n desc""" % (base_sql, clauses_sql)
-            cursor.execute(institution_sql, clauses_params)
-            for row in cursor.fetchall():
-                i_id = row[0]
-                i_count = int(row[1])
-
-                if i_id in institution_numbers:
-                    institution_numbers[i_id]['count'] += i_count
-                else:
-                    if settings.DEBUG:
-                        print "Impossibile trovare institution_id: %s" % (i_id,)
-
-            results['institutions'] = institution_numbers
-
-
-        profession_numbers = {}
-        for profession in OpProfession.objects.db_manager('politici').getBasic().values('id', 'odescription'):
-            profession_numbers[profession['id']] = { 'name': profession['odescription'], 'count': 0 }
-        if profession_id == 0:
-            profession_sql = """select pr.id, pr.oid, count(*) as n
-              %s %s
-              group by pr.id, pr.oid order by n desc""" % (base_sql, clauses_sql)
-            cursor.execute(profession_sql, clauses_params)
-            for row in cursor.fetchall():
-                if row[1] != None:
-                    p_id = row[1]
-                else:
-                    p_id = row[0]
-                p_count = int(row[2])
-                if p_id in profession_numbers:
-                    profession_numbers[p_id]['count'] += p_count
-                else:
-                    if settings.DEBUG:
-                        print "Impossibile trovare profession_id (oid: %s, id: %s)" % (row[1], row[0])
-
-            results['professions'] = profession_numbers
-
-
-        education_numbers = {}
-        for education in OpEducationLevel.objects.db_manager('politici').getBasic().values('id', 'description'):
-            education_numbers[education['id']] = { 'name': education['description'], 'count': 0 }
-        if education_id == 0:
-            education_sql = """select e.id, e.oid, count(*) as n
-              %s %s
-              group by e.id, e.oid order by n desc""" % (base_sql, clauses_sql)
-            cursor.execute(education_sql, clauses_params)
-            for row in cursor.fetchall():
-                if row[1] != None:
-                    e_id = row[1]
-                else:
-                    e_id = row[0]
-                e_count = int(row[2])
-
-                if e_id in education_numbers:
-                    education_numbers[e_id]['count'] += e_count
-                else:
-                    if settings.DEBUG:
-                        print "Impossibile trovare education_id (oid: %s, id: %s)" % (row[0], row[1])
-
-            results['educations'] = education_numbers
-
-
-        return { 'filters': filters, 'results': results }
+        """
+        Return statistics on current charges, filtered by the
+        location_type, location_id, age, sex, institution,
+        profession_id and education_id GET parameters.
+
+        See ``politici.statistics``; a ValueError is raised for wrong parameters.
+        """
+        from .statistics import ChargesStatistics
+
+        try:
+            profession_id = int(request.GET.get('profession_id', 0))
+            education_id = int(request.GET.get('education_id', 0))
+        except ValueError:
+            raise ValueError('profession_id and education_id must be integers')
+
+        statistics = ChargesStatistics(
+            location_type=request.GET.get('location_type'),
+            location_id=request.GET.get('location_id'),
+            using='politici'
+        )
+        return statistics.compute(
+            age=request.GET.get('age'),
+            sex=request.GET.get('sex'),
+            institution=request.GET.get('institution'),
+            profession_id=profession_id,
+            education_id=education_id
+        )
 
 
 
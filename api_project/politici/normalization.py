@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+In-process registries of the small lookup tables that carry
+a normalization pointer (the ``oid`` column):
+OpParty, OpGroup, OpProfession and OpEducationLevel.
+
+Each table is loaded once per process, with a single query,
+and kept in memory, so that normalized rows are found in O(1)
+without hitting the DB.
+
+Rows are reloaded when the TTL expires (``NORMALIZATION_CACHE_TTL`` setting,
+in seconds, one hour by default), or when a row is saved or deleted through
+the ORM, or when ``invalidate`` is called explicitly.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+__author__ = 'guglielmo'
+
+
+class NormalizationRegistry(object):
+    """
+    Maps the ids of a lookup table to its rows (normalized ones included).
+    """
+
+    def __init__(self, model, using='politici', ttl=None):
+        self.model = model
+        self.using = using
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'NORMALIZATION_CACHE_TTL', 3600)
+
+    @property
+    def rows(self):
+        """
+        Return the dictionary of all rows, by id,
+        loading it, if empty or expired.
+        """
+        rows = self._rows
+        if rows is None or time.time() - self._loaded_at > self.get_ttl():
+            with self._lock:
+                # reloaded unless another thread did it meanwhile (the rows
+                # may also have been invalidated meanwhile)
+                if self._rows is rows or self._rows is None:
+                    self._rows = dict(
+                        (row.pk, row) for row in self.model.objects.using(self.using).all()
+                    )
+                    self._loaded_at = time.time()
+                rows = self._rows
+        return rows
+
+    def invalidate(self, *args, **kwargs):
+        """
+        Empty the registry, rows are reloaded at the next access.
+        Can be used as a signal receiver.
+        """
+        with self._lock:
+            self._rows = None
+
+    def get(self, pk):
+        """
+        Return the row with the given id.
+        Rows not yet in the registry are looked up in the DB
+        (a DoesNotExist is raised if not found).
+        """
+        try:
+            return self.rows[pk]
+        except KeyError:
+            return self.model.objects.db_manager(self.using).get(pk=pk)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from api.serializers import FlatSerializer
 from politici.fields import HyperlinkedParlamentareIdentityField
 from politici.models import OpUser, OpResources, OpPolitician, OpContent, OpInstitutionCharge, OpOpenContent, \
     OpParty, OpGroup, \
@@ -186,3 +187,22 @@ class PoliticianExportSerializer(serializers.HyperlinkedModelSerializer):
             'profession', 'education_levels',
             'institution_charges',
         )
+
+
+class InstitutionFlatSerializer(FlatSerializer):
+    fields = (
+        ('id', 'id'),
+        ('name', 'name'),
+        ('short_name', 'short_name'),
+        ('priority', 'priority'),
+    )
+
+
+class ChargeTypeFlatSerializer(FlatSerializer):
+    fields = (
+        ('id', 'id'),
+        ('name', 'name'),
+        ('short_name', 'short_name'),
+        ('priority', 'priority'),
+        ('category', 'category'),
+    )
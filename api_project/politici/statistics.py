@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics on current institution charges.
+
+All breakdowns (age, sex, institution, profession, education) are computed
+from a single *cube*, counting current charges by birth year, sex,
+institution, normalized profession and normalized education level
+of their politicians.
+
+Current charges of the locations of the context are read from the
+interval index (see ``politici.intervals``), with no join to their
+contents; then a query reads the birth year, sex, profession and
+education levels of their politicians.
+
+The cube only depends on the location context, so it is cached
+(``STATISTICS_CACHE_TTL`` setting, in seconds, 10 minutes by default)
+and every combination of the other filters is answered from memory.
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from politici.intervals import Bounds, intervals
+
+__author__ = 'guglielmo'
+
+
+LOCATION_TYPES = ('all', 'regional', 'provincial', 'city')
+
+# age filters, and the decade number they select (see ``decade``)
+AGES = {
+    'twenties': 2,
+    'thirties': 3,
+    'forties': 4,
+    'fifties': 5,
+    'sixties': 6,
+    'seventies': 7,
+    'eighties': 8,
+    'nineties': 9,
+    'venerables': 10,
+}
+
+# age breakdown keys, by decade number
+AGE_BREAKDOWN = (
+    'twenties', 'thirties', 'fourties', 'fifties', 'sixties',
+    'seventies', 'eighties', 'nineties', 'venerables',
+)
+
+SEXES = ('M', 'F')
+
+INSTITUTIONS = (
+    'giunta_regionale', 'consiglio_regionale',
+    'giunta_provinciale', 'consiglio_provinciale',
+    'giunta_comunale', 'consiglio_comunale',
+    'commissariamento',
+)
+
+
+def decade(birth_year, current_year):
+    """
+    Decade number of an age, with boundaries at 5:
+    ages from 15 to 24 are in decade 2, from 25 to 34 in decade 3, ...
+
+    Unknown ages are in decade 0.
+    """
+    if birth_year is None:
+        return 0
+    return (current_year - birth_year + 5) // 10
+
+
+class ChargesStatistics(object):
+    """
+    Computes statistics on current charges, for a location context.
+    """
+    politicians_sql = """
+        select p.content_id, %s, p.sex, coalesce(pr.oid, pr.id), coalesce(e.oid, e.id)
+        from op_politician p, op_profession pr, op_politician_has_op_education_level pe, op_education_level e
+        where p.profession_id=pr.id and p.content_id=pe.politician_id and pe.education_level_id=e.id
+        """
+
+    # politicians are read in chunks of ids, or all at once when there are more
+    politicians_chunk_size = 500
+    politicians_max_chunks = 20
+
+    def __init__(self, location_type=None, location_id=None, using='politici'):
+        self.using = using
+        self.location_type = location_type
+        self.location_id = location_id
+        self.location_filter = {}
+
+        if location_id and location_type != 'all':
+            if location_type not in LOCATION_TYPES:
+                raise ValueError(
+                    'wrong location type parameter: %s not in (regional, provincial, city)' % location_type
+                )
+            self.location_filter = {'%s_id' % location_type: location_id}
+        elif location_type == 'all':
+            self.location_filter = {'location_type_id__in': (4, 5, 6)}
+
+    @property
+    def cache_key(self):
+        return 'politici:statistics:{0}:{1}:{2}'.format(
+            self.using, self.location_type, self.location_id
+        )
+
+    def get_cube(self):
+        """
+        Return the list of (birth_year, sex, institution_id, profession_id,
+        education_id, count) rows, from the cache or from the DB.
+        """
+        cube = cache.get(self.cache_key)
+        if cube is None:
+            cube = self.build_cube()
+            cache.set(self.cache_key, cube, getattr(settings, 'STATISTICS_CACHE_TTL', 600))
+        return cube
+
+    def build_cube(self):
+        from territori.models import OpLocation
+
+        index = intervals.get(self.using)
+        location_ids = list(OpLocation.objects.using(self.using).filter(**self.location_filter).
+                            values_list('id', flat=True))
+        current = Bounds(current=True).as_ordinals()
+
+        # number of current charges, by politician and institution
+        charges = defaultdict(int)
+        for key in index.select(location_ids=location_ids):
+            for start, end, charge_id, politician_id in index.groups[key].find(*current):
+                charges[politician_id, key[1]] += 1
+        institutions = defaultdict(list)
+        for politician_id, institution_id in charges:
+            institutions[politician_id].append(institution_id)
+
+        cube = defaultdict(int)
+        for p_id, y, sex, pr_id, e_id in self.get_politicians(sorted(institutions)):
+            for i_id in institutions[p_id]:
+                cube[int(y) if y is not None else None, sex, i_id, pr_id, e_id] += charges[p_id, i_id]
+        return [key + (n,) for key, n in cube.items()]
+
+    def get_politicians(self, politician_ids):
+        """
+        Return the (id, birth_year, sex, profession_id, education_id) rows
+        of the politicians, one for each of their education levels.
+        """
+        connection = connections[self.using]
+        sql = self.politicians_sql % connection.ops.date_extract_sql('year', 'p.birth_date')
+        cursor = connection.cursor()
+        if len(politician_ids) > self.politicians_chunk_size * self.politicians_max_chunks:
+            cursor.execute(sql)
+            selected = set(politician_ids)
+            return [row for row in cursor.fetchall() if row[0] in selected]
+        rows = []
+        for start in range(0, len(politician_ids), self.politicians_chunk_size):
+            chunk = politician_ids[start:start + self.politicians_chunk_size]
+            cursor.execute(sql + ' and p.content_id in (%s)' % ', '.join(['%s'] * len(chunk)), chunk)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def compute(self, age=None, sex=None, institution=None, profession_id=None, education_id=None):
+        """
+        Return the filters and the results, in the format
+        of ``OpInstitutionChargeManager.get_statistics``.
+
+        Breakdowns are not computed for the dimensions that are filtered.
+        """
+        from politici.models import OpInstitution, OpProfession, OpEducationLevel
+
+        filters = {}
+        if self.location_id and self.location_type != 'all':
+            from territori.models import OpLocation
+            location = OpLocation.objects.db_manager(self.using).retrieve_by_type(
+                self.location_type, self.location_id, codename='istat'
+            )
+            filters['location_context'] = {
+                'type': self.location_type, 'id': self.location_id,
+                'name': location.name, 'op_location_id': location.id
+            }
+        elif self.location_type == 'all':
+            filters['location_context'] = {'type': 'all'}
+
+        professions = dict(
+            (p.id, p.odescription or p.description)
+            for p in OpProfession.normalizations.rows.values() if p.oid is None
+        )
+        educations = dict(
+            (e.id, e.description)
+            for e in OpEducationLevel.normalizations.rows.values() if e.oid is None
+        )
+        institutions = self.get_institutions(OpInstitution)
+
+        if age:
+            if age not in AGES:
+                raise ValueError('wrong age parameter: %s not in (twenties, thirties, ..., nineties, venerables)' % age)
+            filters['age'] = age
+        if sex:
+            if sex not in SEXES:
+                raise ValueError('wrong sex parameter: %s not in (M, F)' % sex)
+            filters['sex'] = sex
+        institution_ids = None
+        if institution:
+            if institution not in INSTITUTIONS:
+                raise ValueError('wrong institution parameter: %s not in (giunta_regionale, consiglio_regionale, ...)' % institution)
+            filters['institution'] = institution.replace('_', ' ')
+            institution_ids = set(
+                i_id for i_id, name in institutions.items()
+                if name.lower() == filters['institution']
+            )
+        if profession_id:
+            if profession_id not in professions:
+                raise ValueError('wrong profession parameter: %s not in professions_ids' % profession_id)
+            filters['profession'] = {'id': profession_id, 'name': professions[profession_id]}
+        if education_id:
+            if education_id not in educations:
+                raise ValueError('wrong education parameter: %s not in educations_ids' % education_id)
+            filters['education'] = {'id': education_id, 'name': educations[education_id]}
+
+        current_year = date.today().year
+        total = 0
+        age_counts = dict((k, 0) for k in AGE_BREAKDOWN)
+        sex_counts = dict((k, 0) for k in SEXES)
+        institution_counts = dict(
+            (i_id, {'name': name, 'count': 0}) for i_id, name in institutions.items()
+            if 'giunta' in name.lower() or 'consiglio' in name.lower() or 'commissariamento' in name.lower()
+        )
+        profession_counts = dict(
+            (p.id, {'name': p.odescription, 'count': 0})
+            for p in OpProfession.normalizations.rows.values() if p.oid is None
+        )
+        education_counts = dict(
+            (e_id, {'name': name, 'count': 0}) for e_id, name in educations.items()
+        )
+
+        for birth_year, p_sex, i_id, p_id, e_id, n in self.get_cube():
+            d = decade(birth_year, current_year)
+            if age and (birth_year is None or d != AGES[age]):
+                continue
+            if sex and p_sex != sex:
+                continue
+            if institution_ids is not None and i_id not in institution_ids:
+                continue
+            if profession_id and p_id != profession_id:
+                continue
+            if education_id and e_id != education_id:
+                continue
+
+            total += n
+            age_counts[AGE_BREAKDOWN[min(max(d, 2), 10) - 2]] += n
+            if p_sex in sex_counts:
+                sex_counts[p_sex] += n
+            if i_id in institution_counts:
+                institution_counts[i_id]['count'] += n
+            if p_id in profession_counts:
+                profession_counts[p_id]['count'] += n
+            if e_id in education_counts:
+                education_counts[e_id]['count'] += n
+
+        results = {'total': total}
+        if not age:
+            results['age'] = dict((k, {'count': v}) for k, v in age_counts.items())
+        if not sex:
+            results['sex'] = dict((k, {'count': v}) for k, v in sex_counts.items())
+        if not institution:
+            results['institutions'] = institution_counts
+        if not profession_id:
+            results['professions'] = profession_counts
+        if not education_id:
+            results['educations'] = education_counts
+
+        return {'filters': filters, 'results': results}
+
+    def get_institutions(self, model):
+        """
+        Return the names of the institutions, by id (cached).
+        """
+        key = 'politici:statistics:{0}:institutions'.format(self.using)
+        institutions = cache.get(key)
+        if institutions is None:
+            institutions = dict(model.objects.using(self.using).values_list('id', 'name'))
+            cache.set(key, institutions, getattr(settings, 'STATISTICS_CACHE_TTL', 600))
+        return institutions
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic politicians, with their education, resources and
+institution charges in the locations of the database
+(see ``territori.synthetic``), generated from a seed, to test
+and benchmark the API on a local database.
+
+Parties, groups, professions and education levels
+have normalized rows (``oid``), as in the openpolis database.
+"""
+from datetime import date, datetime, timedelta
+import itertools
+import random
+
+from politici.models import OpUser, OpContent, OpOpenContent, OpPolitician, OpInstitution, \
+    OpChargeType, OpElectionType, OpConstituency, OpParty, OpGroup, OpProfession, OpEducationLevel, \
+    OpPoliticianHasOpEducationLevel, OpResourcesType, OpResources, OpInstitutionCharge
+from territori.models import OpLocation
+
+__author__ = 'guglielmo'
+
+
+# institutions, by level of their locations
+INSTITUTIONS = (
+    (1, 'Giunta Regionale', OpLocation.REGION_TYPE_ID),
+    (2, 'Consiglio Regionale', OpLocation.REGION_TYPE_ID),
+    (3, 'Giunta Provinciale', OpLocation.PROVINCE_TYPE_ID),
+    (4, 'Consiglio Provinciale', OpLocation.PROVINCE_TYPE_ID),
+    (5, 'Giunta Comunale', OpLocation.CITY_TYPE_ID),
+    (6, 'Consiglio Comunale', OpLocation.CITY_TYPE_ID),
+    (7, 'Commissariamento', OpLocation.CITY_TYPE_ID),
+)
+
+CHARGE_TYPES = (
+    (1, 'Presidente', 'P'),
+    (2, 'Assessore', 'A'),
+    (3, 'Consigliere', 'C'),
+    (4, 'Sindaco', 'S'),
+    (5, 'Vicesindaco facente funzione sindaco', 'V'),
+    (6, 'Commissario straordinario', 'K'),
+)
+
+# charge types of the members of each institution
+MEMBERS = {
+    1: (2,), 2: (3,), 3: (2,), 4: (3,), 5: (2,), 6: (3,), 7: (6,),
+}
+HEADS = {1: 1, 3: 1, 5: 4}
+
+PARTIES = ('Partito Democratico', 'Forza Italia', 'Lega Nord', 'Movimento 5 Stelle',
+           'Sinistra Ecologia Libertà', 'Nuovo Centrodestra', 'Fratelli d\'Italia', 'Lista civica')
+PROFESSIONS = ('Avvocato', 'Medico', 'Insegnante', 'Impiegato', 'Imprenditore', 'Ingegnere', 'Pensionato')
+EDUCATION_LEVELS = ('Licenza media', 'Diploma', 'Laurea', 'Dottorato')
+FIRST_NAMES = ((u'Mario', u'Giuseppe', u'Luca', u'Marco', u'Andrea', u'Nicolò', u'Francesco'),
+               (u'Maria', u'Anna', u'Giulia', u'Francesca', u'Chiara', u'Lucia', u'Elena'))
+LAST_NAMES = (u'Rossi', u'Russo', u'Ferrari', u'Esposito', u'Bianchi', u'Romano', u'Colombo',
+              u'Ricci', u'Marino', u'Greco', u'Bruno', u'Gallo', u'Conti', u'De Luca', u'Mancini')
+
+
+def build_lookups(using):
+    """
+    Create the user, institutions, charge types, parties, groups, professions,
+    education levels and resources types referenced by politicians and charges.
+    """
+    OpUser.objects.using(using).create(id=1, is_active=1, email='admin@openpolis.it',
+                                       wants_newsletter=0, public_name=0)
+    OpInstitution.objects.using(using).bulk_create([
+        OpInstitution(id=i, name=name, short_name=name, priority=i) for i, name, location_type in INSTITUTIONS
+    ])
+    OpChargeType.objects.using(using).bulk_create([
+        OpChargeType(id=i, name=name, short_name=name.split()[0], priority=i, category=category)
+        for i, name, category in CHARGE_TYPES
+    ])
+    OpElectionType.objects.using(using).create(id=1, name='amministrative')
+    OpConstituency.objects.using(using).create(id=1, name='Collegio unico', election_type_id=1)
+
+    # each normalized row has an old, not normalized, duplicate
+    for model, field, values in ((OpParty, 'name', PARTIES), (OpGroup, 'name', PARTIES),
+                                 (OpProfession, 'description', PROFESSIONS),
+                                 (OpEducationLevel, 'description', EDUCATION_LEVELS)):
+        n = len(values)
+        model.objects.using(using).bulk_create(
+            [model(id=i + 1, **{field: value}) for i, value in enumerate(values)] +
+            [model(id=n + i + 1, oid=i + 1, **{field: value.lower()}) for i, value in enumerate(values)]
+        )
+    OpResourcesType.objects.using(using).bulk_create([
+        OpResourcesType(id=1, denominazione='email'), OpResourcesType(id=2, denominazione='url sito'),
+    ])
+
+
+def build_politici(using, politicians=60, charges=3, seed=1, batch_size=500, logger=None):
+    """
+    Create the lookups and ``politicians`` politicians, with about
+    ``charges`` institution charges each, in the existing locations:
+    the first charge of a politician is the one of mayor of a city,
+    in turn, so that every city has its mayors; the others are in
+    random institutions and periods, and may overlap.
+    """
+    rnd = random.Random(seed)
+    build_lookups(using)
+    locations = dict(
+        (location_type, list(OpLocation.objects.using(using).filter(
+            location_type_id=location_type).order_by('id').values_list('id', flat=True)))
+        for location_type in (OpLocation.REGION_TYPE_ID, OpLocation.PROVINCE_TYPE_ID, OpLocation.CITY_TYPE_ID)
+    )
+    cities = locations[OpLocation.CITY_TYPE_ID]
+    institutions = [i for i in INSTITUTIONS if locations[i[2]]]
+
+    content_ids = itertools.count(1)
+    rows = dict((model, []) for model in (OpContent, OpOpenContent, OpPolitician, OpPoliticianHasOpEducationLevel,
+                                          OpResources, OpInstitutionCharge))
+
+    def flush(force=False):
+        if force or len(rows[OpContent]) >= batch_size:
+            for model in (OpContent, OpOpenContent, OpPolitician, OpPoliticianHasOpEducationLevel,
+                          OpResources, OpInstitutionCharge):
+                model.objects.using(using).bulk_create(rows[model], batch_size)
+                del rows[model][:]
+
+    def content(updated_at, deleted_at=None, open_content=True):
+        content_id = next(content_ids)
+        rows[OpContent].append(OpContent(id=content_id, reports=0, created_at=updated_at, updated_at=updated_at))
+        if open_content:
+            rows[OpOpenContent].append(OpOpenContent(content_id=content_id, user_id=1, deleted_at=deleted_at))
+        return content_id
+
+    n_parties, n_professions, n_levels = len(PARTIES), len(PROFESSIONS), len(EDUCATION_LEVELS)
+    for p in range(politicians):
+        sex = rnd.choice('MF')
+        birth_date = datetime(rnd.randint(1930, 1990), rnd.randint(1, 12), rnd.randint(1, 28))
+        updated_at = datetime(2014, 1, 1) + timedelta(seconds=rnd.randint(0, 365 * 86400))
+        politician_id = content(updated_at, open_content=False)
+        rows[OpPolitician].append(OpPolitician(
+            content_id=politician_id, first_name=rnd.choice(FIRST_NAMES[sex == 'F']),
+            last_name=rnd.choice(LAST_NAMES), sex=sex, birth_date=birth_date,
+            profession_id=rnd.randint(1, 2 * n_professions), is_indexed=0, minint_aka=str(politician_id),
+        ))
+        rows[OpPoliticianHasOpEducationLevel].append(OpPoliticianHasOpEducationLevel(
+            politician_id=politician_id, education_level_id=rnd.randint(1, 2 * n_levels),
+        ))
+        rows[OpResources].append(OpResources(
+            content_id=content(updated_at), politician_id=politician_id, resources_type_id=1,
+            valore='politico{0}@example.org'.format(politician_id),
+        ))
+
+        for k in range(max(1, int(round(rnd.gauss(charges, charges / 3.0))))):
+            if k == 0 and cities:
+                institution_id, charge_type_id = 5, 4
+                location_id = cities[p % len(cities)]
+            else:
+                institution_id, name, location_type = rnd.choice(institutions)
+                charge_type_id = rnd.choice(MEMBERS[institution_id])
+                if institution_id in HEADS and rnd.random() < 0.1:
+                    charge_type_id = HEADS[institution_id]
+                location_id = rnd.choice(locations[location_type])
+            # charges not ended by 2015 are current
+            date_start = date(rnd.randint(1995, 2014), rnd.randint(1, 12), 1)
+            date_end = date_start + timedelta(days=rnd.randint(365, 5 * 365))
+            if date_end > date(2014, 12, 31):
+                date_end = None
+            party_id = rnd.randint(1, 2 * n_parties)
+            rows[OpInstitutionCharge].append(OpInstitutionCharge(
+                content_id=content(updated_at, deleted_at=updated_at if rnd.random() < 0.02 else None),
+                politician_id=politician_id, institution_id=institution_id, charge_type_id=charge_type_id,
+                location_id=location_id, party_id=party_id, group_id=party_id,
+                date_start=date_start, date_end=date_end,
+                description='Commissario prefettizio' if charge_type_id == 6 else '',
+            ))
+        flush()
+        if logger and (p + 1) % 10000 == 0:
+            logger.info(u"{0} politicians".format(p + 1))
+    flush(force=True)
@@ -5,7 +5,27 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import copy
+from datetime import date, datetime
+import json
+
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from api import benchmark, testing
+from api.testing import ApiTestCase, Budget, QueryBudgetMixin
+from politici.intervals import Bounds, ChargeIntervals, intervals
+from politici.models import OpUser, OpContent, OpOpenContent, OpPolitician, OpInstitution, \
+    OpChargeType, OpParty, OpGroup, OpProfession, OpEducationLevel, OpPoliticianHasOpEducationLevel, \
+    OpResourcesType, OpResources, OpInstitutionCharge
+from parlamento.synthetic import build_parlamento
+from politici.synthetic import build_politici
+from politici.watermarks import contents
+from territori.models import OpLocation, OpLocationType
+from territori.synthetic import build_locations
 
 
 class SimpleTest(TestCase):
@@ -14,3 +34,299 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+# queries are counted on the views, not on the response cache
+@override_settings(RESPONSE_CACHE=None)
+class PoliticianListQueriesTest(ApiTestCase):
+    """
+    The number of queries needed to build a page of politicians
+    must not depend on the page size.
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+
+    def build_data(self):
+        politicians = OpPolitician.objects.db_manager('politici')
+        OpLocationType.objects.using('politici').create(id=OpLocation.CITY_TYPE_ID, name='Comune')
+        OpLocation.objects.using('politici').create(
+            id=1, location_type_id=OpLocation.CITY_TYPE_ID, name='Roma', prov='RM'
+        )
+        user = OpUser.objects.using('politici').create(
+            id=1, is_active=1, email='', wants_newsletter=0, public_name=0
+        )
+        OpInstitution.objects.using('politici').create(id=1, name='Giunta Comunale')
+        OpChargeType.objects.using('politici').create(id=1, name='Assessore', short_name='Assessore', category='I')
+        OpParty.objects.using('politici').create(id=1, name='Partito', acronym='P')
+        OpParty.objects.using('politici').create(id=2, name='Partito vecchio', oid=1)
+        OpGroup.objects.using('politici').create(id=1, name='Gruppo', acronym='G')
+        OpGroup.objects.using('politici').create(id=2, name='Gruppo vecchio', oid=1)
+        OpProfession.objects.using('politici').create(id=1, description='Avvocato')
+        OpProfession.objects.using('politici').create(id=2, description='avvocato', oid=1)
+        OpEducationLevel.objects.using('politici').create(id=1, description='Laurea')
+        OpEducationLevel.objects.using('politici').create(id=2, description='laurea', oid=1)
+        OpResourcesType.objects.using('politici').create(id=1, denominazione='email')
+
+        self.content_id = 0
+
+        def open_content():
+            self.content_id += 1
+            content = OpContent.objects.using('politici').create(
+                id=self.content_id, reports=0, updated_at=datetime(2014, 1, 1)
+            )
+            return OpOpenContent.objects.using('politici').create(content=content, user=user)
+
+        for i in range(30):
+            politician = politicians.create(
+                content=open_content().content, first_name='Nome', last_name='Cognome {0}'.format(i),
+                is_indexed=0, minint_aka=str(i), profession_id=1 + i % 2
+            )
+            OpPoliticianHasOpEducationLevel.objects.using('politici').create(
+                politician=politician, education_level_id=1 + i % 2
+            )
+            OpResources.objects.using('politici').create(
+                content=open_content(), politician=politician, resources_type_id=1, valore='a@b.it'
+            )
+            for k in range(2):
+                OpInstitutionCharge.objects.using('politici').create(
+                    content=open_content(), politician=politician,
+                    institution_id=1, charge_type_id=1, location_id=1,
+                    party_id=1 + k, group_id=2 - k, date_start=date(2010 + k, 1, 1)
+                )
+
+    def count_queries(self, page_size):
+        with CaptureQueriesContext(connections['politici']) as context:
+            response = self.client.get(
+                reverse('politici:politician-list'), {'format': 'json', 'page_size': page_size}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['results']), page_size)
+        return len(context)
+
+    def test_queries_do_not_grow_with_page_size(self):
+        # warm up the normalization registries
+        self.count_queries(30)
+        self.assertEqual(self.count_queries(5), self.count_queries(30))
+
+
+class ChargeIntervalsTest(ApiTestCase):
+    """
+    The interval index finds the same charges as the DB,
+    and is refreshed incrementally (see politici.intervals).
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+
+    def build_data(self):
+        build_locations('politici', regions=1, provinces=2, cities=5)
+        build_politici('politici', politicians=40)
+        self.charges = OpInstitutionCharge.objects.using('politici').filter(content__deleted_at__isnull=True)
+
+    def assertFinds(self, bounds, queryset, **kwargs):
+        found = intervals.get('politici').find(bounds, **kwargs)
+        self.assertEqual(sorted(c[2] for c in found), sorted(queryset.values_list('pk', flat=True)))
+
+    def test_find(self):
+        day = date(2005, 6, 1)
+        self.assertFinds(Bounds(current=True), self.charges.filter(date_end__isnull=True))
+        self.assertFinds(Bounds(current=False, end_min=day), self.charges.filter(date_end__gte=day))
+        self.assertFinds(
+            Bounds(start_max=day, end_min=day),
+            self.charges.filter(date_start__lte=day).filter(Q(date_end__isnull=True) | Q(date_end__gte=day))
+        )
+        location_id = self.charges[0].location_id
+        self.assertFinds(
+            Bounds(start_min=day), self.charges.filter(date_start__gte=day, location_id=location_id),
+            location_ids=[location_id]
+        )
+        self.assertFinds(Bounds(current=True).narrow(current=False), self.charges.none())
+
+    def test_refresh(self):
+        index = intervals.get('politici')
+        ended, deleted, moved = self.charges.filter(date_end__isnull=True)[:3]
+        OpInstitutionCharge.objects.using('politici').filter(pk=ended.pk).update(date_end=date(2014, 1, 1))
+        OpOpenContent.objects.using('politici').filter(pk=deleted.pk).update(deleted_at=datetime(2015, 1, 1))
+        OpInstitutionCharge.objects.using('politici').filter(pk=moved.pk).update(institution=99)
+        OpContent.objects.using('politici').filter(pk__in=[ended.pk, deleted.pk, moved.pk]).update(
+            updated_at=datetime(2015, 1, 1)
+        )
+        contents.invalidate()
+
+        refreshed = intervals.get('politici')
+        self.assertIsNot(refreshed, index)
+        self.assertEqual(len(refreshed), len(index) - 1)
+        self.assertFinds(Bounds(current=True), self.charges.filter(date_end__isnull=True))
+        # only the groups of the charges updated since the last refresh are replaced
+        key = (ended.location_id, ended.institution_id, ended.charge_type_id)
+        self.assertIsNot(refreshed.groups[key], index.groups[key])
+        updated = set(OpInstitutionCharge.objects.using('politici').filter(
+            content__content__updated_at__gte=index.last_update
+        ).values_list('location_id', 'institution_id', 'charge_type_id'))
+        updated.add((moved.location_id, moved.institution_id, moved.charge_type_id))
+        self.assertTrue(all(refreshed.groups[k] is index.groups[k] for k in set(index.groups) - updated))
+
+        # the refreshed index is the same as a rebuilt one
+        rebuilt = ChargeIntervals.build('politici')
+        self.assertEqual(sorted(refreshed.groups), sorted(rebuilt.groups))
+        for key, group in rebuilt.groups.items():
+            self.assertEqual(refreshed.groups[key].charges(), group.charges())
+        self.assertEqual(refreshed.charge_keys, rebuilt.charge_keys)
+        for refreshed_index, rebuilt_index in zip(refreshed.key_indexes, rebuilt.key_indexes):
+            self.assertEqual(
+                dict((i, sorted(keys)) for i, keys in refreshed_index.items()),
+                dict((i, sorted(keys)) for i, keys in rebuilt_index.items())
+            )
+        self.assertEqual(refreshed.institutions[99], [(moved.location_id, 99, moved.charge_type_id)])
+
+    def test_city_mayors(self):
+        mayor = self.charges.filter(charge_type_id=4, date_end__isnull=True)[0]
+        url = reverse('politici:city-mayors', kwargs={'location_id': mayor.location_id})
+        OpLocation.objects.using('politici').filter(pk=mayor.location_id).update(
+            last_charge_update=datetime(2014, 6, 1)
+        )
+        count = len(self.client.get(url, {'format': 'json'}).data['sindaci'])
+
+        # the mayor is removed, and the location updated, before the index sees it
+        OpOpenContent.objects.using('politici').filter(pk=mayor.pk).update(deleted_at=datetime(2015, 1, 1))
+        OpContent.objects.using('politici').filter(pk=mayor.pk).update(updated_at=datetime(2015, 1, 1))
+        OpLocation.objects.using('politici').filter(pk=mayor.location_id).update(
+            last_charge_update=datetime(2015, 1, 1)
+        )
+        response = self.client.get(url, {'format': 'json'})
+        self.assertEqual(len(response.data['sindaci']), count)
+
+        # the mayors read from the previous index are not kept
+        contents.invalidate()
+        response = self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['sindaci']), count - 1)
+
+    def test_charge_list(self):
+        response = self.client.get(
+            reverse('politici:instcharge-list'), {'format': 'json', 'date': '2005-06-01', 'page_size': 1000}
+        )
+        self.assertEqual(response.status_code, 200)
+        day = date(2005, 6, 1)
+        charges = self.charges.filter(date_start__lt=day).filter(Q(date_end__isnull=True) | Q(date_end__gt=day))
+        results = json.loads(response.content)['results']
+        self.assertEqual(len(results), charges.count())
+        self.assertEqual(
+            sorted((c['date_start'], c['date_end']) for c in results),
+            sorted((c.date_start.isoformat(), c.date_end and c.date_end.isoformat()) for c in charges)
+        )
+
+class ConditionalGetTest(ApiTestCase):
+    """
+    Conditional GETs are answered with 304 from the watermark
+    of the contents, without queries (see api.mixins.ConditionalGetMixin).
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+
+    def build_data(self):
+        build_locations('politici', regions=1, provinces=2, cities=5)
+        build_politici('politici', politicians=10)
+
+    def get(self, **headers):
+        with testing.CaptureAllQueriesContext() as context:
+            response = self.client.get(reverse('politici:politician-list'), HTTP_ACCEPT='application/json', **headers)
+        return response, len(context)
+
+    def test_not_modified(self):
+        response, queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response, queries = self.get(**headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(queries, 0)
+            self.assertEqual(response['ETag'], etag)
+
+        # a new watermark gives a new ETag
+        OpContent.objects.using('politici').filter(pk=1).update(updated_at=datetime(2020, 1, 1))
+        contents.invalidate()
+        response, queries = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+
+class PoliticiQueryBudgetTest(QueryBudgetMixin, ApiTestCase):
+    """
+    Queries and time of each URL, at page sizes 25 and 1000.
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+    urls_module = 'politici.urls'
+    namespace = 'politici'
+    budgets = {
+        'api-root': Budget(queries=0),
+        'politician-export': Budget(queries=4, seconds=1.0),
+        'politician-list': Budget(queries=5, seconds=1.0),
+        'politician-detail': Budget(queries=6, kwargs={'pk': 1}),
+        'instcharge-list': Budget(queries=5, seconds=2.0),
+        'instcharge-detail': Budget(queries=4, kwargs={'pk': 3}),
+        'institution-list': Budget(queries=2),
+        'institution-detail': Budget(queries=1, kwargs={'pk': 1}),
+        'chargetype-list': Budget(queries=2),
+        'chargetype-detail': Budget(queries=1, kwargs={'pk': 1}),
+        'statistics': Budget(queries=0, params={'location_type': 'regional', 'location_id': 1}),
+        'city-mayors': Budget(queries=1, kwargs={'location_id': 3}),
+    }
+
+    def build_data(self):
+        build_locations('politici', regions=2, provinces=3, cities=10)
+        build_politici('politici', politicians=60)
+
+
+@override_settings(RESPONSE_CACHE=None, PROFILING_ENABLED=False)
+class ApiBenchmarkTest(ApiTestCase):
+    """
+    Mixes of requests are replayed through the test client,
+    and summarized per endpoint (see api.benchmark).
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici'), 'parlamento18': ('parlamento',)}
+
+    def build_data(self):
+        build_locations('politici', regions=1, provinces=2, cities=5)
+        build_politici('politici', politicians=20)
+        build_parlamento('parlamento18', parliamentarians=20, sittings=2, votes=5)
+
+    def test_synthetic_mix(self):
+        requests = benchmark.synthetic_mix(size=60)
+        self.assertEqual(len(requests), 60)
+        self.assertTrue(set(r.endpoint for r in requests) <= set([
+            'politici:politician-list', 'politici:instcharge-list', 'politici:city-mayors',
+            'parlamento:parlamentare-detail', 'parlamento:votazione-detail',
+            'territori:location-list', 'territori:location-detail',
+        ]))
+        self.assertEqual(requests, benchmark.synthetic_mix(size=60))
+
+        summary = benchmark.run(requests, benchmark.ClientTransport(), warmup=10)
+        self.assertEqual(summary['meta']['requests'], 50)
+        self.assertEqual(sum(result['count'] for result in summary['endpoints'].values()), 50)
+        for endpoint, result in summary['endpoints'].items():
+            self.assertEqual(result['errors'], 0, endpoint)
+            self.assertTrue(result['p50'] <= result['p95'] <= result['p99'], endpoint)
+            self.assertIsNotNone(result['queries'], endpoint)
+            self.assertIsNotNone(result['peak_rss'], endpoint)
+
+        # the summary is stored as json, and compared with a baseline
+        baseline = json.loads(json.dumps(summary))
+        self.assertEqual(benchmark.compare(summary, baseline), [])
+        slower = copy.deepcopy(baseline)
+        slower['endpoints']['politici:politician-list'].update(p95=1000.0, queries=50.0)
+        base = baseline['endpoints']['politici:politician-list']
+        self.assertEqual(benchmark.compare(slower, baseline), [
+            u'politici:politician-list: p95 1000.0, baseline {0}'.format(base['p95']),
+            u'politici:politician-list: queries 50.0, baseline {0}'.format(base['queries']),
+        ])
+
+    def test_recording(self):
+        lines = [
+            'INFO 2014-06-01 {"method": "GET", "path": "/politici/politicians", "query_string": "namecontains=Rossi"}',
+            '{"method": "POST", "path": "/territori/locations/resolve", "query_string": ""}',
+            '{"method": "GET", "path": "/nowhere", "query_string": ""}',
+            'not json',
+        ]
+        self.assertEqual(benchmark.load_recording(lines), [
+            benchmark.Request('politici:politician-list', '/politici/politicians', 'namecontains=Rossi'),
+        ])
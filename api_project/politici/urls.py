@@ -1,6 +1,6 @@
 from django.conf.urls import patterns, url, include
 from rest_framework.urlpatterns import format_suffix_patterns
-from politici.views import HistoricalCityMayorsView
+from politici.views import HistoricalCityMayorsView, StatisticsView
 from politici.views import UserList, UserDetail, PoliticiansExport, PoliticianList, PoliticianDetail,\
    InstitutionList, ChargeTypeList, InstitutionChargeList, InstitutionChargeDetail, \
    InstitutionDetail, ChargeTypeDetail, PoliticiView
@@ -20,6 +20,7 @@ urlpatterns = patterns('politici.views',
    url(r'^institutions/(?P<pk>\d+)$', InstitutionDetail.as_view(), name='institution-detail'),
    url(r'^chargetypes$', ChargeTypeList.as_view(), name='chargetype-list'),
    url(r'^chargetypes/(?P<pk>\d+)$', ChargeTypeDetail.as_view(), name='chargetype-detail'),
+   url(r'^statistics$', StatisticsView.as_view(), name='statistics'),
    url(r'^city_mayors/(?P<location_id>[^/]+)/$',
        HistoricalCityMayorsView.as_view(), name='city-mayors'),
 
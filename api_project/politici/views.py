@@ -1,30 +1,51 @@
 # -*- coding: utf-8 -*-
-from datetime import date
+from datetime import date, timedelta
+import hashlib
+import time
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.utils.datastructures import SortedDict
 
 from rest_framework import generics, pagination, authentication, permissions, filters
 from rest_framework.compat import parse_date
+from rest_framework.exceptions import ParseError
 from rest_framework.reverse import reverse
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.mixins import ConditionalGetMixin, KeysetPaginationMixin, StreamingRenderMixin, \
+    is_not_modified, set_validators
 from territori.models import OpLocation
+from .export import PoliticiansExporter
+from .intervals import Bounds, ChargeList, intervals
 from .models import OpUser, OpPolitician, OpInstitution, OpChargeType, OpInstitutionCharge
 from .serializers import UserSerializer, PoliticianSerializer, PoliticianExportSerializer, \
-        OpInstitutionChargeSerializer, PoliticianInlineSerializer
+        OpInstitutionChargeSerializer, PoliticianInlineSerializer, InstitutionFlatSerializer, ChargeTypeFlatSerializer
+from .watermarks import contents
 
 
-class PoliticiDBSelectMixin(object):
+class PoliticiDBSelectMixin(ConditionalGetMixin):
     """
     Defines a filter_queryset method,
     to be added before all views that extend GenericAPIView,
-    in order to select correct DB source
+    in order to select correct DB source;
+    responses are cached, and validated by conditional requests,
+    until the contents are updated (see ``api.mixins.ConditionalGetMixin``)
     """
     def filter_queryset(self, queryset):
         return queryset.using('politici')
 
+    def get_response_cache_namespace(self):
+        return 'politici'
+
+    def get_response_cache_watermark(self):
+        return contents.get('politici')
+
+    def get_cache_max_age(self):
+        return getattr(settings, 'POLITICI_MAX_AGE', 300)
+
 
 class DefaultsMixin(object):
     """Default settings for view authentication, permissions, viewsets,
@@ -62,6 +83,7 @@ class PoliticiView(APIView):
             ('institutions', reverse('politici:institution-list', request=request, format=format)),
             ('chargetypes', reverse('politici:chargetype-list', request=request, format=format)),
             ('institution charges', reverse('politici:instcharge-list', request=request, format=format)),
+            ('statistics', reverse('politici:statistics', request=request, format=format)),
         ])
         return Response(data)
 
@@ -76,27 +98,112 @@ class UserList(DefaultsMixin, PoliticiDBSelectMixin, generics.ListAPIView):
     paginate_by = 25
     max_paginate_by = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
 
+    # users are not contents
+    cache_responses = False
+
 class UserDetail(PoliticiDBSelectMixin, generics.RetrieveAPIView):
     """
     Represents a single politici user.
     """
     model = OpUser
     serializer_class = UserSerializer
+    cache_responses = False
+
+
+
+class PoliticianDetailsMixin(object):
+    """
+    Fetches the details of all the politicians in a page at once,
+    with a fixed number of queries, whatever the page size.
+
+    ``politician_details`` lists the details to attach,
+    ``charges_related`` the relations followed for each charge.
+    """
+    politician_details = ('education_levels', 'institution_charges', 'resources')
+    charges_related = ()
+
+    def paginate_queryset(self, queryset, page_size=None):
+        page = super(PoliticianDetailsMixin, self).paginate_queryset(queryset, page_size)
+        if page is not None and page_size is None:
+            page.object_list = OpPolitician.objects.db_manager('politici').attach_details(
+                page.object_list, self.politician_details, self.charges_related
+            )
+        return page
+
+
+class ChargePoliticianDetailsMixin(PoliticianDetailsMixin):
+    """
+    Fetches the details of the politicians of all the charges in a page
+    (or of a single charge) at once, as ``PoliticianDetailsMixin``
+    does for pages of politicians.
+    """
+    charges_related = (
+        'institution', 'charge_type', 'location', 'constituency', 'party', 'group',
+    )
+
+    def attach_politician_details(self, charges):
+        charges = list(charges)
+        OpPolitician.objects.db_manager('politici').attach_details(
+            [charge.politician for charge in charges], self.politician_details, self.charges_related
+        )
+        return charges
+
+    def paginate_queryset(self, queryset, page_size=None):
+        page = super(PoliticianDetailsMixin, self).paginate_queryset(queryset, page_size)
+        if page is not None and page_size is None:
+            page.object_list = self.attach_politician_details(page.object_list)
+        return page
 
+    def get_serializer(self, instance=None, *args, **kwargs):
+        # keyset pages are lists, details are single charges
+        if isinstance(instance, list):
+            instance = self.attach_politician_details(instance)
+        elif isinstance(instance, OpInstitutionCharge):
+            self.attach_politician_details([instance])
+        return super(ChargePoliticianDetailsMixin, self).get_serializer(instance, *args, **kwargs)
 
 
-class PoliticiansExport(DefaultsMixin, PoliticiDBSelectMixin, generics.ListAPIView):
+class PoliticiansExport(StreamingRenderMixin, PoliticianDetailsMixin, DefaultsMixin, PoliticiDBSelectMixin,
+                        generics.ListAPIView):
     """
     Represents the list of politicians, with all details, neede for export purposes.
 
     It should not be used as a public view, but only with internal requests,
     in order to produce json files.
+
+    Accepts these filters through the following **GET** querystring parameters:
+
+    * ``regional_id``   - politicians with charges in the given region (istat id)
+    * ``provincial_id`` - politicians with charges in the given province (istat id)
+    * ``stream``        - ndjson|csv, stream the whole list in the given format,
+                          instead of paginating it
+
+    The same export can be produced with the ``politici_export``
+    management command.
     """
     model = OpPolitician
-    queryset = model.objects.select_related('content')
+    queryset = model.objects.select_related('content', 'profession')
     serializer_class = PoliticianExportSerializer
     paginate_by = 25
     max_paginate_by = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
+    politician_details = ('education_levels', 'institution_charges')
+    charges_related = PoliticiansExporter.charges_related
+
+    def list(self, request, *args, **kwargs):
+        stream_format = request.QUERY_PARAMS.get('stream', None)
+        if not stream_format:
+            return super(PoliticiansExport, self).list(request, *args, **kwargs)
+
+        if stream_format not in PoliticiansExporter.formats:
+            raise ParseError("stream must be one of: {0}".format(
+                ', '.join(PoliticiansExporter.formats.keys())
+            ))
+        exporter = PoliticiansExporter(self.filter_queryset(self.get_queryset()))
+        return StreamingHttpResponse(
+            exporter.stream(stream_format),
+            content_type=PoliticiansExporter.formats[stream_format]
+        )
+
 
     def get_queryset(self):
         """
@@ -121,7 +228,8 @@ class PoliticiansExport(DefaultsMixin, PoliticiDBSelectMixin, generics.ListAPIVi
         return queryset
 
 
-class PoliticianList(DefaultsMixin, PoliticiDBSelectMixin, generics.ListAPIView):
+class PoliticianList(StreamingRenderMixin, PoliticianDetailsMixin, DefaultsMixin, PoliticiDBSelectMixin,
+                     generics.ListAPIView):
     """
     Represents the list of politicians
 
@@ -152,10 +260,13 @@ class PoliticianList(DefaultsMixin, PoliticiDBSelectMixin, generics.ListAPIView)
         600
     """
     model = OpPolitician
-    queryset = model.objects.select_related('content')
+    queryset = model.objects.select_related('content', 'profession')
     serializer_class = PoliticianInlineSerializer
     paginate_by = 25
     max_paginate_by = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
+    charges_related = (
+        'institution', 'charge_type', 'location', 'constituency', 'party', 'group',
+    )
 
     def get_queryset(self):
         """
@@ -200,12 +311,22 @@ class PoliticianDetail(PoliticiDBSelectMixin, generics.RetrieveAPIView):
     model = OpPolitician
     serializer_class = PoliticianSerializer
 
+    def get_object(self, queryset=None):
+        # details and charges are fetched with a fixed number of queries,
+        # whatever the number of charges of the politician
+        politician = super(PoliticianDetail, self).get_object(queryset)
+        OpPolitician.objects.db_manager('politici').attach_details(
+            [politician], PoliticianDetailsMixin.politician_details, ChargePoliticianDetailsMixin.charges_related
+        )
+        return politician
+
 
 class InstitutionList(PoliticiDBSelectMixin, generics.ListAPIView):
     """
     Represents the list of institutions
     """
     model = OpInstitution
+    serializer_class = InstitutionFlatSerializer
     paginate_by = 25
     max_paginate_by = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
 
@@ -221,6 +342,7 @@ class ChargeTypeList(PoliticiDBSelectMixin, generics.ListAPIView):
     Represents the list of charge types
     """
     model = OpChargeType
+    serializer_class = ChargeTypeFlatSerializer
     paginate_by = 25
     max_paginate_by = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
 
@@ -232,6 +354,9 @@ class ChargeTypeDetail(PoliticiDBSelectMixin, generics.RetrieveAPIView):
 
 
 class InstitutionChargeList(
+    StreamingRenderMixin,
+    KeysetPaginationMixin,
+    ChargePoliticianDetailsMixin,
     DefaultsMixin,
     PoliticiDBSelectMixin,
     generics.ListAPIView
@@ -264,6 +389,12 @@ class InstitutionChargeList(
 
     Results have a standard pagination, with 25 results per page.
 
+    Adding the ``cursor`` parameter (initially empty) switches to keyset
+    pagination: results are sorted by ``date_start`` (or by the update
+    timestamp, when ``updated_after`` is used), no ``count`` is given,
+    and the ``next`` and ``previous`` urls carry opaque cursors.
+    This is the fastest way to walk the whole list.
+
     To get JSON format, specify ``format=json`` as a **GET** parameter,
     or add ``.json`` to the URL.
 
@@ -273,6 +404,10 @@ class InstitutionChargeList(
         >> res = r.json()
         >> print res['count']
         1539
+
+        >> r = requests.get('http://api.openpolis.it/politici/instcharges.json?updated_after=2014-01-01T00:00:00Z&cursor=')
+        >> res = r.json()
+        >> r = requests.get(res['next'])
     """
     model = OpInstitutionCharge
     serializer_class = OpInstitutionChargeSerializer
@@ -287,6 +422,14 @@ class InstitutionChargeList(
                        'content', 'content__content').\
         exclude(content__deleted_at__isnull=False)
 
+    def get_cursor_key(self):
+        """
+        Keyset pagination sorts on the update timestamp when syncing
+        (``updated_after``), on ``date_start`` otherwise.
+        """
+        if self.request.QUERY_PARAMS.get('updated_after', None):
+            return 'content__content__updated_at', False
+        return 'date_start', self.request.QUERY_PARAMS.get('order_by', None) == 'date'
 
     def get_queryset(self):
         """
@@ -295,6 +438,14 @@ class InstitutionChargeList(
 
         queryset = super(InstitutionChargeList, self).get_queryset()
 
+        # charges filtered by dates are selected in the interval index,
+        # unless they are synced by update timestamp, or walked with a cursor
+        if not self.request.QUERY_PARAMS.get('updated_after', None) and \
+                self.cursor_query_param not in self.request.QUERY_PARAMS:
+            bounds = self.get_date_bounds()
+            if bounds:
+                return self.get_indexed_charges(queryset, bounds)
+
         # date filters
         # date format is YYYY-MM-DD
 
@@ -393,15 +544,111 @@ class InstitutionChargeList(
 
         return queryset
 
-class InstitutionChargeDetail(PoliticiDBSelectMixin, generics.RetrieveAPIView):
+    def get_date_bounds(self):
+        """
+        Return the bounds of the date and status filters
+        (see ``politici.intervals.Bounds``), empty for wrong dates.
+        """
+        params = self.request.QUERY_PARAMS
+        bounds = Bounds()
+        charge_status = params.get('status', 'n').lower()[:1]
+        if charge_status == 'a':
+            bounds.narrow(current=True)
+        elif charge_status == 'i':
+            bounds.narrow(current=False)
+
+        for name in ('started_after', 'closed_after', 'date_from', 'date_to', 'date'):
+            value = params.get(name, None)
+            if not value:
+                continue
+            value = parse_date(value)
+            if not value or value > date.today():
+                bounds.empty = True
+            elif name == 'started_after':
+                bounds.narrow(start_min=value)
+            elif name == 'closed_after':
+                bounds.narrow(end_min=value, current=False)
+            elif name == 'date_from':
+                bounds.narrow(start_min=value, start_max=value)
+            elif name == 'date_to':
+                bounds.narrow(end_min=value, end_max=value)
+            else:
+                bounds.narrow(start_max=value - timedelta(days=1), end_min=value + timedelta(days=1))
+        return bounds
+
+    def get_indexed_charges(self, queryset, bounds):
+        """
+        Return the charges within the bounds, and the other filters,
+        selected in the interval index, sorted by id,
+        or by descending ``date_start`` (``order_by=date``).
+        """
+        params = self.request.QUERY_PARAMS
+
+        def ids(name, separator=None):
+            value = params.get(name, None)
+            if not value:
+                return None
+            return [int(i) for i in (value.split(separator) if separator else [value])]
+
+        # as in get_queryset, only charge types can be more, separated by commas
+        charges = intervals.get('politici').find(
+            bounds, location_ids=ids('location_id'), institution_ids=ids('institution_id'),
+            charge_type_ids=ids('charge_type_id', ',')
+        )
+        if params.get('order_by', None) == 'date':
+            charges.sort(key=lambda c: (-c[0], c[2]))
+        else:
+            charges.sort(key=lambda c: c[2])
+        return ChargeList(queryset, [c[2] for c in charges])
+
+class InstitutionChargeDetail(ChargePoliticianDetailsMixin, PoliticiDBSelectMixin, generics.RetrieveAPIView):
     """
     Represents the details of an institution charge
     """
     model = OpInstitutionCharge
-    queryset = model.objects.select_related('content')
+    queryset = model.objects.select_related('institution', 'charge_type', 'location',
+                                            'politician', 'politician__profession', 'politician__content',
+                                            'party', 'group',
+                                            'constituency', 'constituency__election_type',
+                                            'content', 'content__content')
     serializer_class = OpInstitutionChargeSerializer
 
 
+class StatisticsView(APIView):
+    """
+    Statistics on current institution charges: total number,
+    and breakdowns by age, sex, institution, profession and education level.
+
+    Accepts these filters through the following **GET** querystring parameters:
+
+    * ``location_type`` - all|regional|provincial|city
+    * ``location_id``   - istat id of the location (with a regional, provincial or city ``location_type``)
+    * ``age``           - twenties|thirties|forties|fifties|sixties|seventies|eighties|nineties|venerables
+    * ``sex``           - M|F
+    * ``institution``   - giunta_regionale|consiglio_regionale|giunta_provinciale|consiglio_provinciale|
+                          giunta_comunale|consiglio_comunale|commissariamento
+    * ``profession_id`` - id of a normalized profession
+    * ``education_id``  - id of a normalized education level
+
+    Breakdowns are not returned for the filtered dimensions.
+
+    Example usage::
+
+        Women in the city councils of Lazio
+        >> r = requests.get('http://api.openpolis.it/politici/statistics?location_type=regional&location_id=12&sex=F&institution=consiglio_comunale')
+        >> res = r.json()
+        >> print res['results']['total']
+
+    """
+    def get(self, request, **kwargs):
+        try:
+            data = OpInstitutionCharge.objects.get_statistics(request)
+        except (ValueError, OpLocation.DoesNotExist), e:
+            raise ParseError(unicode(e))
+
+        return Response(data)
+
+
 class HistoricalCityMayorsView(APIView):
     """
     List all top charges for a given city, during the years
@@ -433,35 +680,69 @@ class HistoricalCityMayorsView(APIView):
     def get(self, request, **kwargs):
         location_id = kwargs['location_id']
         try:
-            data = self.get_city_mayors_data(location_id)
-        except Exception, e:
-            data = { 'error': e }
-
-        return Response(data)
+            location = self.get_location(location_id)
+        except Exception, detail:
+            return Response({
+                'exception': 'Error retrieving location with location_id: %s. %s' % (location_id, detail)
+            })
+
+        # charges are read from the interval index, that may be refreshed
+        # after the last charge update of the location is seen
+        index = intervals.get('politici')
+        cache_key = self.get_cache_key(location, index)
+
+        # conditional requests are validated by the last charge update
+        # of the location, and by the last update of the index
+        etag = last_modified = None
+        if location.last_charge_update:
+            etag = hashlib.sha1('{0}:{1}'.format(cache_key, request.accepted_renderer.format)).hexdigest()
+            last_modified = time.mktime(max(location.last_charge_update, index.last_update).timetuple())
+            if is_not_modified(request, etag, last_modified):
+                return set_validators(HttpResponseNotModified(), etag, last_modified)
+
+        data = cache.get(cache_key)
+        if data is None:
+            try:
+                data = self.get_city_mayors_data(location, index)
+                cache.set(cache_key, data, getattr(settings, 'CITY_MAYORS_CACHE_TTL', 86400))
+            except Exception, e:
+                data = { 'error': e }
+
+        return set_validators(Response(data), etag, last_modified, getattr(settings, 'POLITICI_MAX_AGE', 300))
 
     def get_location(self, city_id):
         """
         Return the Location object, given the location_id
         """
-        location = OpLocation.objects.using('politici').get(id=city_id)
+        location = OpLocation.objects.using('politici').select_related('location_type').get(id=city_id)
         if location.location_type.name.lower() != 'comune':
             raise  Exception('location is not a city. only cities are accepted')
         return location
 
-    def get_city_mayors_data(self, city_id):
+    def get_cache_key(self, location, index):
+        """
+        Results are cached by location and date filters;
+        the last charge update of the location and the last update
+        of the interval index are part of the key, so that results
+        are invalidated when charges are updated, and read again
+        when the index sees the update.
+        """
+        return 'politici:city_mayors:{0}:{1}:{2}:{3}:{4}:{5}'.format(
+            location.id,
+            location.last_charge_update and location.last_charge_update.isoformat(),
+            index.last_update and index.last_update.isoformat(),
+            *[self.request.QUERY_PARAMS.get(p, '') for p in ('date_from', 'date_to', 'date')]
+        )
+
+    def get_city_mayors_data(self, location, index):
         """get all top charges for a given city during the years"""
         data = {}
-        try:
-            location = self.get_location(city_id)
-            data['location'] = "%s (%s)" % (location.name, location.prov)
-        except Exception, detail:
-            return { 'exception': 'Error retrieving location with location_id: %s. %s' % (city_id, detail) }
+        data['location'] = "%s (%s)" % (location.name, location.prov)
 
-        ics = OpInstitutionCharge.objects.db_manager('politici').exclude(content__deleted_at__isnull=False).filter(
-            Q(location__id=location.id),
-            Q(charge_type__name='Sindaco') | Q(charge_type__name='Commissario straordinario') |
-            Q(charge_type__name='Vicesindaco facente funzione sindaco'),
-        ).order_by('-date_start')
+        # charges are selected in the interval index; charge types, parties
+        # and politicians are fetched in the same query, normalized parties
+        # are looked up in the in-process registry
+        bounds = Bounds()
 
         # fetch all charges started exactly on a given date
         date_from = self.request.QUERY_PARAMS.get('date_from', None)
@@ -470,13 +751,15 @@ class HistoricalCityMayorsView(APIView):
             if not date_from or date_from > date.today():
                 # TODO: raise an Exception
                 return {'sindaci': []}
-            ics = ics.filter(Q(date_end__isnull=True) | Q(date_end__gt=date_from))
+            bounds.narrow(end_min=date_from + timedelta(days=1))
 
         # fetch all charges ended exactly on a given date
         date_to = self.request.QUERY_PARAMS.get('date_to', None)
         if date_to:
             date_to = parse_date(date_to)
-            ics = ics.filter(date_start__lte=date_to)
+            if not date_to:
+                return {'sindaci': []}
+            bounds.narrow(start_max=date_to)
 
         # fetch all charges active on a given date
         given_date = self.request.QUERY_PARAMS.get('date', None)
@@ -485,51 +768,39 @@ class HistoricalCityMayorsView(APIView):
             if not given_date or given_date > date.today():
                 # TODO: raise an Exception
                 return {'sindaci': []}
-            ics = ics.filter(
-                date_start__lte=given_date,
-            ).filter(Q(date_end__isnull=True) | Q(date_end__gte=given_date))
+            bounds.narrow(start_max=given_date, end_min=given_date)
 
+        charge_types = OpChargeType.objects.db_manager('politici').filter(
+            name__in=('Sindaco', 'Commissario straordinario', 'Vicesindaco facente funzione sindaco'),
+        ).values_list('id', flat=True)
+        charges = index.find(bounds, location_ids=[location.id], charge_type_ids=charge_types)
+        ics = OpInstitutionCharge.objects.db_manager('politici').filter(
+            pk__in=[c[2] for c in charges],
+        ).select_related('charge_type', 'party', 'politician').order_by('-date_start')
 
         data['sindaci'] = []
         for ic in ics:
-            charge_id = ic.content_id
-            if ic.charge_type.name == 'Sindaco':
-                c = {
-                    'charge_type': 'Sindaco',
-                    'date_start': ic.date_start,
-                    'date_end': ic.date_end,
-                    'party_acronym': ic.party.getNormalizedAcronymOrName(),
-                    'party_name': ic.party.getName(),
-                    'first_name': ic.politician.first_name,
-                    'last_name': ic.politician.last_name,
-                    'birth_date': ic.politician.birth_date,
-                    'picture_url': 'http://politici.openpolis.it/politician/picture?content_id=%s' % ic.politician.content_id,
-                    'op_link': 'http://politici.openpolis.it/politico/%s' % ic.politician.content_id
-                }
-            elif (ic.charge_type.name == 'Vicesindaco facente funzione sindaco'):
-                c = {
-                    'charge_type': 'Vicesindaco f.f.',
-                    'date_start': ic.date_start,
-                    'date_end': ic.date_end,
+            politician = ic.politician
+            c = {
+                'date_start': ic.date_start,
+                'date_end': ic.date_end,
+                'first_name': politician.first_name,
+                'last_name': politician.last_name,
+                'birth_date': politician.birth_date,
+                'op_link': 'http://politici.openpolis.it/politico/%s' % politician.content_id
+            }
+            if ic.charge_type.name in ('Sindaco', 'Vicesindaco facente funzione sindaco'):
+                c.update({
+                    'charge_type': 'Sindaco' if ic.charge_type.name == 'Sindaco' else 'Vicesindaco f.f.',
                     'party_acronym': ic.party.getNormalizedAcronymOrName(),
                     'party_name': ic.party.getName(),
-                    'first_name': ic.politician.first_name,
-                    'last_name': ic.politician.last_name,
-                    'birth_date': ic.politician.birth_date,
-                    'picture_url': 'http://politici.openpolis.it/politician/picture?content_id=%s' % ic.politician.content_id,
-                    'op_link': 'http://politici.openpolis.it/politico/%s' % ic.politician.content_id
-                }
+                    'picture_url': 'http://politici.openpolis.it/politician/picture?content_id=%s' % politician.content_id,
+                })
             else:
-                c = {
+                c.update({
                     'charge_type': 'Commissario',
-                    'date_start': ic.date_start,
-                    'date_end': ic.date_end,
-                    'first_name': ic.politician.first_name,
-                    'last_name': ic.politician.last_name,
-                    'birth_date': ic.politician.birth_date,
                     'description': ic.description,
-                    'op_link': 'http://politici.openpolis.it/politico/%s' % ic.politician.content_id
-                }
+                })
 
             data['sindaci'].append(c)
 
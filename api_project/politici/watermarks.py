@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Watermark of the politici data: every politician, charge and
+resource is an ``op_content``, and its ``updated_at`` is moved
+whenever it changes, so the latest ``updated_at`` changes
+when (and only when) the data changes.
+"""
+from django.conf import settings
+from django.db.models import Max
+
+from api.watermarks import Watermark
+from politici.models import OpContent
+
+__author__ = 'guglielmo'
+
+
+class ContentWatermark(Watermark):
+    """
+    Latest ``op_content.updated_at``, kept for
+    ``POLITICI_LAST_UPDATE_TTL`` seconds (60 by default).
+    """
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'POLITICI_LAST_UPDATE_TTL', 60)
+
+    def query(self, db_alias):
+        return OpContent.objects.using(db_alias).aggregate(last_update=Max('updated_at'))['last_update']
+
+
+contents = ContentWatermark()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory gazetteer of the italian territorial hierarchy:
+regions, provinces and cities in the ``op_location`` table.
+
+The whole hierarchy (about 8,000 rows) is read with a single query
+into an immutable snapshot: rows are kept as tuples, in a tuple,
+and dictionaries index them by op id, istat ids, minint codes and
+province acronyms, so that parent, children and code lookups
+need no DB round trip.
+
+Snapshots are shared by all threads of a process. The number
+of rows and the last ``last_charge_update`` of the table
+(the ``locations`` watermark) are read every
+``GAZETTEER_CHECK_INTERVAL`` seconds (5 minutes by default),
+and the snapshot is rebuilt only when they changed.
+"""
+from collections import defaultdict
+import threading
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.datastructures import SortedDict
+
+from api.watermarks import Watermark
+
+__author__ = 'guglielmo'
+
+
+REGION_TYPE_ID = 4
+PROVINCE_TYPE_ID = 5
+CITY_TYPE_ID = 6
+
+
+def split_minint_id(minint_id):
+    """
+    Unpack a minint id, as in ``OpLocation.minint_id``,
+    into its regional (2), provincial (3) and city (4 chars) codes.
+    """
+    minint_id = str(minint_id)
+    if len(minint_id) != 9:
+        raise ValueError('minint_id code must be exactly 9 characters long: %s is %s char-long' % (minint_id, len(minint_id),))
+    return int(minint_id[:2]), int(minint_id[2:5]), int(minint_id[5:])
+
+
+class Gazetteer(object):
+    """
+    Immutable snapshot of the regions, provinces and cities.
+
+    Lookups return new ``OpLocation`` instances, built from the rows,
+    and raise ``OpLocation.DoesNotExist`` when no location matches.
+    """
+
+    def __init__(self, model, rows, using, watermark=None):
+        self.model = model
+        self.using = using
+        self.watermark = watermark
+        self.fields = tuple(f.attname for f in model._meta.concrete_fields)
+        self.rows = tuple(rows)
+
+        self.columns = dict((name, n) for n, name in enumerate(self.fields))
+        c_id, c_type, c_end = self.columns['id'], self.columns['location_type_id'], self.columns['date_end']
+        c_reg, c_prov, c_city = self.columns['regional_id'], self.columns['provincial_id'], self.columns['city_id']
+        c_acr = self.columns['prov']
+        c_m_reg, c_m_prov, c_m_city = (
+            self.columns['minint_regional_code'],
+            self.columns['minint_provincial_code'],
+            self.columns['minint_city_code']
+        )
+
+        self.ids = {}
+        self.regions = {}
+        self.provinces = {}
+        self.cities = {}
+        self.minint_codes = {}
+        self.acronyms = {}
+        for n, row in enumerate(self.rows):
+            self.ids[row[c_id]] = n
+            if row[c_type] == REGION_TYPE_ID:
+                self._index(self.regions, row[c_reg], n, c_end)
+            elif row[c_type] == PROVINCE_TYPE_ID:
+                self._index(self.provinces, row[c_prov], n, c_end)
+                self._index(self.acronyms, row[c_acr] and row[c_acr].upper(), n, c_end)
+            elif row[c_type] == CITY_TYPE_ID:
+                self._index(self.cities, row[c_city], n, c_end)
+                if row[c_m_reg] is not None:
+                    self._index(self.minint_codes, (row[c_m_reg], row[c_m_prov], row[c_m_city]), n, c_end)
+
+        # children of regions and provinces, by op id
+        children = defaultdict(list)
+        for n, row in enumerate(self.rows):
+            if row[c_type] == PROVINCE_TYPE_ID and row[c_reg] in self.regions:
+                children[self.rows[self.regions[row[c_reg]]][c_id]].append(n)
+            elif row[c_type] == CITY_TYPE_ID and row[c_prov] in self.provinces:
+                children[self.rows[self.provinces[row[c_prov]]][c_id]].append(n)
+        self._children = dict((k, tuple(v)) for k, v in children.items())
+        self._hierarchies = {}
+        self._geo_index = None
+
+    def _index(self, index, key, n, c_end):
+        """
+        Add the n-th row to the index;
+        on duplicate keys, current locations (with no date_end) win.
+        """
+        if key is None:
+            return
+        m = index.get(key)
+        if m is None or (self.rows[m][c_end] is not None and self.rows[n][c_end] is None):
+            index[key] = n
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def geo_index(self):
+        """
+        Spatial index of the cities (see ``territori.geo``),
+        built at first access.
+        """
+        if self._geo_index is None:
+            from .geo import GeoIndex
+            self._geo_index = GeoIndex(self)
+        return self._geo_index
+
+    def value(self, n, field):
+        """Return the value of a field of the n-th row"""
+        return self.rows[n][self.columns[field]]
+
+    def location(self, n):
+        """Return the n-th row as an OpLocation instance"""
+        obj = self.model(*self.rows[n])
+        obj._state.db = self.using
+        obj._state.adding = False
+        return obj
+
+    def _lookup(self, index, key, description):
+        try:
+            return self.location(index[key])
+        except KeyError:
+            raise self.model.DoesNotExist(
+                "OpLocation matching %s %s does not exist." % (description, key)
+            )
+
+    def get(self, id, location_type_id=None):
+        """Return the location with the given op id (and type, if given)"""
+        location = self._lookup(self.ids, int(id), 'id')
+        if location_type_id is not None and location.location_type_id != location_type_id:
+            raise self.model.DoesNotExist(
+                "OpLocation matching id %s and location_type_id %s does not exist." % (id, location_type_id)
+            )
+        return location
+
+    def region(self, regional_id):
+        """Return the region with the given istat code"""
+        return self._lookup(self.regions, int(regional_id), 'regional_id')
+
+    def province(self, provincial_id):
+        """Return the province with the given istat code"""
+        return self._lookup(self.provinces, int(provincial_id), 'provincial_id')
+
+    def province_from_acronym(self, prov):
+        """Return the province with the given acronym (RM, MI, ...)"""
+        return self._lookup(self.acronyms, prov.upper(), 'prov')
+
+    def city(self, city_id):
+        """Return the city with the given istat code"""
+        return self._lookup(self.cities, int(city_id), 'city_id')
+
+    def city_from_minint_codes(self, regional_code, provincial_code, city_code):
+        """Return the city with the given minint codes"""
+        return self._lookup(
+            self.minint_codes, (int(regional_code), int(provincial_code), int(city_code)), 'minint codes'
+        )
+
+    def city_from_minint_id(self, minint_id):
+        """Return the city with the given minint id (see ``split_minint_id``)"""
+        return self._lookup(self.minint_codes, split_minint_id(minint_id), 'minint_id')
+
+    # code schemes accepted by ``index_of``
+    schemes = ('id', 'regional_id', 'provincial_id', 'city_id', 'minint_id', 'prov')
+
+    def index_of(self, scheme, code):
+        """
+        Return the position of the row of the location
+        identified by the code in the given scheme, or None.
+
+        A ValueError is raised for unknown schemes or malformed codes.
+        """
+        if scheme == 'id':
+            return self.ids.get(int(code))
+        if scheme == 'regional_id':
+            return self.regions.get(int(code))
+        if scheme == 'provincial_id':
+            return self.provinces.get(int(code))
+        if scheme == 'city_id':
+            return self.cities.get(int(code))
+        if scheme == 'minint_id':
+            return self.minint_codes.get(split_minint_id(code))
+        if scheme == 'prov':
+            return self.acronyms.get(code.upper())
+        raise ValueError("'%s' is not a valid code scheme" % scheme)
+
+    def hierarchy(self, n):
+        """
+        Return a dictionary with the codes of the n-th location
+        and the op ids and names of its province and region.
+
+        Dictionaries are built once and shared: they must not be modified.
+        """
+        try:
+            return self._hierarchies[n]
+        except KeyError:
+            pass
+
+        row = self.rows[n]
+        c = self.columns
+        data = SortedDict([
+            ('id', row[c['id']]),
+            ('name', row[c['name']]),
+            ('location_type_id', row[c['location_type_id']]),
+            ('regional_id', row[c['regional_id']]),
+            ('provincial_id', row[c['provincial_id']]),
+            ('city_id', row[c['city_id']]),
+            ('prov', row[c['prov']]),
+            ('province', None),
+            ('region', None),
+        ])
+        if row[c['location_type_id']] == CITY_TYPE_ID:
+            p = self.provinces.get(row[c['provincial_id']])
+            if p is not None:
+                data['province'] = {'id': self.rows[p][c['id']], 'name': self.rows[p][c['name']]}
+        if row[c['location_type_id']] in (CITY_TYPE_ID, PROVINCE_TYPE_ID):
+            r = self.regions.get(row[c['regional_id']])
+            if r is not None:
+                data['region'] = {'id': self.rows[r][c['id']], 'name': self.rows[r][c['name']]}
+        self._hierarchies[n] = data
+        return data
+
+    def parent(self, location):
+        """Return the province of a city, or the region of a province"""
+        if location.location_type_id == CITY_TYPE_ID:
+            return self.province(location.provincial_id)
+        if location.location_type_id == PROVINCE_TYPE_ID:
+            return self.region(location.regional_id)
+        raise Exception("Only cities and provinces have a parent location")
+
+    def children(self, location):
+        """Return the provinces of a region, or the cities of a province"""
+        return [self.location(n) for n in self._children.get(location.id, ())]
+
+
+_lock = threading.Lock()
+_gazetteers = {}
+
+
+def get_watermark(using):
+    from territori.models import OpLocation
+
+    watermark = OpLocation.objects.using(using).aggregate(n=Count('id'), last=Max('last_charge_update'))
+    return watermark['n'], watermark['last']
+
+
+class LocationWatermark(Watermark):
+    """
+    The watermark of the ``op_location`` table, read
+    every ``GAZETTEER_CHECK_INTERVAL`` seconds at most.
+    """
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'GAZETTEER_CHECK_INTERVAL', 300)
+
+    def query(self, db_alias):
+        return get_watermark(db_alias)
+
+
+locations = LocationWatermark()
+
+
+def load(using, watermark=None):
+    """Read the regions, provinces and cities into a new gazetteer"""
+    from territori.models import OpLocation
+
+    fields = [f.attname for f in OpLocation._meta.concrete_fields]
+    rows = OpLocation.objects.using(using).filter(
+        location_type_id__in=(REGION_TYPE_ID, PROVINCE_TYPE_ID, CITY_TYPE_ID)
+    ).order_by('id').values_list(*fields)
+    return Gazetteer(OpLocation, rows, using, watermark)
+
+
+def get_gazetteer(using):
+    """
+    Return the gazetteer for the given DB alias,
+    loading it, or reloading it if the watermark changed.
+    """
+    gazetteer = _gazetteers.get(using)
+    if gazetteer is None or locations.has_changed(using, gazetteer.watermark):
+        with _lock:
+            gazetteer = _gazetteers.get(using)
+            if gazetteer is None or locations.has_changed(using, gazetteer.watermark):
+                gazetteer = load(using, locations.get(using))
+                _gazetteers[using] = gazetteer
+    return gazetteer
+
+
+def invalidate(using=None):
+    """Drop the gazetteer of an alias (of all aliases, if None)"""
+    with _lock:
+        for alias in ([using] if using else _gazetteers.keys()):
+            _gazetteers.pop(alias, None)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory spatial index of the cities in the gazetteer,
+built from the ``gps_lat``/``gps_lon`` columns of ``op_location``.
+
+Coordinates are mapped on the unit sphere, and stored in a k-d tree,
+where the euclidean (chord) distance grows with the great-circle distance,
+so that k-nearest and radius queries are exact, with no projection;
+bounding box queries scan the locations sorted by latitude,
+in the latitude range of the box, found by bisection.
+
+Only current cities (with no ``date_end``) are indexed.
+"""
+from bisect import bisect_left, bisect_right
+import heapq
+import math
+
+from .gazetteer import CITY_TYPE_ID
+
+__author__ = 'guglielmo'
+
+
+EARTH_RADIUS = 6371.0088  # km
+
+
+def to_xyz(lat, lon):
+    """Return the point on the unit sphere for the given coordinates"""
+    lat, lon = math.radians(lat), math.radians(lon)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km / (2 * EARTH_RADIUS), math.pi / 2))
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance, in km (haversine formula)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(a), 1.0))
+
+
+class KDTree(object):
+    """
+    Static 3-d tree; nodes are (point index, axis, left, right) tuples.
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.root = self._build(range(len(points)), 0)
+
+    def _build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda i: self.points[i][axis])
+        m = len(indexes) // 2
+        return (
+            indexes[m], axis,
+            self._build(indexes[:m], depth + 1),
+            self._build(indexes[m + 1:], depth + 1)
+        )
+
+    def nearest(self, point, k=None, max_chord=None):
+        """
+        Return the (chord, index) pairs of the k points nearest to point
+        (of all points, if k is None), within max_chord, if given,
+        sorted by distance.
+        """
+        k = k if k is not None else len(self.points)
+        bound = max_chord * max_chord if max_chord is not None else float('inf')
+        heap = []
+
+        def visit(node):
+            if node is None:
+                return
+            i, axis, left, right = node
+            p = self.points[i]
+            d2 = (point[0] - p[0]) ** 2 + (point[1] - p[1]) ** 2 + (point[2] - p[2]) ** 2
+            if d2 <= bound:
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, i))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, i))
+
+            diff = point[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            # the far side may only contain nearer points
+            # if the splitting plane is nearer than the current worst
+            worst = -heap[0][0] if len(heap) == k else bound
+            if diff * diff <= worst:
+                visit(far)
+
+        visit(self.root)
+        return sorted((math.sqrt(-d2), i) for d2, i in heap)
+
+
+class GeoIndex(object):
+    """
+    Spatial index of the current cities of a gazetteer.
+    """
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+
+        positions = []
+        for n in range(len(gazetteer)):
+            if gazetteer.value(n, 'location_type_id') != CITY_TYPE_ID or \
+               gazetteer.value(n, 'date_end') is not None:
+                continue
+            lat, lon = gazetteer.value(n, 'gps_lat'), gazetteer.value(n, 'gps_lon')
+            if lat is None or lon is None:
+                continue
+            positions.append((lat, lon, n))
+
+        # rows sorted by latitude, for bounding boxes
+        positions.sort()
+        self.positions = positions
+        self.latitudes = [p[0] for p in positions]
+
+        self.tree = KDTree([to_xyz(lat, lon) for lat, lon, n in positions])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nearest(self, lat, lon, k=10, radius=None):
+        """
+        Return the (distance in km, gazetteer row) pairs
+        of the k cities nearest to the given point,
+        within radius km, if given.
+        """
+        max_chord = km_to_chord(radius) if radius is not None else None
+        return [
+            (chord_to_km(chord), self.positions[i][2])
+            for chord, i in self.tree.nearest(to_xyz(lat, lon), k, max_chord)
+        ]
+
+    def within(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Return the gazetteer rows of the cities in the bounding box.
+        """
+        start = bisect_left(self.latitudes, min_lat)
+        end = bisect_right(self.latitudes, max_lat)
+        return [
+            n for lat, lon, n in self.positions[start:end]
+            if min_lon <= lon <= max_lon
+        ]
+
+    def scan_nearest(self, lat, lon, k=10, radius=None):
+        """
+        Same as ``nearest``, computing all distances;
+        used as a reference in tests and benchmarks.
+        """
+        distances = sorted(
+            (distance(lat, lon, p_lat, p_lon), n) for p_lat, p_lon, n in self.positions
+        )
+        if radius is not None:
+            distances = [(d, n) for d, n in distances if d <= radius]
+        return distances[:k] if k is not None else distances
+
+    def scan_within(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Same as ``within``, checking all locations.
+        """
+        return [
+            n for lat, lon, n in self.positions
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+        ]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from territori.gazetteer import get_gazetteer
+
+__author__ = 'guglielmo'
+
+
+class Command(BaseCommand):
+    """
+    Nearest-cities and bounding box queries, at random points,
+    are answered by the spatial index of the gazetteer,
+    and by a full scan of all cities.
+
+    Average times per query are shown, and results of the
+    two methods are checked to be the same.
+    """
+    help = "Benchmark the spatial index of the cities against a full scan"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--queries',
+                    dest='queries',
+                    default=1000,
+                    help='Number of random queries of each kind'),
+        make_option('--k',
+                    dest='k',
+                    default=10,
+                    help='Number of nearest cities'),
+        make_option('--radius',
+                    dest='radius',
+                    default=None,
+                    help='Max distance of nearest cities, in km'),
+        make_option('--bbox-size',
+                    dest='bbox_size',
+                    default=0.5,
+                    help='Side of the bounding boxes, in degrees'),
+        make_option('--seed',
+                    dest='seed',
+                    default=1,
+                    help='Seed of the random points'),
+    )
+
+    def handle(self, *args, **options):
+        n_queries = int(options['queries'])
+        k = int(options['k'])
+        radius = float(options['radius']) if options['radius'] else None
+        size = float(options['bbox_size'])
+        random.seed(int(options['seed']))
+
+        t = time.time()
+        gazetteer = get_gazetteer('politici')
+        index = gazetteer.geo_index
+        self.stdout.write("Index of {0} cities built in {1:.3f}s".format(len(index), time.time() - t))
+        if not len(index):
+            raise CommandError("No cities with gps coordinates found")
+
+        lats = [p[0] for p in index.positions]
+        lons = [p[1] for p in index.positions]
+        points = [
+            (random.uniform(min(lats), max(lats)), random.uniform(min(lons), max(lons)))
+            for _ in range(n_queries)
+        ]
+        boxes = [(lat, lon, lat + size, lon + size) for lat, lon in points]
+
+        for name, indexed, scan, args_list, rows in (
+            ('nearest',
+             lambda *a: index.nearest(*a, k=k, radius=radius),
+             lambda *a: index.scan_nearest(*a, k=k, radius=radius),
+             points, lambda result: [n for d, n in result]),
+            ('bbox',
+             index.within,
+             index.scan_within,
+             boxes, lambda result: result),
+        ):
+            timings = {}
+            results = {}
+            for method, f in (('index', indexed), ('scan', scan)):
+                t = time.time()
+                results[method] = [f(*args) for args in args_list]
+                timings[method] = (time.time() - t) / n_queries * 1e6
+
+            mismatches = sum(
+                1 for a, b in zip(results['index'], results['scan']) if rows(a) != rows(b)
+            )
+            self.stdout.write(
+                "{0}: index {1:.1f}us/query, scan {2:.1f}us/query, speedup {3:.1f}x, {4} mismatches".format(
+                    name, timings['index'], timings['scan'], timings['scan'] / timings['index'], mismatches
+                )
+            )
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from django.db import models
 
+from .gazetteer import get_gazetteer
+
 # edit to load from other database
 DBNAME = 'politici'
 
@@ -16,15 +18,15 @@ class OpLocationType(models.Model):
 
 
 class OpLocationQuerySet(models.query.QuerySet):
+    """
+    Single regions, provinces and cities are looked up in the
+    in-memory gazetteer of the DB (see ``territori.gazetteer``),
+    with no DB round trip.
+    """
 
-    _cache = {}
-    def _location_query(self, method, key, key_field='pk'):
-        """ returns a get cached query"""
-        cache_key = "%s_by_%s_%s" % (method, key_field, key)
-        if cache_key not in OpLocationQuerySet._cache:
-            OpLocationQuerySet._cache[cache_key] = getattr(self, method)().get(**{key_field:key})
-        return OpLocationQuerySet._cache[cache_key]
-
+    @property
+    def gazetteer(self):
+        return get_gazetteer(self.db)
 
     def regioni(self):
         return self.filter(location_type_id=OpLocation.REGION_TYPE_ID)
@@ -41,15 +43,15 @@ class OpLocationQuerySet(models.query.QuerySet):
 
     def regione_from_location(self, comune_or_provincia):
         """return an Location object that contains provided location"""
-        return self._location_query('regioni', comune_or_provincia.regional_id, 'regional_id')
+        return self.gazetteer.region(comune_or_provincia.regional_id)
 
     def regione_from_id(self, id):
         """return an Location region object from primary key"""
-        return self._location_query('regioni', id)
+        return self.gazetteer.get(id, OpLocation.REGION_TYPE_ID)
 
     def regione_from_istat_id(self, id):
         """return an Location region object, from the istat regional_id"""
-        return self.regioni().get(regional_id = id )
+        return self.gazetteer.region(id)
 
     def province(self):
         return self.filter(location_type_id=OpLocation.PROVINCE_TYPE_ID)
@@ -65,26 +67,30 @@ class OpLocationQuerySet(models.query.QuerySet):
 
     def provincia_from_location(self, comune):
         """return an Location object that contains provided location"""
-        return self._location_query('province', comune.provincial_id, 'provincial_id')
+        return self.gazetteer.province(comune.provincial_id)
 
     def provincia_from_id(self, id):
         """return an Location province object from primary key"""
-        return self._location_query('province', id)
+        return self.gazetteer.get(id, OpLocation.PROVINCE_TYPE_ID)
 
     def provincia_from_istat_id(self, id):
         """return an Location object, from the istat provincial_id"""
-        return self._location_query('province', id, 'provincial_id')
+        return self.gazetteer.province(id)
+
+    def provincia_from_acronym(self, prov):
+        """return an Location object, from the province acronym (RM, MI, ...)"""
+        return self.gazetteer.province_from_acronym(prov)
 
     def comuni(self):
         return self.filter(location_type_id=OpLocation.CITY_TYPE_ID)
 
     def comune_from_id(self, id):
         """return an Location city object from primary key"""
-        return self._location_query('comuni', id)
+        return self.gazetteer.get(id, OpLocation.CITY_TYPE_ID)
 
     def comune_from_istat_id(self, id):
         """return an Location object, from the istat city_id"""
-        return self._location_query('comuni', id, 'city_id')
+        return self.gazetteer.city(id)
 
     def comune_from_minint_id(self, minint_id):
         """
@@ -93,15 +99,7 @@ class OpLocationQuerySet(models.query.QuerySet):
         the argument length is validated
         codes are unpacked from the argument
         """
-        if len(minint_id) != 9:
-            raise Exception('minint_id code must be exactly 9 characters long: %s is %s char-long' % (id, len(minint_id),))
-        regional_code = int(id[:2])
-        provincial_code = int(id[2:5])
-        city_code = int(id[5:])
-
-        return self.comuni().get(minint_regional_code=regional_code,
-                                 minint_provincial_code=provincial_code,
-                                 minint_city_code=city_code)
+        return self.gazetteer.city_from_minint_id(minint_id)
 
     def comune(self, id, codename='op'):
         try:
@@ -128,6 +126,7 @@ class OpLocationManager(models.Manager):
     def provincia(self, territorio, codename='op'): return self.get_queryset().provincia(territorio, codename)
     def provincia_from_id(self, id): return self.provincia(id, codename='op')
     def provincia_from_istat_id(self, id): return self.provincia(id, codename='istat')
+    def provincia_from_acronym(self, prov): return self.get_queryset().provincia_from_acronym(prov)
     def comuni(self): return self.get_queryset().comuni()
     def comune(self, territorio_id, codename='op'): return self.get_queryset().comune(territorio_id, codename=codename)
     def comune_from_id(self, id): return self.comune(id, codename='op')
@@ -139,7 +138,7 @@ class OpLocationManager(models.Manager):
             if location_type == OpLocation.CITY_TYPE_ID:
                 return self.comune(location_id, codename=codename)
             if location_type == OpLocation.PROVINCE_TYPE_ID:
-                return self.comune(location_id, codename=codename)
+                return self.provincia(location_id, codename=codename)
             if location_type == OpLocation.REGION_TYPE_ID:
                 return self.regione(location_id, codename=codename)
         else:
@@ -275,14 +274,17 @@ class OpLocation(models.Model):
 
     def getLocalReps(self, institution_name):
         """docstring for getLocalReps"""
-        from politici.models import OpInstitutionCharge
-
+        from politici.intervals import Bounds, intervals
+        from politici.models import OpInstitution, OpInstitutionCharge
+
+        # current charges are selected in the interval index
+        institutions = OpInstitution.objects.db_manager(DBNAME).filter(
+            name=institution_name
+        ).values_list('id', flat=True)
+        current = intervals.get(DBNAME).find(Bounds(current=True), location_ids=[self.id], institution_ids=institutions)
         charges = OpInstitutionCharge.objects.db_manager(DBNAME).filter(
-            institution__name=institution_name,
-            location__id=self.id,
-            date_end=None,
-            content__deleted_at=None,
-            ).order_by('charge_type__priority', 'politician__last_name')
+            pk__in=[c[2] for c in current],
+            ).select_related('politician', 'charge_type').order_by('charge_type__priority', 'politician__last_name')
         reps  = []
 
         for charge in charges:
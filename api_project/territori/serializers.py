@@ -1,4 +1,6 @@
 from rest_framework import serializers
+
+from api.serializers import FlatSerializer
 from territori.models import OpLocation
 
 __author__ = 'guglielmo'
@@ -13,3 +15,10 @@ class LocationSerializer(serializers.ModelSerializer):
             'macroregional_id', 'regional_id', 'provincial_id', 'city_id',
             'prov'
         )
+
+
+class LocationTypeFlatSerializer(FlatSerializer):
+    fields = (
+        ('id', 'id'),
+        ('name', 'name'),
+    )
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic locations: a hierarchy of regions, provinces and cities,
+with istat and Ministero dell'Interno codes and gps coordinates,
+generated from a seed, to test and benchmark the API on a local
+database (the tables of the unmanaged models must exist).
+"""
+import itertools
+import random
+import string
+
+from territori.models import OpLocation, OpLocationType
+
+__author__ = 'guglielmo'
+
+
+LOCATION_TYPES = (
+    (OpLocation.REGION_TYPE_ID, 'Regione'),
+    (OpLocation.PROVINCE_TYPE_ID, 'Provincia'),
+    (OpLocation.CITY_TYPE_ID, 'Comune'),
+)
+
+
+def province_acronym(n):
+    """Two letters acronym of the n-th province (AA, AB, ...)"""
+    return string.ascii_uppercase[n // 26 % 26] + string.ascii_uppercase[n % 26]
+
+
+def build_locations(using, regions=2, provinces=2, cities=5, seed=1, batch_size=500):
+    """
+    Create the location types and ``regions`` regions,
+    with ``provinces`` provinces each, with ``cities`` cities each.
+
+    Return the ids of the cities.
+    """
+    rnd = random.Random(seed)
+    OpLocationType.objects.using(using).bulk_create([
+        OpLocationType(id=type_id, name=name) for type_id, name in LOCATION_TYPES
+    ])
+
+    ids = itertools.count(1)
+    locations = []
+    city_ids = []
+    province_n = 0
+    for r in range(1, regions + 1):
+        locations.append(OpLocation(
+            id=next(ids), location_type_id=OpLocation.REGION_TYPE_ID,
+            name=u'Regione {0}'.format(r), regional_id=r, minint_regional_code=r,
+        ))
+        for p in range(provinces):
+            province_n += 1
+            prov = province_acronym(province_n - 1)
+            locations.append(OpLocation(
+                id=next(ids), location_type_id=OpLocation.PROVINCE_TYPE_ID,
+                name=u'Provincia {0}'.format(prov), regional_id=r, provincial_id=province_n, prov=prov,
+                minint_regional_code=r, minint_provincial_code=province_n,
+            ))
+            # cities are scattered around the chief town of the province
+            lat, lon = rnd.uniform(37.0, 46.5), rnd.uniform(7.0, 18.0)
+            for c in range(1, cities + 1):
+                city_ids.append(next(ids))
+                locations.append(OpLocation(
+                    id=city_ids[-1], location_type_id=OpLocation.CITY_TYPE_ID,
+                    name=u'Comune {0} {1}'.format(prov, c), regional_id=r, provincial_id=province_n,
+                    city_id=province_n * 1000 + c, prov=prov, inhabitants=int(rnd.paretovariate(1.2) * 1000),
+                    minint_regional_code=r, minint_provincial_code=province_n, minint_city_code=c,
+                    gps_lat=round(lat + rnd.uniform(-0.3, 0.3), 6), gps_lon=round(lon + rnd.uniform(-0.3, 0.3), 6),
+                ))
+        if len(locations) >= batch_size:
+            OpLocation.objects.using(using).bulk_create(locations, batch_size)
+            del locations[:]
+    OpLocation.objects.using(using).bulk_create(locations, batch_size)
+    return city_ids
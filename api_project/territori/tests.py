@@ -5,7 +5,14 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from api.cache import response_cache
+from api.testing import ApiTestCase, Budget, QueryBudgetMixin
+from politici.synthetic import build_politici
+from territori.synthetic import build_locations
 
 
 class SimpleTest(TestCase):
@@ -14,3 +21,71 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class TerritoriQueryBudgetTest(QueryBudgetMixin, ApiTestCase):
+    """
+    Queries and time of each URL, at page sizes 25 and 1000.
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+    urls_module = 'territori.urls'
+    namespace = 'territori'
+    budgets = {
+        'api-root': Budget(queries=0),
+        'location-list': Budget(queries=2, seconds=1.0),
+        'location-resolve': Budget(queries=0, method='post', data={
+            'codes': [['id', 1], ['city_id', 1001], ['prov', 'AB'], ['minint_id', '010010001']]
+        }),
+        'location-nearest': Budget(queries=0, params={'lat': 42.0, 'lon': 12.5, 'k': 20}),
+        'location-detail': Budget(queries=1, kwargs={'pk': 3}),
+        'locationtype-list': Budget(queries=2),
+    }
+
+    def build_data(self):
+        build_locations('politici', regions=20, provinces=5, cities=20)
+
+
+@override_settings(RESPONSE_CACHE={'BACKEND': 'api.cache.LRUBackend', 'TIMEOUT': 60})
+class ResponseCacheTest(ApiTestCase):
+    """
+    Responses of the territori and politici views are cached
+    in their own namespaces, with their own watermarks;
+    streamed responses are cached when served.
+    """
+    unmanaged_apps = {'politici': ('territori', 'politici')}
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        response_cache.clear()
+
+    def build_data(self):
+        build_locations('politici', regions=1, provinces=2, cities=5)
+        build_politici('politici', politicians=10)
+
+    def test_alternate_namespaces(self):
+        urls = [reverse('politici:politician-list'), reverse('territori:location-list')]
+        for url in urls:
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json')['X-Cache'], 'MISS')
+
+        invalidations = response_cache.stats['invalidations']
+        for n in range(3):
+            for url in urls:
+                self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json')['X-Cache'], 'HIT', url)
+        self.assertEqual(response_cache.stats['invalidations'], invalidations)
+
+    @override_settings(STREAMING_RENDER_MIN_ITEMS=5)
+    def test_head_then_get(self):
+        url = reverse('territori:location-list')
+        response = self.client.head(url, HTTP_ACCEPT='application/json')
+        self.assertTrue(response.streaming)
+        # the content of HEAD responses is dropped, the response is closed
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        self.assertEqual(response_cache._flights, {})
+
+        waits = response_cache.stats['waits']
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(response_cache.stats['waits'], waits)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json')['X-Cache'], 'HIT')
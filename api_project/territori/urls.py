@@ -1,12 +1,14 @@
 from django.conf.urls import patterns, url, include
 from rest_framework.urlpatterns import format_suffix_patterns
-from territori.views import LocationList, LocationTypeList, LocationDetail, TerritoriView
+from territori.views import LocationList, LocationTypeList, LocationDetail, LocationResolve, LocationNearest, TerritoriView
 
 __author__ = 'guglielmo'
 
 urlpatterns = patterns('territori.views',
    url(r'^$', TerritoriView.as_view(), name='api-root'),
    url(r'^locations$', LocationList.as_view(), name='location-list'),
+   url(r'^locations/resolve$', LocationResolve.as_view(), name='location-resolve'),
+   url(r'^locations/nearest$', LocationNearest.as_view(), name='location-nearest'),
    url(r'^locations/(?P<pk>\d+)$', LocationDetail.as_view(), name='location-detail'),
    url(r'^locationtypes$', LocationTypeList.as_view(), name='locationtype-list'),
 )
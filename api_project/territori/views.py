@@ -2,12 +2,37 @@ from django.conf import settings
 from django.utils.datastructures import SortedDict
 from rest_framework import generics
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
+from api.mixins import StreamingRenderMixin
 from politici.views import PoliticiDBSelectMixin
+from territori.gazetteer import get_gazetteer, locations
 from territori.models import OpLocation, OpLocationType
-from territori.serializers import LocationSerializer
+from territori.serializers import LocationSerializer, LocationTypeFlatSerializer
+
+
+class TerritoriDBSelectMixin(PoliticiDBSelectMixin):
+    """
+    Locations are not contents: responses are cached
+    until the ``op_location`` watermark changes, in their own namespace,
+    so that they do not drop the responses of the politici views
+    """
+
+    def get_response_cache_namespace(self):
+        return 'territori'
+
+    def get_response_cache_watermark(self):
+        return locations.get('politici')
+
+    def get_last_modified(self, watermark):
+        # the watermark is a (count, last charge update) couple,
+        # removed locations change the count only
+        return None
+
+    def get_cache_max_age(self):
+        return getattr(settings, 'TERRITORI_MAX_AGE', 86400)
 
 
 class TerritoriView(APIView):
@@ -15,18 +40,22 @@ class TerritoriView(APIView):
     List of available resources' endpoints for the ``territori`` section of the API
 
     * ``locations`` - list of locations
+    * ``locations/resolve`` - resolution of batches of location codes (POST)
+    * ``locations/nearest`` - cities nearest to a point, or in a bounding box
     * ``locationtypes`` - list of location types, as used in the openpolis original DB
     """
     def get(self, request, **kwargs):
         format = kwargs.get('format', None)
         data = SortedDict([
             ('locations', reverse('territori:location-list', request=request, format=format)),
+            ('locations resolve', reverse('territori:location-resolve', request=request, format=format)),
+            ('locations nearest', reverse('territori:location-nearest', request=request, format=format)),
             ('locationtypes', reverse('territori:locationtype-list', request=request, format=format)),
         ])
         return Response(data)
 
 
-class LocationList(PoliticiDBSelectMixin, generics.ListAPIView):
+class LocationList(StreamingRenderMixin, TerritoriDBSelectMixin, generics.ListAPIView):
     """
     Represents the list of locations
 
@@ -123,18 +152,154 @@ class LocationList(PoliticiDBSelectMixin, generics.ListAPIView):
 
         return queryset
 
-class LocationDetail(PoliticiDBSelectMixin, generics.RetrieveAPIView):
+class LocationResolve(APIView):
+    """
+    Resolves batches of location codes into openpolis locations,
+    with their province and region.
+
+    Codes are **POST**-ed as a json object, with a ``codes`` list
+    of ``[scheme, code]`` pairs (or ``{"scheme": ..., "code": ...}`` objects),
+    where scheme is one of:
+
+    * ``id``            - openpolis id
+    * ``regional_id``   - istat code of a region
+    * ``provincial_id`` - istat code of a province
+    * ``city_id``       - istat code of a city
+    * ``minint_id``     - Ministero dell'Interno code of a city, as a 9 characters string
+                          (2 regional, 3 provincial and 4 city digits)
+    * ``prov``          - acronym of a province (RM, MI, ...)
+
+    Results are in the same order as the codes;
+    the location is null for codes that could not be resolved.
+
+    Codes are resolved in memory, with no queries, up to
+    ``LOCATION_RESOLVE_MAX_CODES`` (50000) codes per request.
+
+    Example usage::
+
+        >> r = requests.post('http://api.openpolis.it/territori/locations/resolve',
+               data=json.dumps({'codes': [['city_id', 58091], ['minint_id', '120910650']]}),
+               headers={'content-type': 'application/json'})
+        >> res = r.json()
+        >> print res['results'][0]['location']['id']
+        5132
+
+    """
+    # resolution is read-only, POST is only used to send large batches
+    permission_classes = ()
+
+    def post(self, request, **kwargs):
+        codes = request.DATA.get('codes') if hasattr(request.DATA, 'get') else None
+        if not isinstance(codes, list):
+            raise ParseError("a list of [scheme, code] pairs is expected in 'codes'")
+        max_codes = getattr(settings, 'LOCATION_RESOLVE_MAX_CODES', 50000)
+        if len(codes) > max_codes:
+            raise ParseError("at most {0} codes can be resolved per request".format(max_codes))
+
+        gazetteer = get_gazetteer('politici')
+        results = []
+        not_found = 0
+        for item in codes:
+            try:
+                if isinstance(item, dict):
+                    scheme, code = item['scheme'], item['code']
+                else:
+                    scheme, code = item
+                n = gazetteer.index_of(scheme, code)
+            except (TypeError, ValueError, AttributeError, KeyError), e:
+                raise ParseError("wrong code {0}: {1}".format(item, e))
+            if n is None:
+                not_found += 1
+            results.append({
+                'scheme': scheme,
+                'code': code,
+                'location': gazetteer.hierarchy(n) if n is not None else None,
+            })
+
+        return Response(SortedDict([
+            ('count', len(results)),
+            ('not_found', not_found),
+            ('results', results),
+        ]))
+
+
+class LocationNearest(APIView):
+    """
+    Cities nearest to a point, or inside a bounding box,
+    found through an in-memory spatial index of their gps coordinates.
+
+    Accepts these parameters through the following **GET** querystring parameters:
+
+    * ``lat``, ``lon`` - coordinates of the point
+    * ``k``            - max number of cities (10 by default)
+    * ``radius``       - max distance from the point, in km
+    * ``bbox``         - ``min_lon,min_lat,max_lon,max_lat``, the bounding box,
+                         used instead of the point
+
+    Cities nearest to the point are sorted by distance (in km),
+    cities inside the bounding box by latitude.
+
+    Example usage::
+
+        The 5 cities nearest to Piazza Venezia, in Rome
+        >> r = requests.get('http://api.openpolis.it/territori/locations/nearest?lat=41.896&lon=12.482&k=5')
+        >> res = r.json()
+        >> print res['results'][0]['name']
+        Roma
+
+    """
+    def get(self, request, **kwargs):
+        params = request.QUERY_PARAMS
+        max_k = settings.REST_FRAMEWORK['MAX_PAGINATE_BY']
+        try:
+            k = int(params['k']) if 'k' in params else None
+            radius = float(params['radius']) if 'radius' in params else None
+            if 'bbox' in params:
+                min_lon, min_lat, max_lon, max_lat = [float(c) for c in params['bbox'].split(',')]
+            else:
+                lat, lon = float(params['lat']), float(params['lon'])
+        except (KeyError, ValueError):
+            raise ParseError("lat and lon, or a bbox (min_lon,min_lat,max_lon,max_lat) are required, "
+                             "k must be an integer and radius a number")
+        if k is not None and not 0 < k <= max_k:
+            raise ParseError("k must be between 1 and {0}".format(max_k))
+
+        gazetteer = get_gazetteer('politici')
+        results = []
+        if 'bbox' in params:
+            for n in gazetteer.geo_index.within(min_lat, min_lon, max_lat, max_lon)[:k or max_k]:
+                results.append(self.get_location_data(gazetteer, n))
+        else:
+            for d, n in gazetteer.geo_index.nearest(lat, lon, k or 10, radius):
+                results.append(self.get_location_data(gazetteer, n, d))
+
+        return Response(SortedDict([
+            ('count', len(results)),
+            ('results', results),
+        ]))
+
+    def get_location_data(self, gazetteer, n, distance=None):
+        data = SortedDict(gazetteer.hierarchy(n))
+        data['gps_lat'] = gazetteer.value(n, 'gps_lat')
+        data['gps_lon'] = gazetteer.value(n, 'gps_lon')
+        if distance is not None:
+            data['distance'] = round(distance, 3)
+        return data
+
+
+class LocationDetail(TerritoriDBSelectMixin, generics.RetrieveAPIView):
     """
     Represents a single location and show all gory details stored in the DB
     """
     model = OpLocation
 
-class LocationTypeList(PoliticiDBSelectMixin, generics.ListAPIView):
+class LocationTypeList(TerritoriDBSelectMixin, generics.ListAPIView):
     """
     Represents the list of location types.
 
     May be useful for reference when integrating location data into other datasets.
     """
     model = OpLocationType
+    serializer_class = LocationTypeFlatSerializer
     paginate_by = 25
     max_paginate_by = 100